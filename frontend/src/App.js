@@ -1,9 +1,29 @@
 import React, { useState, useRef } from "react";
 import ReactMarkdown from "react-markdown";
 
+// Define your Django backend base URL
+// Use a variable for this so it's easy to change for production or different dev setups
+const DJANGO_BASE_URL = "http://localhost:8000";
+
+// PDFs are rendered in the background - poll the job until it finishes
+async function waitForPdf(statusUrl, attempts = 60, intervalMs = 1000) {
+  for (let i = 0; i < attempts; i++) {
+    const response = await fetch(`${DJANGO_BASE_URL}${statusUrl}`);
+    if (response.ok) {
+      const job = await response.json();
+      if (job.status === "success" || job.status === "error") {
+        return job;
+      }
+    }
+    await new Promise((resolve) => setTimeout(resolve, intervalMs));
+  }
+  return { status: "error", message: "Timed out waiting for the PDF." };
+}
+
 function App() {
   const [input, setInput] = useState("");
   const [files, setFiles] = useState([]);
+  const [conversationId, setConversationId] = useState(null); // Server-side session, holds the report between turns
 
   const [chatLog, setChatLog] = useState([{
     user: "gpt",
@@ -19,6 +39,7 @@ function App() {
       message: "Welcome to Kosh Feedback Agent! Upload your report and I'll give you some feedback."
     }]);
     setFiles([]);
+    setConversationId(null);
     if (fileInputRef.current) {
       fileInputRef.current.value = null;
     }
@@ -37,6 +58,9 @@ function App() {
     // Set up form data
     const formData = new FormData();
     formData.append("message", input);
+    if (conversationId) {
+      formData.append("conversation_id", conversationId);
+    }
 
     // Append each file to formData
     for (let i = 0; i < files.length; i++) {
@@ -60,6 +84,9 @@ function App() {
       }
 
       const data = await response.json();
+      if (data.conversation_id) {
+        setConversationId(data.conversation_id);
+      }
 
       let gptMessage = { user: "gpt", message: data.response };
 
@@ -71,10 +98,21 @@ function App() {
         gptMessage.message += "\n\n(A session summary PDF has been generated.)";
       } else if (data.pdf_info && data.pdf_info.status === "error") {
           gptMessage.message += `\n\n(PDF generation failed: ${data.pdf_info.message})`;
+      } else if (data.pdf_info && data.pdf_info.status_url) {
+        gptMessage.message += "\n\n(Your session summary PDF is being generated...)";
       }
 
       setChatLog((chatLog) => [...chatLog, gptMessage]);
 
+      // Queued PDF - let the user know once it's ready
+      if (data.pdf_info && data.pdf_info.status_url && data.pdf_info.status !== "success" && data.pdf_info.status !== "error") {
+        const job = await waitForPdf(data.pdf_info.status_url);
+        const pdfMessage = job.status === "success"
+          ? { user: "gpt", message: "Your session summary PDF is ready.", pdfUrl: job.url, pdfFilename: job.filename || "summary.pdf" }
+          : { user: "gpt", message: `(PDF generation failed: ${job.message})` };
+        setChatLog((chatLog) => [...chatLog, pdfMessage]);
+      }
+
     } catch (error) {
       console.error("Error fetching data:", error);
       setChatLog((chatLog) => [
@@ -84,10 +122,6 @@ function App() {
     }
   }
   const ChatMessageGPT = ({ message }) => {
-    // Define your Django backend base URL
-    // Use a variable for this so it's easy to change for production or different dev setups
-    const DJANGO_BASE_URL = "http://localhost:8000"; 
-  
     // Construct the absolute URL for the PDF
     const absolutePdfUrl = message.pdfUrl ? `${DJANGO_BASE_URL}${message.pdfUrl}` : null;
   
@@ -0,0 +1,8 @@
+"""
+Offline benchmarks for the agent's hot paths.
+
+fakes provides deterministic stand-ins for ChatOpenAI and OpenAIEmbeddings,
+corpus generates synthetic research PDFs and report uploads, and runner measures
+ingestion, retrieval and the query endpoints with them. Run everything with
+`python manage.py benchmark`; no OpenAI account or network access is needed.
+"""
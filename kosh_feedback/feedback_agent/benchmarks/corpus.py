@@ -0,0 +1,79 @@
+"""
+Synthetic PDFs for benchmarks: a research corpus for RAG_data and report uploads.
+
+Text is generated from a fixed vocabulary of psychometric terms with a seeded
+random generator, so a given seed always produces the same files.
+"""
+import io
+import os
+import random
+
+from django.core.files.uploadedfile import SimpleUploadedFile
+from reportlab.lib.pagesizes import letter
+from reportlab.pdfgen import canvas
+
+TOPICS = [
+    "emotional intelligence", "resilience", "conscientiousness", "openness to experience",
+    "agreeableness", "extraversion", "neuroticism", "team effectiveness", "leadership development",
+    "situational judgement", "cognitive ability", "coping strategies", "self-awareness",
+    "stress management", "decision making", "interpersonal skills", "adaptability", "motivation",
+]
+VERBS = ["predicts", "supports", "is linked to", "moderates", "strengthens", "is measured alongside", "shapes"]
+OBJECTS = [
+    "job performance", "wellbeing at work", "team cohesion", "career progression", "learning agility",
+    "conflict resolution", "feedback seeking", "goal attainment", "retention", "peer ratings",
+]
+QUALIFIERS = [
+    "in longitudinal studies", "across cultures", "for early-career employees", "in high-pressure roles",
+    "according to meta-analytic evidence", "when coaching is provided", "in cross-functional teams",
+]
+
+LINES_PER_PAGE = 45
+CHARS_PER_LINE = 95
+
+
+def sentence(rng):
+    return f"{rng.choice(TOPICS).capitalize()} {rng.choice(VERBS)} {rng.choice(OBJECTS)} {rng.choice(QUALIFIERS)}."
+
+def page_lines(rng):
+    """About one page of wrapped text."""
+    lines, line = [], ""
+    while len(lines) < LINES_PER_PAGE:
+        next_sentence = sentence(rng)
+        if len(line) + len(next_sentence) + 1 > CHARS_PER_LINE:
+            lines.append(line)
+            line = next_sentence
+        else:
+            line = f"{line} {next_sentence}".strip()
+    return lines
+
+def synthetic_pdf(pages, seed, title="Synthetic Research Paper"):
+    """The bytes of a text PDF with the given number of pages."""
+    rng = random.Random(seed)
+    buffer = io.BytesIO()
+    pdf = canvas.Canvas(buffer, pagesize=letter)
+    width, height = letter
+    for page in range(pages):
+        text = pdf.beginText(50, height - 50)
+        text.setFont("Helvetica", 9)
+        text.textLine(f"{title} - page {page + 1}")
+        for line in page_lines(rng):
+            text.textLine(line)
+        pdf.drawText(text)
+        pdf.showPage()
+    pdf.save()
+    return buffer.getvalue()
+
+def generate_corpus(directory, files=20, pages_per_file=10, seed=0):
+    """Write a corpus of synthetic PDFs to directory. Returns the total number of pages."""
+    os.makedirs(directory, exist_ok=True)
+    for i in range(files):
+        data = synthetic_pdf(pages_per_file, seed * 100_003 + i, title=f"Synthetic Research Paper {i + 1}")
+        with open(os.path.join(directory, f"synthetic-{i:04d}.pdf"), "wb") as f:
+            f.write(data)
+    return files * pages_per_file
+
+def synthetic_upload(pages=4, seed=0):
+    """A report upload as the views receive it."""
+    data = synthetic_pdf(pages, seed, title="Psychometric Assessment Report")
+    return SimpleUploadedFile(f"report-{seed}.pdf", data, content_type="application/pdf")
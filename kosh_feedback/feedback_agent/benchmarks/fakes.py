@@ -0,0 +1,113 @@
+"""
+Deterministic local stand-ins for the OpenAI chat and embedding models.
+
+FakeEmbeddings turns each text into a unit vector seeded by its hash, so the same
+text always gets the same vector. FakeChatModel follows a fixed script: with
+tools bound, it first calls retriever_tool (tool_rounds times) and then answers;
+without tools (e.g. when summarising history) it answers straight away. Both
+can sleep to simulate API latency.
+"""
+import hashlib
+import json
+import time
+from typing import Any
+
+import numpy as np
+from langchain_core.embeddings import Embeddings
+from langchain_core.language_models.chat_models import BaseChatModel
+from langchain_core.messages import AIMessage, AIMessageChunk, HumanMessage, ToolMessage
+from langchain_core.outputs import ChatGeneration, ChatGenerationChunk, ChatResult
+
+ANSWER_WORDS = (
+    "Based on your report, your strengths in emotional awareness and resilience stand out. "
+    "Consider building on them by seeking roles with clear feedback loops, and work on "
+    "delegation as a next step in your development plan."
+).split()
+
+
+class FakeEmbeddings(Embeddings):
+
+    def __init__(self, dimensions=1536, latency_ms=0.0, per_text_latency_ms=0.0):
+        self.dimensions = dimensions
+        self.latency_ms = latency_ms
+        self.per_text_latency_ms = per_text_latency_ms
+        self.calls = 0
+        self.texts = 0
+
+    def _vector(self, text):
+        seed = int.from_bytes(hashlib.sha256(text.encode("utf-8")).digest()[:8], "little")
+        vector = np.random.default_rng(seed).standard_normal(self.dimensions, dtype=np.float32)
+        return (vector / np.linalg.norm(vector)).tolist()
+
+    def _sleep(self, count):
+        delay = self.latency_ms + self.per_text_latency_ms * count
+        if delay:
+            time.sleep(delay / 1000)
+
+    def embed_documents(self, texts):
+        self.calls += 1
+        self.texts += len(texts)
+        self._sleep(len(texts))
+        return [self._vector(text) for text in texts]
+
+    def embed_query(self, text):
+        return self.embed_documents([text])[0]
+
+
+class FakeChatModel(BaseChatModel):
+    """Scripted chat model. Latencies are in milliseconds."""
+
+    tool_rounds: int = 1
+    queries_per_call: int = 2
+    first_token_ms: float = 0.0
+    per_token_ms: float = 0.0
+    tools_bound: bool = False
+    calls: int = 0
+
+    @property
+    def _llm_type(self):
+        return "fake-chat"
+
+    def bind_tools(self, tools, tool_choice=None, **kwargs):
+        return self.model_copy(update={"tools_bound": tool_choice != "none"})
+
+    def _next_message(self, messages):
+        self.calls += 1
+        rounds_done = sum(1 for m in messages if isinstance(m, ToolMessage))
+        question = next((m.content for m in reversed(messages) if isinstance(m, HumanMessage)), "")
+        if self.tools_bound and rounds_done < self.tool_rounds:
+            queries = [f"{question} (aspect {i + 1})" for i in range(self.queries_per_call)]
+            return AIMessage(content="", tool_calls=[{
+                "name": "retriever_tool",
+                "args": {"queries": queries},
+                "id": f"call_{self.calls}_{rounds_done}",
+            }])
+        return AIMessage(content=" ".join(ANSWER_WORDS))
+
+    def _usage(self, messages, message):
+        input_tokens = sum(len(str(m.content)) // 4 + 1 for m in messages)
+        output_tokens = len(str(message.content)) // 4 + 1
+        return {"input_tokens": input_tokens, "output_tokens": output_tokens, "total_tokens": input_tokens + output_tokens}
+
+    def _generate(self, messages, stop=None, run_manager=None, **kwargs: Any):
+        message = self._next_message(messages)
+        time.sleep((self.first_token_ms + self.per_token_ms * len(str(message.content).split())) / 1000)
+        message.usage_metadata = self._usage(messages, message)
+        return ChatResult(generations=[ChatGeneration(message=message)])
+
+    def _stream(self, messages, stop=None, run_manager=None, **kwargs: Any):
+        message = self._next_message(messages)
+        time.sleep(self.first_token_ms / 1000)
+        if message.tool_calls:
+            yield ChatGenerationChunk(message=AIMessageChunk(content="", tool_call_chunks=[
+                {"name": call["name"], "args": json.dumps(call["args"]), "id": call["id"], "index": i}
+                for i, call in enumerate(message.tool_calls)
+            ]))
+            return
+        for word in str(message.content).split():
+            if self.per_token_ms:
+                time.sleep(self.per_token_ms / 1000)
+            chunk = ChatGenerationChunk(message=AIMessageChunk(content=word + " "))
+            if run_manager:
+                run_manager.on_llm_new_token(word + " ", chunk=chunk)
+            yield chunk
@@ -0,0 +1,275 @@
+"""
+Benchmarks of ingestion, retrieval and the query endpoints, run against the
+offline fakes in a scratch directory and a scratch database.
+
+Each benchmark returns a JSON-serialisable dict. Latencies are summarised as
+p50/p95/p99 in milliseconds; memory is this process's resident set size, plus
+the ingestion pool's worker processes.
+"""
+import asyncio
+import json
+import os
+import resource
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import contextmanager
+
+import numpy as np
+from django.conf import settings
+from django.test import AsyncClient, Client
+from django.test.utils import override_settings
+
+from .. import resources, views
+from ..indexing import build_index
+from ..ingestion import pool_pids
+from ..retrieval import multi_query_search
+from .corpus import TOPICS, generate_corpus, synthetic_upload
+
+QUESTIONS = [
+    "What are my main strengths according to the report?",
+    "How can I manage stress better at work?",
+    "Which careers suit my personality profile?",
+    "What should I work on to become a better leader?",
+    "How do I compare on resilience and adaptability?",
+]
+
+
+#################### Measurement helpers ######################
+
+def summarize_latencies(samples_ms):
+    samples = np.asarray(samples_ms, dtype=np.float64)
+    if not len(samples):
+        return {"count": 0}
+    return {
+        "count": len(samples),
+        "mean_ms": round(float(samples.mean()), 2),
+        "p50_ms": round(float(np.percentile(samples, 50)), 2),
+        "p95_ms": round(float(np.percentile(samples, 95)), 2),
+        "p99_ms": round(float(np.percentile(samples, 99)), 2),
+        "max_ms": round(float(samples.max()), 2),
+    }
+
+def rss_mb(pid="self"):
+    """Resident set size of a process in MB, or None where /proc isn't available."""
+    try:
+        with open(f"/proc/{pid}/statm") as f:
+            return round(int(f.read().split()[1]) * os.sysconf("SC_PAGE_SIZE") / 2**20, 1)
+    except (OSError, ValueError):
+        return None
+
+def memory_usage():
+    """RSS of this process (current and peak) and of each ingestion pool worker, in MB."""
+    return {
+        "rss_mb": rss_mb(),
+        "peak_rss_mb": round(resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024, 1), # ru_maxrss is KB on Linux
+        "pool_workers_rss_mb": [rss_mb(pid) for pid in pool_pids()],
+    }
+
+@contextmanager
+def offline_models(chat, embeddings):
+    """Swap the fakes into the resource registry, restoring the real clients afterwards."""
+    saved = (resources._llm, resources._embeddings, resources._indexing_embeddings,
+             resources._vectorstore, resources._vectorstore_version)
+    resources._llm, resources._embeddings, resources._indexing_embeddings = chat, embeddings, embeddings
+    resources._vectorstore = resources._vectorstore_version = None
+    resources.invalidate_vectorstore()
+    views.get_tool_llm.cache_clear()
+    views.get_final_answer_llm.cache_clear()
+    try:
+        yield
+    finally:
+        (resources._llm, resources._embeddings, resources._indexing_embeddings,
+         resources._vectorstore, resources._vectorstore_version) = saved
+        resources.invalidate_vectorstore()
+        views.get_tool_llm.cache_clear()
+        views.get_final_answer_llm.cache_clear()
+
+@contextmanager
+def scratch_settings(workdir):
+    """
+    Point the corpus, index and generated PDFs at workdir. The background audit
+    writer and retention cleanup stay off: their thread outlives the scratch
+    database and would otherwise write to (and purge) the real one.
+    """
+    with override_settings(
+        RAG_DATA_DIR=os.path.join(workdir, "RAG_data"),
+        VECTORSTORE_DIR=os.path.join(workdir, "vectorstores", "bench_index"),
+        MEDIA_ROOT=os.path.join(workdir, "media"),
+        ALLOWED_HOSTS=["testserver"],
+        PERSISTENCE_ENABLED=False,
+        RETENTION_CLEANUP_INTERVAL_SECONDS=0,
+    ):
+        yield
+
+
+#################### Benchmarks ######################
+
+def bench_ingestion(embeddings, files, pages_per_file, seed=0):
+    """Generate a corpus into RAG_DATA_DIR and index it from scratch."""
+    started = time.perf_counter()
+    pages = generate_corpus(settings.RAG_DATA_DIR, files, pages_per_file, seed)
+    generated = time.perf_counter()
+    stats = build_index(settings.RAG_DATA_DIR, settings.VECTORSTORE_DIR, embeddings, incremental=False)
+    indexed = time.perf_counter()
+    resources.invalidate_vectorstore()
+
+    seconds = indexed - generated
+    return {
+        "files": files,
+        "pages": pages,
+        "chunks": stats["chunks_total"],
+        "corpus_generation_s": round(generated - started, 2),
+        "index_s": round(seconds, 2),
+        "chunks_per_sec": round(stats["chunks_total"] / seconds, 1) if seconds else None,
+        "pages_per_sec": round(pages / seconds, 1) if seconds else None,
+        "parse_per_file": summarize_latencies([t["parse_ms"] for t in stats["timings"]]),
+        "memory": memory_usage(),
+    }
+
+def bench_retrieval(searches, queries_per_search=2, seed=0):
+    """Time retriever searches one after another against the loaded index."""
+    store = resources.get_vectorstore()
+    rng = np.random.default_rng(seed)
+    latencies = []
+    started = time.perf_counter()
+    for i in range(searches):
+        queries = [f"{TOPICS[j]} at work {i}" for j in rng.choice(len(TOPICS), queries_per_search, replace=False)]
+        search_started = time.perf_counter()
+        multi_query_search(store, queries)
+        latencies.append((time.perf_counter() - search_started) * 1000)
+    elapsed = time.perf_counter() - started
+    return {
+        "searches": searches,
+        "queries_per_search": queries_per_search,
+        "latency": summarize_latencies(latencies),
+        "searches_per_sec": round(searches / elapsed, 1) if elapsed else None,
+    }
+
+def run_conversation(client_id, turns, report_pages):
+    """One client: upload a report with the first question, then follow up. Returns (latencies, errors)."""
+    client = Client()
+    conversation_id = None
+    latencies, errors = [], 0
+    for turn in range(turns):
+        data = {"message": QUESTIONS[(client_id + turn) % len(QUESTIONS)] + f" (client {client_id}, turn {turn})"}
+        if conversation_id:
+            data["conversation_id"] = conversation_id
+        else:
+            data["files"] = synthetic_upload(report_pages, seed=client_id)
+        started = time.perf_counter()
+        response = client.post("/api/query_chatgpt/", data)
+        latencies.append((time.perf_counter() - started) * 1000)
+        if response.status_code != 200:
+            errors += 1
+            continue
+        conversation_id = response.json().get("conversation_id")
+    return latencies, errors
+
+def bench_queries(clients, turns, report_pages=4):
+    """Concurrent clients holding conversations with query_chatgpt."""
+    started = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=clients) as pool:
+        results = list(pool.map(lambda i: run_conversation(i, turns, report_pages), range(clients)))
+    elapsed = time.perf_counter() - started
+
+    latencies = [ms for client_latencies, _ in results for ms in client_latencies]
+    errors = sum(client_errors for _, client_errors in results)
+    return {
+        "clients": clients,
+        "turns_per_client": turns,
+        "requests": len(latencies),
+        "errors": errors,
+        "latency": summarize_latencies(latencies),
+        "requests_per_sec": round((len(latencies) - errors) / elapsed, 2) if elapsed else None,
+        "memory": memory_usage(),
+    }
+
+async def stream_once(client, client_id, report_pages):
+    """One streamed first turn. Returns (total ms, time to first token ms or None, ok)."""
+    started = time.perf_counter()
+    first_token_ms = None
+    ok = False
+    response = await client.post("/api/query_chatgpt/stream/", {
+        "message": QUESTIONS[client_id % len(QUESTIONS)] + f" (stream client {client_id})",
+        "files": synthetic_upload(report_pages, seed=client_id),
+    })
+    async for part in response.streaming_content:
+        text = part.decode() if isinstance(part, bytes) else part
+        if first_token_ms is None and text.startswith("event: token"):
+            first_token_ms = (time.perf_counter() - started) * 1000
+        if text.startswith("event: done"):
+            ok = True
+    return (time.perf_counter() - started) * 1000, first_token_ms, ok
+
+def bench_stream(clients, report_pages=4):
+    """Concurrent first turns against the streaming endpoint, measuring time to first token."""
+    async def run_all():
+        client = AsyncClient()
+        return await asyncio.gather(*(stream_once(client, i, report_pages) for i in range(clients)))
+
+    started = time.perf_counter()
+    results = asyncio.run(run_all())
+    elapsed = time.perf_counter() - started
+    return {
+        "clients": clients,
+        "errors": sum(1 for _, _, ok in results if not ok),
+        "latency": summarize_latencies([total for total, _, _ in results]),
+        "time_to_first_token": summarize_latencies([ttft for _, ttft, _ in results if ttft is not None]),
+        "requests_per_sec": round(len(results) / elapsed, 2) if elapsed else None,
+    }
+
+
+#################### Regression check ######################
+
+def find_regressions(report, baseline, max_regression):
+    """
+    Compare every p95 latency in report with the same figure in baseline.
+    Returns a description of each that got slower by more than max_regression (a fraction).
+    """
+    regressions = []
+
+    def walk(current, previous, path):
+        for key, value in current.items():
+            if key not in previous:
+                continue
+            if isinstance(value, dict) and isinstance(previous[key], dict):
+                walk(value, previous[key], f"{path}{key}.")
+            elif key == "p95_ms" and previous[key] and value > previous[key] * (1 + max_regression):
+                regressions.append(f"{path}{key}: {previous[key]} -> {value}")
+
+    walk(report, baseline, "")
+    return regressions
+
+def load_report(path):
+    with open(path, "r", encoding="utf-8") as f:
+        return json.load(f)
+
+
+#################### Entry point ######################
+
+_run_lock = threading.Lock()
+
+def run_benchmarks(workdir, chat, embeddings, files=20, pages_per_file=10, searches=200,
+                   clients=8, turns=3, report_pages=4, stream_clients=8, seed=0):
+    """Run every benchmark in order and return the combined report."""
+    with _run_lock, scratch_settings(workdir), offline_models(chat, embeddings):
+        report = {"config": {
+            "files": files, "pages_per_file": pages_per_file, "searches": searches, "clients": clients,
+            "turns": turns, "report_pages": report_pages, "stream_clients": stream_clients,
+            "embedding_dimensions": embeddings.dimensions,
+            "chat_first_token_ms": chat.first_token_ms, "chat_per_token_ms": chat.per_token_ms,
+            "embedding_latency_ms": embeddings.latency_ms,
+        }}
+        print(f"Ingesting {files} synthetic PDFs of {pages_per_file} pages...")
+        report["ingestion"] = bench_ingestion(embeddings, files, pages_per_file, seed)
+        print(f"Running {searches} retrieval searches...")
+        report["retrieval"] = bench_retrieval(searches, seed=seed)
+        if clients:
+            print(f"Running {clients} concurrent clients x {turns} turns against query_chatgpt...")
+            report["query"] = bench_queries(clients, turns, report_pages)
+        if stream_clients:
+            print(f"Running {stream_clients} concurrent streamed turns...")
+            report["stream"] = bench_stream(stream_clients, report_pages)
+        report["memory"] = memory_usage()
+        return report
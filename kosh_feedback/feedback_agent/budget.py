@@ -0,0 +1,116 @@
+"""
+Per-request execution budgets for the agent loop.
+
+Each turn gets an ExecutionBudget, passed to the graph nodes through the run's
+config. It limits LLM steps (AGENT_MAX_STEPS), tokens (AGENT_MAX_TOKENS), tool
+calls (AGENT_MAX_TOOL_CALLS) and wall-clock time (AGENT_DEADLINE_SECONDS).
+When a limit is reached, llm_call makes one last call with tools disabled, so
+the client still gets an answer built from whatever was gathered so far.
+
+cancel() (used when a streaming client disconnects) stops the run at the next
+node, and stops tool_agent from waiting on its tool calls.
+"""
+import threading
+import time
+
+from django.conf import settings
+
+# How often a waiting tool_agent checks whether the run was cancelled
+CANCEL_POLL_SECONDS = 0.25
+
+
+class RunCancelled(Exception):
+    """The client went away; stop working on this turn."""
+
+
+class ExecutionBudget:
+
+    def __init__(self, max_steps, max_tokens, max_tool_calls, deadline_seconds, final_answer_reserve_seconds):
+        self.max_steps = max_steps
+        self.max_tokens = max_tokens
+        self.max_tool_calls = max_tool_calls
+        self.final_answer_reserve_seconds = final_answer_reserve_seconds
+        self.started = time.monotonic()
+        self.deadline = self.started + deadline_seconds
+        self.steps = 0
+        self.tokens = 0
+        self.tool_calls = 0
+        self.cancelled = False
+        self.exhausted_reason = None # Why the final answer was forced, if it was
+        self._lock = threading.Lock()
+
+    @classmethod
+    def from_settings(cls):
+        return cls(
+            settings.AGENT_MAX_STEPS,
+            settings.AGENT_MAX_TOKENS,
+            settings.AGENT_MAX_TOOL_CALLS,
+            settings.AGENT_DEADLINE_SECONDS,
+            settings.AGENT_FINAL_ANSWER_RESERVE_SECONDS,
+        )
+
+    def remaining_seconds(self):
+        return self.deadline - time.monotonic()
+
+    def tool_deadline(self):
+        """Tools must finish by this monotonic time, leaving room for the final answer."""
+        return self.deadline - self.final_answer_reserve_seconds
+
+    def must_answer(self):
+        """
+        The reason the next LLM step has to be the final answer, or None.
+        The last allowed step is always kept for that answer.
+        """
+        if self.steps + 1 >= self.max_steps:
+            return "steps"
+        if self.tokens >= self.max_tokens:
+            return "tokens"
+        if self.tool_calls >= self.max_tool_calls:
+            return "tool_calls"
+        if self.remaining_seconds() <= self.final_answer_reserve_seconds:
+            return "deadline"
+        return None
+
+    def charge_step(self, tokens):
+        with self._lock:
+            self.steps += 1
+            self.tokens += tokens
+
+    def take_tool_calls(self, requested):
+        """Reserve up to requested tool calls. Returns how many may run."""
+        with self._lock:
+            allowed = max(0, min(requested, self.max_tool_calls - self.tool_calls))
+            self.tool_calls += allowed
+            return allowed
+
+    def cancel(self):
+        self.cancelled = True
+
+    def check_cancelled(self):
+        if self.cancelled:
+            raise RunCancelled()
+
+    def summary(self):
+        return {
+            "steps": self.steps,
+            "tokens": self.tokens,
+            "tool_calls": self.tool_calls,
+            "elapsed_s": round(time.monotonic() - self.started, 2),
+            "exhausted": self.exhausted_reason,
+            "cancelled": self.cancelled,
+        }
+
+
+def run_config(budget):
+    """LangGraph config for a run under budget. recursion_limit is a backstop in case a node ignores it."""
+    return {"configurable": {"budget": budget}, "recursion_limit": 2 * budget.max_steps + 2}
+
+def budget_from(config):
+    """
+    The run's budget. A run started without one is refused rather than given a
+    fresh budget at every node, which would never run out.
+    """
+    budget = ((config or {}).get("configurable") or {}).get("budget")
+    if budget is None:
+        raise ValueError("The agent graph must be run with config=run_config(budget).")
+    return budget
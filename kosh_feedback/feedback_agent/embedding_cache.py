@@ -0,0 +1,336 @@
+"""
+Disk-backed cache for embedding vectors.
+
+Vectors live in a flat float32 file opened as a memmap, one row per cached
+text. A SQLite index, shared by every worker process, maps each key (a hash of
+model + text) to its row and keeps LRU order. A miss only appends its rows and
+index entries, in one short transaction; nothing is rewritten as the cache
+grows. The key digest of every row is stored in a parallel file and checked on
+read, so a row another process is reusing is treated as a miss rather than
+returning the wrong vector.
+
+Hits only note when each key was used. A background thread writes those LRU
+updates every EMBEDDING_CACHE_FLUSH_SECONDS, off the request path.
+
+CachedEmbeddings wraps any LangChain Embeddings (OpenAIEmbeddings in production,
+a local fake in tests) and only sends cache misses to it, in size-tuned batches
+with bounded concurrency.
+"""
+import atexit
+import hashlib
+import os
+import re
+import sqlite3
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+import numpy as np
+from django.conf import settings
+from langchain_core.embeddings import Embeddings
+from langchain_openai import OpenAIEmbeddings
+
+INDEX_FILENAME = "index.sqlite3"
+VECTORS_FILENAME = "vectors.f32"
+KEYS_FILENAME = "keys.u8"
+
+INITIAL_CAPACITY = 1024
+KEY_BYTES = 32
+SQL_BATCH_SIZE = 500 # Keys per IN (...) query, under SQLite's variable limit
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS meta (name TEXT PRIMARY KEY, value INTEGER NOT NULL);
+CREATE TABLE IF NOT EXISTS slots (key BLOB PRIMARY KEY, row INTEGER NOT NULL UNIQUE, last_used REAL NOT NULL);
+CREATE INDEX IF NOT EXISTS slots_last_used ON slots (last_used);
+"""
+
+
+def cache_key(model, text):
+    return hashlib.sha256(f"{model}\0{text}".encode("utf-8")).hexdigest()
+
+
+class EmbeddingStore:
+    """Fixed-width vector rows on disk with a shared LRU index. Thread and process safe."""
+
+    def __init__(self, directory, max_entries):
+        self.directory = directory
+        self.max_entries = max_entries
+        self._lock = threading.Lock()
+        self._touched = {} # key digest -> time it was last read, not yet written to the index
+        self._vectors = None
+        self._keys = None
+        self._dim = None
+
+        os.makedirs(directory, exist_ok=True)
+        try:
+            self._db = self._connect()
+        except sqlite3.DatabaseError as e:
+            print(f"Embedding cache at {self.directory} is unreadable, starting empty: {e}")
+            for filename in (INDEX_FILENAME, VECTORS_FILENAME, KEYS_FILENAME):
+                if os.path.exists(self._path(filename)):
+                    os.remove(self._path(filename))
+            self._db = self._connect()
+
+    #################### Files ######################
+
+    def _path(self, filename):
+        return os.path.join(self.directory, filename)
+
+    def _connect(self):
+        db = sqlite3.connect(self._path(INDEX_FILENAME), timeout=30, isolation_level=None, check_same_thread=False)
+        db.execute("PRAGMA journal_mode=WAL")
+        db.execute("PRAGMA synchronous=NORMAL")
+        db.executescript(SCHEMA)
+        return db
+
+    def _meta(self, name):
+        row = self._db.execute("SELECT value FROM meta WHERE name = ?", (name,)).fetchone()
+        return row[0] if row else None
+
+    def _set_meta(self, name, value):
+        self._db.execute("INSERT OR REPLACE INTO meta (name, value) VALUES (?, ?)", (name, value))
+
+    def _map(self, rows_needed=0):
+        """(Re)open the memmaps if rows up to rows_needed aren't mapped yet; another process may have grown the files."""
+        if self._vectors is not None and len(self._vectors) >= rows_needed:
+            return True
+        if self._dim is None:
+            self._dim = self._meta("dim")
+            if self._dim is None:
+                return False
+        path = self._path(VECTORS_FILENAME)
+        rows = os.path.getsize(path) // (4 * self._dim) if os.path.exists(path) else 0
+        if rows == 0:
+            return False
+        self._vectors = np.memmap(self._path(VECTORS_FILENAME), dtype=np.float32, mode="r+", shape=(rows, self._dim))
+        self._keys = np.memmap(self._path(KEYS_FILENAME), dtype=np.uint8, mode="r+", shape=(rows, KEY_BYTES))
+        return len(self._vectors) >= rows_needed
+
+    def _grow(self, rows_needed):
+        """Extend both files in place (other processes keep their mappings) to hold rows_needed rows."""
+        if self._map(rows_needed):
+            return
+        current = len(self._vectors) if self._vectors is not None else 0
+        capacity = min(max(rows_needed, current * 2, INITIAL_CAPACITY), self.max_entries)
+        for filename, row_bytes in ((VECTORS_FILENAME, 4 * self._dim), (KEYS_FILENAME, KEY_BYTES)):
+            with open(self._path(filename), "ab") as f:
+                if f.tell() < capacity * row_bytes:
+                    f.truncate(capacity * row_bytes)
+        self._vectors = None
+        self._map(rows_needed)
+
+    def _write_touched(self):
+        if self._touched:
+            self._db.executemany(
+                "UPDATE slots SET last_used = MAX(last_used, ?) WHERE key = ?",
+                [(used, digest) for digest, used in self._touched.items()])
+            self._touched = {}
+
+    def flush(self):
+        """Write pending LRU updates to the index and the vectors to disk."""
+        with self._lock:
+            if self._touched:
+                self._db.execute("BEGIN IMMEDIATE")
+                try:
+                    self._write_touched()
+                finally:
+                    self._db.execute("COMMIT")
+            mapped = (self._vectors, self._keys)
+        # Syncing the memmaps can take a while at full size; lookups needn't wait for it
+        for array in mapped:
+            if array is not None:
+                array.flush()
+
+    #################### Lookups ######################
+
+    def _rows_for(self, digests):
+        """{digest: row} for the digests in the index."""
+        found = {}
+        for start in range(0, len(digests), SQL_BATCH_SIZE):
+            batch = digests[start:start + SQL_BATCH_SIZE]
+            found.update(self._db.execute(
+                f"SELECT key, row FROM slots WHERE key IN ({','.join('?' * len(batch))})", batch).fetchall())
+        return found
+
+    def get_many(self, keys):
+        """Return {key: vector} for every key that is cached."""
+        found = {}
+        digests = {bytes.fromhex(key): key for key in keys}
+        with self._lock:
+            rows = self._rows_for(list(digests))
+            if not rows or not self._map(max(rows.values()) + 1):
+                return found
+            now = time.time()
+            for digest, row in rows.items():
+                # Read the vector before checking its digest: a writer replaces the digest first
+                vector = np.array(self._vectors[row])
+                if self._keys[row].tobytes() != digest:
+                    continue # Row is being reused by another process
+                found[digests[digest]] = vector.tolist()
+                self._touched[digest] = now
+        return found
+
+    def put_many(self, items):
+        """Store {key: vector}, evicting least recently used rows when full."""
+        if not items:
+            return
+        dim = len(next(iter(items.values())))
+        with self._lock:
+            self._db.execute("BEGIN IMMEDIATE")
+            try:
+                self._write_touched()
+                stored_dim = self._meta("dim")
+                if stored_dim is None:
+                    self._set_meta("dim", dim)
+                elif stored_dim != dim:
+                    raise ValueError(f"Embedding cache holds {stored_dim}-dim vectors, got {dim}")
+                self._dim = dim
+
+                # Another process may have stored some of them meanwhile; the same text embeds the same
+                digests = [bytes.fromhex(key) for key in items]
+                existing = self._rows_for(digests)
+                new = [d for d in digests if d not in existing][-self.max_entries:]
+
+                allocated = self._meta("rows") or 0
+                fresh = min(len(new), max(self.max_entries - allocated, 0))
+                rows = list(range(allocated, allocated + fresh))
+                if fresh:
+                    self._set_meta("rows", allocated + fresh)
+                if len(new) > fresh:
+                    evicted = self._db.execute(
+                        "SELECT key, row FROM slots ORDER BY last_used LIMIT ?", (len(new) - fresh,)).fetchall()
+                    self._db.executemany("DELETE FROM slots WHERE key = ?", [(key,) for key, _ in evicted])
+                    rows += [row for _, row in evicted]
+                    for key, _ in evicted:
+                        self._touched.pop(key, None)
+                new = new[:len(rows)]
+                if not new:
+                    self._db.execute("COMMIT")
+                    return
+
+                self._grow(max(rows) + 1)
+                now = time.time()
+                by_digest = {bytes.fromhex(key): vector for key, vector in items.items()}
+                for digest, row in zip(new, rows):
+                    # Digest first, so a concurrent reader of the old entry sees a miss, never a mixed vector
+                    self._keys[row] = np.frombuffer(digest, dtype=np.uint8)
+                    self._vectors[row] = by_digest[digest]
+                self._db.executemany(
+                    "INSERT INTO slots (key, row, last_used) VALUES (?, ?, ?)",
+                    [(digest, row, now) for digest, row in zip(new, rows)])
+            except BaseException:
+                self._db.execute("ROLLBACK")
+                raise
+            self._db.execute("COMMIT")
+
+    def __len__(self):
+        with self._lock:
+            return self._db.execute("SELECT COUNT(*) FROM slots").fetchone()[0]
+
+
+class CachedEmbeddings(Embeddings):
+    """Embeddings wrapper that serves repeated texts from an EmbeddingStore."""
+
+    def __init__(self, embeddings, store, model, batch_size=256, max_batch_chars=200_000, max_concurrency=4):
+        self.embeddings = embeddings
+        self.store = store
+        self.model = model
+        self.batch_size = batch_size
+        self.max_batch_chars = max_batch_chars
+        self.max_concurrency = max_concurrency
+
+    def _batches(self, texts):
+        """Group texts into batches capped by both count and total characters."""
+        batch = []
+        batch_chars = 0
+        for text in texts:
+            if batch and (len(batch) >= self.batch_size or batch_chars + len(text) > self.max_batch_chars):
+                yield batch
+                batch = []
+                batch_chars = 0
+            batch.append(text)
+            batch_chars += len(text)
+        if batch:
+            yield batch
+
+    def embed_documents(self, texts):
+        keys = [cache_key(self.model, text) for text in texts]
+        cached = self.store.get_many(keys)
+
+        # Each distinct missing text is embedded once, however often it repeats
+        missing = {}
+        for key, text in zip(keys, texts):
+            if key not in cached and key not in missing:
+                missing[key] = text
+
+        if missing:
+            batches = list(self._batches(list(missing.values())))
+            if len(batches) == 1 or self.max_concurrency <= 1:
+                vectors = [v for batch in batches for v in self.embeddings.embed_documents(batch)]
+            else:
+                with ThreadPoolExecutor(max_workers=min(self.max_concurrency, len(batches))) as pool:
+                    results = pool.map(self.embeddings.embed_documents, batches)
+                    vectors = [v for batch_vectors in results for v in batch_vectors]
+
+            new_items = dict(zip(missing.keys(), vectors))
+            self.store.put_many(new_items)
+            cached.update(new_items)
+
+        return [cached[key] for key in keys]
+
+    def embed_query(self, text):
+        key = cache_key(self.model, text)
+        cached = self.store.get_many([key])
+        if key in cached:
+            return cached[key]
+
+        vector = self.embeddings.embed_query(text)
+        self.store.put_many({key: vector})
+        return vector
+
+
+_stores = {}
+_stores_lock = threading.Lock()
+_flusher = None
+
+def flush_all():
+    with _stores_lock:
+        stores = list(_stores.values())
+    for store in stores:
+        try:
+            store.flush()
+        except Exception as e:
+            print(f"Embedding cache flush failed for {store.directory}: {e!r}")
+
+def run_flusher():
+    while True:
+        time.sleep(settings.EMBEDDING_CACHE_FLUSH_SECONDS)
+        flush_all()
+
+def get_store(model):
+    """One EmbeddingStore per model per process, under EMBEDDING_CACHE_DIR."""
+    global _flusher
+    with _stores_lock:
+        if model not in _stores:
+            directory = os.path.join(settings.EMBEDDING_CACHE_DIR, re.sub(r"[^A-Za-z0-9_.-]", "_", model))
+            _stores[model] = EmbeddingStore(directory, settings.EMBEDDING_CACHE_MAX_ENTRIES)
+        if _flusher is None:
+            _flusher = threading.Thread(target=run_flusher, name="embedding-cache-flush", daemon=True)
+            _flusher.start()
+            atexit.register(flush_all)
+        return _stores[model]
+
+def cached_openai_embeddings(model=None, http_client=None):
+    """
+    OpenAIEmbeddings for `model` (EMBEDDING_MODEL by default) behind the disk cache.
+    With http_client, requests go through it and the SDK's own retries are off.
+    """
+    model = model or settings.EMBEDDING_MODEL
+    client_options = {"http_client": http_client, "max_retries": 0} if http_client is not None else {}
+    return CachedEmbeddings(
+        OpenAIEmbeddings(model=model, **client_options),
+        get_store(model),
+        model,
+        batch_size=settings.EMBEDDING_BATCH_SIZE,
+        max_concurrency=settings.EMBEDDING_MAX_CONCURRENCY,
+    )
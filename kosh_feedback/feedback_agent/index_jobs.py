@@ -0,0 +1,182 @@
+"""
+Background indexing jobs for setup_vector_db.
+
+setup_vector_db records an IndexJob and returns straight away; the job runs on
+a single worker thread (only one index build may run at a time), so a long
+re-index ties up no request workers and can't hit an HTTP timeout. As in
+pdf_jobs, the job table is the queue and claiming a job is a conditional UPDATE.
+Across processes, a unique constraint allows only one queued or running job per
+index, and build_index holds a file lock on the index while it runs.
+
+build_index checkpoints every embedded file, so a job that fails can simply be
+posted again and picks up where it stopped. A job whose worker died (no
+heartbeat for INDEX_JOB_STALE_SECONDS) is requeued the next time any process
+is asked to start a job, and resumes the same way. The live index is only
+swapped when a job succeeds.
+
+While a job runs, its progress (files and chunks done, chunks embedded per
+second and an ETA) is saved to the row at most every INDEX_JOB_PROGRESS_SECONDS,
+where the job status endpoint reads it.
+"""
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from datetime import timedelta
+
+from django.conf import settings
+from django.db import IntegrityError, close_old_connections, transaction
+from django.utils import timezone
+
+from .indexing import build_index
+from .models import IndexJob
+from .resources import get_indexing_embeddings, invalidate_vectorstore
+from .tracing import span
+
+
+class ProgressWriter:
+    """Saves build_index's running statistics to the job row, with the embedding rate and an ETA."""
+
+    # Only the running totals are stored as progress; per-file timings go into the final stats
+    FIELDS = ("phase", "files_indexed", "files_done", "chunks_embedded", "chunks_resumed", "bytes_total", "bytes_done")
+
+    def __init__(self, job_id):
+        self.job_id = job_id
+        self.started = time.monotonic()
+        self.last_write = 0.0
+
+    def snapshot(self, stats):
+        progress = {field: stats.get(field) for field in self.FIELDS}
+        progress["bytes_done"] = int(progress["bytes_done"] or 0)
+        elapsed = time.monotonic() - self.started
+        progress["elapsed_s"] = round(elapsed, 1)
+        progress["chunks_per_sec"] = round(stats["chunks_embedded"] / elapsed, 1) if elapsed else None
+
+        # Work done in this run (not loaded from a checkpoint) predicts the rest, by file size
+        done = stats["bytes_done"] - stats["bytes_resumed"]
+        left = stats["bytes_total"] - stats["bytes_done"]
+        if stats["phase"] != "embedding" or left <= 0:
+            progress["eta_s"] = 0 if stats["phase"] == "done" else None
+        else:
+            progress["eta_s"] = round(elapsed * left / done, 1) if done > 0 else None
+        return progress
+
+    def __call__(self, stats, force=False):
+        now = time.monotonic()
+        if not force and stats["phase"] == "embedding" and now - self.last_write < settings.INDEX_JOB_PROGRESS_SECONDS:
+            return
+        self.last_write = now
+        IndexJob.objects.filter(pk=self.job_id).update(progress=self.snapshot(stats), heartbeat_at=timezone.now())
+
+
+#################### Worker ######################
+
+_executor = None
+_executor_lock = threading.Lock()
+_enqueue_lock = threading.Lock()
+
+def get_executor():
+    """The indexing worker."""
+    global _executor
+    with _executor_lock:
+        if _executor is None:
+            _executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix="index-job")
+        return _executor
+
+def recover_pending():
+    """Requeue jobs whose worker stopped sending heartbeats and return the IDs of all queued jobs, oldest first."""
+    stale_before = timezone.now() - timedelta(seconds=settings.INDEX_JOB_STALE_SECONDS)
+    IndexJob.objects.filter(status=IndexJob.RUNNING, heartbeat_at__lt=stale_before).update(status=IndexJob.QUEUED)
+    return list(IndexJob.objects.filter(status=IndexJob.QUEUED).order_by("created_at").values_list("id", flat=True))
+
+def run_job(job_id):
+    """Build the index for one job. Runs on the worker thread."""
+    try:
+        claimed = IndexJob.objects.filter(pk=job_id, status=IndexJob.QUEUED).update(
+            status=IndexJob.RUNNING, started_at=timezone.now(), heartbeat_at=timezone.now())
+        if not claimed:
+            return # Already taken by another worker
+
+        job = IndexJob.objects.get(pk=job_id)
+        writer = ProgressWriter(job_id)
+        try:
+            with span("index_job", job_id=str(job_id), index_type=job.index_type):
+                stats = build_index(
+                    settings.RAG_DATA_DIR, job.index_dir or settings.VECTORSTORE_DIR, get_indexing_embeddings(),
+                    incremental=job.incremental, index_type=job.index_type, index_params=job.index_params,
+                    checkpoint=True, batch_size=settings.INDEX_CHECKPOINT_CHUNKS, progress=writer,
+                )
+        except Exception as e:
+            print(f"Indexing job {job_id} failed: {e!r}")
+            IndexJob.objects.filter(pk=job_id).update(status=IndexJob.ERROR, error=str(e), finished_at=timezone.now())
+            return
+        invalidate_vectorstore() # Pick up the new index straight away in this worker
+        IndexJob.objects.filter(pk=job_id).update(
+            status=IndexJob.SUCCESS, stats=stats, progress=writer.snapshot(stats), finished_at=timezone.now())
+    finally:
+        close_old_connections() # The worker thread holds its own DB connection
+
+
+#################### API ######################
+
+def active_job(index_dir=None):
+    """The queued or running job for the index (VECTORSTORE_DIR by default), if there is one."""
+    return IndexJob.objects.filter(
+        status__in=(IndexJob.QUEUED, IndexJob.RUNNING), index_dir__in=(index_dir or settings.VECTORSTORE_DIR, ""),
+    ).order_by("created_at").first()
+
+def enqueue(incremental, index_type, index_params):
+    """
+    Record a job and hand it to the worker. Returns (job, created); while another
+    job is queued or running, that job is returned instead and nothing is queued.
+    """
+    executor = get_executor()
+    with _enqueue_lock:
+        # Whichever process's worker died holding a job, this one takes it over; run_job's
+        # claim makes sure a job still queued in a live worker only runs once
+        for job_id in recover_pending():
+            executor.submit(run_job, job_id)
+        existing = active_job()
+        if existing is not None:
+            return existing, False
+        try:
+            with transaction.atomic():
+                job = IndexJob.objects.create(
+                    index_dir=settings.VECTORSTORE_DIR,
+                    incremental=incremental, index_type=index_type, index_params=index_params,
+                )
+        except IntegrityError:
+            # Another process queued a job for this index since we looked
+            existing = active_job()
+            if existing is None:
+                raise # ...and it has already finished
+            return existing, False
+    executor.submit(run_job, job.id)
+    return job, True
+
+def job_info(job):
+    """What the API reports about a job."""
+    info = {
+        "status": job.status,
+        "job_id": str(job.id),
+        "status_url": f"/api/setup_vector_db/jobs/{job.id}/",
+        "mode": "incremental" if job.incremental else "full",
+        "index_type": job.index_type,
+        "progress": job.progress,
+        "created_at": job.created_at,
+        "started_at": job.started_at,
+        "finished_at": job.finished_at,
+    }
+    if job.status == IndexJob.SUCCESS:
+        stats = job.stats or {}
+        info["stats"] = stats
+        info["message"] = (
+            f"Indexed {stats.get('chunks_embedded', 0) + stats.get('chunks_resumed', 0)} new chunks from "
+            f"{stats.get('files_indexed', 0)} PDF(s); index holds {stats.get('chunks_total', 0)} chunks "
+            f"from {stats.get('files_total', 0)} PDF(s)."
+        )
+    elif job.status == IndexJob.ERROR:
+        info["error"] = job.error
+        info["message"] = "Indexing failed. Post to setup_vector_db again to resume from the last checkpoint."
+    else:
+        info["message"] = "Indexing is in progress." if job.status == IndexJob.RUNNING else "Indexing is queued."
+    return info
@@ -0,0 +1,187 @@
+"""
+FAISS index types for the research index.
+
+"flat" is exact search over raw float32 vectors: search time and memory grow
+linearly with the corpus. The other types trade a little recall for much less
+of both:
+  - ivf_flat: vectors bucketed into nlist clusters; a search scans nprobe of them
+  - ivf_pq: as ivf_flat, but vectors are product-quantized to pq_m bytes each
+  - hnsw: a navigable small-world graph over the raw vectors (more memory, no training)
+  - sq8: raw vectors scalar-quantized to one byte per dimension (exhaustive search)
+
+Types that need training are trained on a random sample of at most train_sample
+vectors. When the corpus is too small to train one, the index falls back to flat.
+compare_index_types() measures recall@k and latency of each type against flat.
+"""
+import time
+
+import faiss
+import numpy as np
+
+INDEX_TYPES = ("flat", "ivf_flat", "ivf_pq", "hnsw", "sq8")
+
+# Types whose stored vectors reconstruct exactly, so re-indexing can reuse them
+EXACT_TYPES = ("flat", "ivf_flat", "hnsw")
+
+DEFAULT_PARAMS = {
+    "nlist": None, # IVF clusters; None picks about 4 * sqrt(vectors)
+    "pq_m": None, # PQ bytes per vector; None picks about one per 16 dimensions
+    "hnsw_m": 32, # HNSW graph neighbours per node
+    "ef_construction": 80, # HNSW build-time search depth
+    "train_sample": 50_000, # Vectors used to train IVF, PQ and SQ
+}
+
+# FAISS wants about this many training vectors per centroid
+MIN_POINTS_PER_CENTROID = 39
+PQ_CENTROIDS = 256 # 8 bits per PQ code
+
+
+def default_nlist(n):
+    return max(1, min(int(4 * np.sqrt(n)), n // MIN_POINTS_PER_CENTROID))
+
+def default_pq_m(dim):
+    target = max(1, dim // 16)
+    return max(m for m in range(1, target + 1) if dim % m == 0)
+
+def factory_string(index_type, dim, n, params):
+    """
+    The faiss.index_factory description for index_type, or (None, reason) if there
+    aren't enough vectors to train it.
+    """
+    if index_type == "flat":
+        return "Flat", None
+    if index_type == "hnsw":
+        return f"HNSW{params['hnsw_m']}", None
+    if index_type == "sq8":
+        return ("SQ8", None) if n else (None, "no vectors to train on")
+
+    nlist = params["nlist"] or default_nlist(n)
+    if n < nlist:
+        return None, f"{n} vectors can't train {nlist} IVF clusters"
+    if index_type == "ivf_flat":
+        return f"IVF{nlist},Flat", None
+
+    pq_m = params["pq_m"] or default_pq_m(dim)
+    if dim % pq_m:
+        raise ValueError(f"pq_m={pq_m} must divide the embedding dimension {dim}")
+    if n < PQ_CENTROIDS:
+        return None, f"{n} vectors can't train a {PQ_CENTROIDS}-centroid product quantizer"
+    return f"IVF{nlist},PQ{pq_m}x8", None
+
+def build_faiss_index(vectors, dim, index_type="flat", params=None, seed=0):
+    """
+    Build an index of index_type over vectors, training it on a sample first if it needs it.
+    Returns (index, info) where info describes what was built and how long it took.
+    """
+    if index_type not in INDEX_TYPES:
+        raise ValueError(f"Unknown index type {index_type!r}; expected one of {', '.join(INDEX_TYPES)}")
+    params = {**DEFAULT_PARAMS, **(params or {})}
+    vectors = np.ascontiguousarray(vectors, dtype=np.float32).reshape(-1, dim)
+    n = len(vectors)
+
+    description, fallback = factory_string(index_type, dim, n, params)
+    if description is None:
+        print(f"Building a flat index instead of {index_type}: {fallback}")
+        description = "Flat"
+    index = faiss.index_factory(dim, description)
+
+    started = time.perf_counter()
+    if not index.is_trained:
+        sample = vectors
+        if n > params["train_sample"]:
+            rows = np.random.default_rng(seed).choice(n, params["train_sample"], replace=False)
+            sample = vectors[np.sort(rows)]
+        index.train(sample)
+    trained = time.perf_counter()
+
+    if hasattr(index, "hnsw"):
+        index.hnsw.efConstruction = params["ef_construction"]
+    if n:
+        index.add(vectors)
+    ivf = faiss.try_extract_index_ivf(index)
+    if ivf is not None:
+        ivf.make_direct_map() # Lets vectors be reconstructed by row for MMR and re-indexing
+    finished = time.perf_counter()
+
+    return index, {
+        "type": index_type if fallback is None else "flat",
+        "requested_type": index_type,
+        "factory": description,
+        "fallback_reason": fallback,
+        "vectors": n,
+        "train_ms": round((trained - started) * 1000, 1),
+        "add_ms": round((finished - trained) * 1000, 1),
+    }
+
+def apply_search_params(index, params):
+    """Set search-time knobs (nprobe for IVF, efSearch for HNSW) that apply to this index."""
+    params = params or {}
+    ivf = faiss.try_extract_index_ivf(index)
+    if ivf is not None and "nprobe" in params:
+        ivf.nprobe = min(int(params["nprobe"]), ivf.nlist)
+    if hasattr(index, "hnsw") and "efSearch" in params:
+        index.hnsw.efSearch = int(params["efSearch"])
+    return index
+
+
+#################### Recall and latency report ######################
+
+# Search settings swept for each type; the flat baseline has nothing to tune
+DEFAULT_SWEEP = {
+    "flat": [{}],
+    "ivf_flat": [{"nprobe": 1}, {"nprobe": 4}, {"nprobe": 16}, {"nprobe": 64}],
+    "ivf_pq": [{"nprobe": 1}, {"nprobe": 4}, {"nprobe": 16}, {"nprobe": 64}],
+    "hnsw": [{"efSearch": 16}, {"efSearch": 64}, {"efSearch": 256}],
+    "sq8": [{}],
+}
+
+def timed_search(index, queries, k):
+    """Search one query at a time, as the retriever does. Returns (rows, per-query latencies in ms)."""
+    rows, latencies = [], []
+    for query in queries:
+        started = time.perf_counter()
+        _, result = index.search(query.reshape(1, -1), k)
+        latencies.append((time.perf_counter() - started) * 1000)
+        rows.append(result[0])
+    return np.vstack(rows), np.array(latencies)
+
+def recall_at_k(rows, truth):
+    """Mean share of the exact top k that the approximate search found."""
+    hits = [len(set(r[r != -1]) & set(t[t != -1])) / max(1, (t != -1).sum()) for r, t in zip(rows, truth)]
+    return float(np.mean(hits)) if hits else 0.0
+
+def compare_index_types(vectors, queries, k=10, index_types=INDEX_TYPES, params=None, sweep=None):
+    """
+    Build each index type over vectors and search it with queries, comparing the
+    results with exact search. Returns one row per (type, search setting).
+    """
+    vectors = np.ascontiguousarray(vectors, dtype=np.float32)
+    queries = np.ascontiguousarray(queries, dtype=np.float32)
+    dim = vectors.shape[1]
+    k = min(k, len(vectors))
+    sweep = {**DEFAULT_SWEEP, **(sweep or {})}
+
+    baseline, _ = build_faiss_index(vectors, dim, "flat")
+    truth, _ = timed_search(baseline, queries, k)
+
+    report = []
+    for index_type in ["flat"] + [t for t in index_types if t != "flat"]:
+        index, info = build_faiss_index(vectors, dim, index_type, params)
+        size = len(faiss.serialize_index(index))
+        for search_params in sweep.get(index_type, [{}]):
+            apply_search_params(index, search_params)
+            rows, latencies = timed_search(index, queries, k)
+            report.append({
+                "type": info["type"],
+                "requested_type": index_type,
+                "factory": info["factory"],
+                "search_params": search_params,
+                f"recall_at_{k}": round(recall_at_k(rows, truth), 4),
+                "latency_ms_p50": round(float(np.percentile(latencies, 50)), 3),
+                "latency_ms_p95": round(float(np.percentile(latencies, 95)), 3),
+                "index_bytes": size,
+                "bytes_per_vector": round(size / max(1, len(vectors)), 1),
+                "train_ms": info["train_ms"],
+                "add_ms": info["add_ms"],
+            })
+    return report
@@ -0,0 +1,447 @@
+"""
+Indexing of the RAG_data research PDFs into the FAISS vector store.
+
+A manifest of file hashes and chunk hashes is saved next to the index so that
+re-indexing only chunks and embeds PDFs that are new or changed, and drops the
+chunks of PDFs that were changed or deleted. The index is written in the
+memory-mappable layout read by vector_index.MappedIndex, together with a BM25
+keyword index over the same chunks (which needs no embeddings to rebuild).
+Lossy (quantized) index types also keep the raw vectors, so rebuilding or
+comparing them never embeds unchanged chunks again.
+
+With a checkpoint directory, each file's chunks and vectors are saved there as
+soon as the file is embedded, so a run that fails or is killed partway through
+can be rerun without parsing or embedding those files again. Within a file,
+chunks are embedded in batches, each of which lands in the embedding cache.
+The live index is only replaced once the whole run has succeeded.
+"""
+import fcntl
+import hashlib
+import json
+import os
+import shutil
+import threading
+import uuid
+from contextlib import contextmanager
+
+import numpy as np
+
+from .index_types import EXACT_TYPES, build_faiss_index
+from .ingestion import CHUNK_OVERLAP, CHUNK_SIZE, iter_parsed
+from .lexical_index import BM25Index
+from .vector_index import MappedIndex, write_store, write_vectors
+
+MANIFEST_FILENAME = "manifest.json"
+MANIFEST_VERSION = 2 # 2: MappedIndex layout (version 1 indexes were pickled LangChain FAISS stores)
+CHECKPOINT_VERSION = 1
+
+# Only one indexing run per process may write the index at a time; index_lock extends that across processes
+_index_lock = threading.Lock()
+
+
+#################### Hashing and manifest ######################
+
+def file_sha256(path, block_size=1024 * 1024):
+    """Hash a file's contents without reading it into memory in one go."""
+    digest = hashlib.sha256()
+    with open(path, "rb") as f:
+        for block in iter(lambda: f.read(block_size), b""):
+            digest.update(block)
+    return digest.hexdigest()
+
+def text_sha256(text):
+    return hashlib.sha256(text.encode("utf-8")).hexdigest()
+
+def load_manifest(index_dir):
+    """Return the manifest saved with the index, or None if there isn't a usable one."""
+    path = os.path.join(index_dir, MANIFEST_FILENAME)
+    if not os.path.exists(path):
+        return None
+    with open(path, "r", encoding="utf-8") as f:
+        manifest = json.load(f)
+    if manifest.get("version") != MANIFEST_VERSION:
+        return None
+    return manifest
+
+def write_manifest(index_dir, manifest):
+    with open(os.path.join(index_dir, MANIFEST_FILENAME), "w", encoding="utf-8") as f:
+        json.dump(manifest, f, indent=2)
+
+def list_pdfs(data_folder):
+    """Map each PDF filename in the data folder to its content hash."""
+    return {
+        filename: file_sha256(os.path.join(data_folder, filename))
+        for filename in sorted(os.listdir(data_folder))
+        if filename.endswith(".pdf")
+    }
+
+
+#################### Chunking ######################
+
+def chunk_ids_for(filename, file_hash, chunks):
+    """
+    Stable docstore IDs for a file's chunks, plus the manifest entries recording them.
+    IDs are derived from the filename and file hash, so an unchanged file always
+    maps to the same IDs and identical copies under different names don't collide.
+    """
+    prefix = text_sha256(f"{filename}:{file_hash}")[:16]
+    ids = []
+    entries = []
+    for i, chunk in enumerate(chunks):
+        chunk_id = f"{prefix}-{i:05d}"
+        ids.append(chunk_id)
+        entries.append({"id": chunk_id, "sha256": text_sha256(chunk.page_content)})
+    return ids, entries
+
+
+#################### Saving ######################
+
+@contextmanager
+def index_lock(index_dir):
+    """Hold the index's write lock: first this process's, then an OS file lock shared with other processes."""
+    os.makedirs(os.path.dirname(index_dir) or ".", exist_ok=True)
+    with _index_lock, open(f"{index_dir}.lock", "a") as lock_file:
+        fcntl.flock(lock_file, fcntl.LOCK_EX)
+        try:
+            yield
+        finally:
+            fcntl.flock(lock_file, fcntl.LOCK_UN)
+
+def swap_in(version_dir, index_dir):
+    """
+    Point index_dir at the fully written version_dir, which sits next to it.
+    index_dir is a symlink, replaced in one os.replace, so readers always find
+    an index there: the old one or the new one, never a half-written one and
+    never none. The previous version is then deleted; workers that have it
+    memory-mapped keep reading it until they reload.
+    """
+    previous = os.path.realpath(index_dir) if os.path.islink(index_dir) else None
+    if os.path.isdir(index_dir) and not os.path.islink(index_dir):
+        # An index saved before versioned directories - move it aside (only this first swap has a gap)
+        previous = f"{index_dir}.v0"
+        shutil.rmtree(previous, ignore_errors=True)
+        os.rename(index_dir, previous)
+
+    link = f"{index_dir}.link-{os.getpid()}"
+    if os.path.lexists(link):
+        os.remove(link)
+    os.symlink(os.path.basename(version_dir), link)
+    os.replace(link, index_dir)
+    if previous is not None and previous != os.path.realpath(version_dir):
+        shutil.rmtree(previous, ignore_errors=True)
+
+def new_version_dir(index_dir):
+    return f"{index_dir}.v-{uuid.uuid4().hex[:12]}"
+
+def save_index(index, texts, metadatas, ids, manifest, index_dir, vectors=None):
+    """Write the index, its manifest and (if given) the raw vectors to a new version directory, then swap it in."""
+    version_dir = new_version_dir(index_dir)
+    os.makedirs(os.path.dirname(index_dir), exist_ok=True)
+
+    try:
+        write_store(version_dir, index, texts, metadatas, ids, vectors)
+        write_manifest(version_dir, manifest)
+        swap_in(version_dir, index_dir)
+    except Exception:
+        shutil.rmtree(version_dir, ignore_errors=True)
+        raise
+
+
+def link_or_copy(src, dst):
+    try:
+        os.link(src, dst)
+    except OSError:
+        shutil.copy2(src, dst)
+
+def add_to_index(index_dir, manifest, add):
+    """
+    Add files to the live index without writing into it: hard-link its files into
+    a new version directory, let add(version_dir) write the new ones there, then
+    swap that in like any other build.
+    """
+    version_dir = new_version_dir(index_dir)
+    try:
+        shutil.copytree(os.path.realpath(index_dir), version_dir, copy_function=link_or_copy)
+        add(version_dir)
+        # A new manifest file rather than a link to the live one, so workers see a new version and reload
+        os.remove(os.path.join(version_dir, MANIFEST_FILENAME))
+        write_manifest(version_dir, manifest)
+        swap_in(version_dir, index_dir)
+    except Exception:
+        shutil.rmtree(version_dir, ignore_errors=True)
+        raise
+
+
+#################### Checkpoints ######################
+
+class Checkpoint:
+    """
+    Per-file results of an unfinished indexing run: chunk IDs, texts, metadata,
+    manifest entries and vectors. Checkpoints written with different chunking or
+    a different embedding model are discarded.
+    """
+
+    def __init__(self, directory, embedding_model):
+        self.directory = directory
+        self.key = {
+            "version": CHECKPOINT_VERSION,
+            "chunk_size": CHUNK_SIZE,
+            "chunk_overlap": CHUNK_OVERLAP,
+            "embedding_model": embedding_model,
+        }
+
+    def open(self):
+        state_path = os.path.join(self.directory, "state.json")
+        if os.path.exists(state_path):
+            with open(state_path, "r", encoding="utf-8") as f:
+                if json.load(f) == self.key:
+                    return self
+            print(f"Discarding indexing checkpoint at {self.directory} written with other settings")
+            self.clear()
+        os.makedirs(self.directory, exist_ok=True)
+        with open(state_path, "w", encoding="utf-8") as f:
+            json.dump(self.key, f)
+        return self
+
+    def _path(self, filename, file_hash, extension):
+        return os.path.join(self.directory, f"{text_sha256(f'{filename}:{file_hash}')[:32]}{extension}")
+
+    def load(self, filename, file_hash):
+        """(chunk_ids, entries, texts, metadatas, vectors) saved for this version of the file, or None."""
+        json_path = self._path(filename, file_hash, ".json")
+        if not os.path.exists(json_path):
+            return None
+        with open(json_path, "r", encoding="utf-8") as f:
+            saved = json.load(f)
+        vectors = np.load(self._path(filename, file_hash, ".npy"))
+        return saved["ids"], saved["entries"], saved["texts"], saved["metadatas"], vectors
+
+    def save(self, filename, file_hash, chunk_ids, entries, texts, metadatas, vectors):
+        """Write the vectors, then the JSON; a file only counts as checkpointed once its JSON exists."""
+        vectors_path = self._path(filename, file_hash, ".npy")
+        with open(f"{vectors_path}.tmp", "wb") as f:
+            np.save(f, vectors)
+        os.replace(f"{vectors_path}.tmp", vectors_path)
+        json_path = self._path(filename, file_hash, ".json")
+        with open(f"{json_path}.tmp", "w", encoding="utf-8") as f:
+            json.dump({"ids": chunk_ids, "entries": entries, "texts": texts, "metadatas": metadatas}, f)
+        os.replace(f"{json_path}.tmp", json_path)
+
+    def clear(self):
+        shutil.rmtree(self.directory, ignore_errors=True)
+
+
+def checkpoint_dir_for(index_dir):
+    return f"{index_dir}.checkpoint"
+
+
+#################### Build ######################
+
+def stored_vectors(store, rows, exact, embeddings=None):
+    """
+    The vectors of the given rows: from the raw vectors saved with a lossy index,
+    or reconstructed from an exact one. Lossy indexes written before raw vectors
+    were saved have their chunks embedded again, with embeddings (the store's
+    own by default).
+    """
+    if exact or store.raw_vectors is not None:
+        return store.vectors(rows)
+    texts = [store.chunks[row] for row in rows]
+    if not texts:
+        return np.zeros((0, store.index.d), dtype=np.float32)
+    return np.asarray((embeddings or store.embeddings).embed_documents(texts), dtype=np.float32)
+
+def is_exact(manifest):
+    return (manifest or {}).get("index", {}).get("built_type", "flat") in EXACT_TYPES
+
+def has_exact_vectors(store, index_dir):
+    """Whether every vector of the index at index_dir can be read without embedding anything."""
+    return store.raw_vectors is not None or is_exact(load_manifest(index_dir))
+
+def all_vectors(store, index_dir, max_count=None, seed=0):
+    """
+    Every vector of the index saved at index_dir (or a random sample of max_count
+    of them, in index order), as exactly as they can be recovered.
+    """
+    rows = list(range(len(store)))
+    if max_count is not None and len(rows) > max_count:
+        rows = sorted(np.random.default_rng(seed).choice(len(rows), max_count, replace=False).tolist())
+    return stored_vectors(store, rows, is_exact(load_manifest(index_dir)))
+
+def embed_in_batches(embeddings, texts, batch_size, on_batch):
+    """Embed texts batch_size at a time (all at once if None), calling on_batch(count) after each batch."""
+    batch_size = batch_size or len(texts) or 1
+    vectors = []
+    for start in range(0, len(texts), batch_size):
+        batch = texts[start:start + batch_size]
+        vectors.extend(embeddings.embed_documents(batch))
+        on_batch(len(batch))
+    return np.asarray(vectors, dtype=np.float32)
+
+def build_index(data_folder, index_dir, embeddings, incremental=True, index_type="flat", index_params=None,
+                checkpoint=False, batch_size=None, progress=None):
+    """
+    Index every PDF in data_folder into the FAISS store at index_dir.
+
+    With incremental=True and an existing manifest, unchanged PDFs are skipped,
+    new or changed PDFs are chunked and embedded, and the chunks of changed or
+    deleted PDFs are removed. Otherwise the index is rebuilt from scratch.
+    index_type and index_params choose the FAISS index (see index_types); changing
+    them rebuilds the index from the existing vectors without re-parsing any PDFs.
+
+    With checkpoint=True, files embedded by an earlier, unfinished run are loaded
+    from the checkpoint next to index_dir rather than embedded again. Chunks are
+    embedded batch_size at a time, and progress(stats) is called after each batch
+    and each phase with the running statistics.
+    Returns a dict of statistics about the run.
+    """
+    index_config = {"type": index_type, "params": dict(index_params or {})}
+    report = progress or (lambda stats: None)
+    with index_lock(index_dir):
+        current_files = list_pdfs(data_folder)
+
+        manifest = load_manifest(index_dir) if incremental else None
+        previous = None
+        if manifest is not None:
+            try:
+                previous = MappedIndex.load(index_dir, embeddings)
+            except Exception as e:
+                # Manifest without a readable index - fall back to a full rebuild
+                print(f"Could not load existing index, rebuilding from scratch: {e}")
+                manifest = None
+
+        old_files = manifest["files"] if manifest else {}
+
+        unchanged = [f for f, h in current_files.items() if old_files.get(f, {}).get("sha256") == h]
+        to_index = [f for f in current_files if f not in unchanged]
+        to_remove = [f for f in old_files if f not in unchanged]
+        sizes = {f: os.path.getsize(os.path.join(data_folder, f)) for f in to_index}
+
+        stats = {
+            "mode": "incremental" if manifest is not None else "full",
+            "phase": "embedding",
+            "files_total": len(current_files),
+            "files_unchanged": len(unchanged),
+            "files_indexed": len(to_index),
+            "files_done": 0, # Of files_indexed
+            "files_removed": len([f for f in to_remove if f not in current_files]),
+            "chunks_embedded": 0,
+            "chunks_resumed": 0, # Loaded from the checkpoint of an earlier run
+            "chunks_removed": sum(len(old_files[f]["chunks"]) for f in to_remove),
+            "chunks_total": 0,
+            "bytes_total": sum(sizes.values()), # Of the files to index; progress is tracked by size
+            "bytes_done": 0,
+            "bytes_resumed": 0,
+            "timings": [],
+        }
+        checkpoint_store = Checkpoint(checkpoint_dir_for(index_dir), getattr(embeddings, "model", None)).open() if checkpoint else None
+
+        # Indexes from before index types were configurable are flat
+        previous_config = manifest.get("index", {"type": "flat", "params": {}}) if manifest else {}
+        same_index = (previous_config.get("type"), previous_config.get("params")) == (index_type, index_config["params"])
+        if not to_index and not to_remove and same_index:
+            stats["chunks_total"] = sum(len(old_files[f]["chunks"]) for f in unchanged)
+            if previous is not None and previous.lexical is None:
+                # Index written before the keyword index existed - add one without re-embedding
+                lexical = BM25Index.build([previous.chunks[row] for row in range(len(previous.chunks))])
+                add_to_index(index_dir, manifest, lexical.save)
+                stats["lexical_index_added"] = True
+            if previous is not None and previous.raw_vectors is None and not is_exact(manifest):
+                # Lossy index written before raw vectors were saved - embed once so later runs needn't
+                raw_vectors = stored_vectors(previous, list(range(len(previous))), False, embeddings)
+                add_to_index(index_dir, manifest, lambda version_dir: write_vectors(version_dir, raw_vectors))
+                stats["raw_vectors_added"] = True
+            if checkpoint_store:
+                checkpoint_store.clear()
+            stats["phase"] = "done"
+            return stats
+
+        # Step 1: Carry over the chunks and vectors of unchanged files
+        ids, texts, metadatas, vectors = [], [], [], []
+        if previous is not None:
+            rows_by_id = {chunk_id: row for row, chunk_id in enumerate(previous.ids)}
+            kept_rows = [rows_by_id[c["id"]] for f in unchanged for c in old_files[f]["chunks"]]
+            ids.extend(previous.ids[row] for row in kept_rows)
+            texts.extend(previous.chunks[row] for row in kept_rows)
+            metadatas.extend(previous.metadatas[row] for row in kept_rows)
+            vectors.append(stored_vectors(previous, kept_rows, is_exact(manifest), embeddings))
+
+        new_manifest = {"version": MANIFEST_VERSION, "files": {f: old_files[f] for f in unchanged}, "index": index_config}
+
+        def add_file(filename, chunk_ids, entries, chunk_texts, chunk_metadatas, file_vectors):
+            new_manifest["files"][filename] = {"sha256": current_files[filename], "chunks": entries}
+            if len(chunk_ids):
+                vectors.append(file_vectors)
+                ids.extend(chunk_ids)
+                texts.extend(chunk_texts)
+                metadatas.extend(chunk_metadatas)
+            stats["files_done"] += 1
+
+        # Step 2: Load files a previous run already embedded
+        to_parse = []
+        for filename in to_index:
+            saved = checkpoint_store.load(filename, current_files[filename]) if checkpoint_store else None
+            if saved is None:
+                to_parse.append(filename)
+                continue
+            add_file(filename, *saved)
+            stats["chunks_resumed"] += len(saved[0])
+            stats["bytes_done"] += sizes[filename]
+            stats["bytes_resumed"] += sizes[filename]
+        if stats["chunks_resumed"]:
+            print(f"Resuming indexing: {stats['files_done']} file(s), {stats['chunks_resumed']} chunks from the checkpoint")
+        report(stats)
+
+        # Step 3: Chunk the other new and changed files in the process pool, embedding each as it arrives
+        parsed_files = iter_parsed((filename, os.path.join(data_folder, filename)) for filename in to_parse)
+        for parsed in parsed_files:
+            filename = parsed.name
+            chunks = parsed.documents
+            stats["timings"].append(parsed.timing())
+            chunk_ids, entries = chunk_ids_for(filename, current_files[filename], chunks)
+            chunk_texts = [chunk.page_content for chunk in chunks]
+            chunk_metadatas = [chunk.metadata for chunk in chunks]
+
+            def on_batch(count, filename=filename, total=len(chunks)):
+                stats["chunks_embedded"] += count
+                stats["bytes_done"] += sizes[filename] * count / total
+                report(stats)
+
+            file_vectors = embed_in_batches(embeddings, chunk_texts, batch_size, on_batch)
+            if checkpoint_store:
+                checkpoint_store.save(filename, current_files[filename], chunk_ids, entries, chunk_texts, chunk_metadatas, file_vectors)
+            add_file(filename, chunk_ids, entries, chunk_texts, chunk_metadatas, file_vectors)
+            if not chunks:
+                stats["bytes_done"] += sizes[filename]
+            report(stats)
+
+        stats["chunks_total"] = len(ids)
+        stats["bytes_done"] = stats["bytes_total"] # Settle rounding from per-batch progress
+
+        vectors = [v for v in vectors if len(v)]
+        if vectors:
+            dim = vectors[0].shape[1]
+        elif previous is not None:
+            dim = previous.index.d # Every chunk was removed - save an empty index
+        else:
+            # Nothing to save - every PDF was empty and there was no previous index
+            if checkpoint_store:
+                checkpoint_store.clear()
+            stats["phase"] = "done"
+            return stats
+
+        # Step 4: Build, save and swap in the new index
+        stats["phase"] = "building"
+        report(stats)
+        all_rows = np.vstack(vectors) if vectors else np.zeros((0, dim), dtype=np.float32)
+        index, stats["index"] = build_faiss_index(all_rows, dim, index_type, index_params)
+        new_manifest["index"]["built_type"] = stats["index"]["type"]
+        stats["phase"] = "saving"
+        report(stats)
+        # Lossy indexes keep the raw vectors too, so later runs reuse them instead of re-embedding
+        save_index(index, texts, metadatas, ids, new_manifest, index_dir,
+                   vectors=None if is_exact(new_manifest) else all_rows)
+        if checkpoint_store:
+            checkpoint_store.clear() # Only once the new index is in place
+        stats["phase"] = "done"
+        return stats
@@ -0,0 +1,199 @@
+"""
+Parallel PDF ingestion.
+
+PDF parsing and chunking is CPU-bound, so files are handed to a shared process
+pool sized to the machine's cores. Results are yielded per file as soon as each
+one finishes, so callers can start embedding while later files are still being
+parsed.
+
+User uploads take a lighter path: text is extracted straight from the upload's
+buffer (or Django's own spooled file) with PyMuPDF, page by page, stopping once
+the page or character budget is used up.
+"""
+import multiprocessing
+import os
+import threading
+import time
+from concurrent.futures import ProcessPoolExecutor, as_completed
+from concurrent.futures.process import BrokenProcessPool
+from typing import NamedTuple
+
+import pymupdf
+from django.conf import settings
+from langchain_community.document_loaders import PyPDFLoader, PyMuPDFLoader
+from langchain.text_splitter import RecursiveCharacterTextSplitter
+
+CHUNK_SIZE = 500
+CHUNK_OVERLAP = 50
+
+LOADERS = {
+    "pypdf": PyPDFLoader,
+    "pymupdf": PyMuPDFLoader,
+}
+
+
+class ParsedFile(NamedTuple):
+    """One parsed PDF: its documents (chunks if split) and how long each stage took."""
+    name: str
+    documents: list
+    pages: int
+    parse_ms: float
+    split_ms: float
+
+    def timing(self):
+        return {
+            "file": self.name,
+            "pages": self.pages,
+            "documents": len(self.documents),
+            "parse_ms": round(self.parse_ms, 1),
+            "split_ms": round(self.split_ms, 1),
+        }
+
+
+class ExtractedText(NamedTuple):
+    """Page texts pulled from one uploaded PDF, capped by the page and character budget."""
+    name: str
+    pages: list
+    truncated: bool
+    extract_ms: float
+
+
+def split_documents(docs):
+    text_splitter = RecursiveCharacterTextSplitter(chunk_size=CHUNK_SIZE, chunk_overlap=CHUNK_OVERLAP)
+    return text_splitter.split_documents(docs)
+
+def parse_file(name, path, loader="pypdf", split=True):
+    """Load one PDF (and optionally chunk it). Runs inside the pool's worker processes."""
+    started = time.perf_counter()
+    docs = LOADERS[loader](path).load()
+    parsed = time.perf_counter()
+    documents = split_documents(docs) if split else docs
+    finished = time.perf_counter()
+    return ParsedFile(name, documents, len(docs), (parsed - started) * 1000, (finished - parsed) * 1000)
+
+
+def take_within_budget(page_texts, max_pages=None, max_chars=None):
+    """
+    Take page texts in order until max_pages pages or max_chars characters are used.
+    Returns (taken, truncated). Stops pulling from page_texts once the budget is spent.
+    """
+    taken = []
+    chars = 0
+    for text in page_texts:
+        if max_pages is not None and len(taken) >= max_pages:
+            return taken, True
+        if max_chars is not None and chars + len(text) > max_chars:
+            taken.append(text[:max_chars - chars])
+            return taken, True
+        taken.append(text)
+        chars += len(text)
+    return taken, False
+
+def extract_text(name, source, max_pages=None, max_chars=None):
+    """
+    Extract page texts from a PDF given as a file path or an in-memory buffer,
+    without writing anything to disk. Pages past the budget are never parsed.
+    """
+    started = time.perf_counter()
+    if isinstance(source, str):
+        doc = pymupdf.open(source)
+    else:
+        doc = pymupdf.open(stream=source, filetype="pdf")
+
+    with doc:
+        pages, truncated = take_within_budget((page.get_text() for page in doc), max_pages, max_chars)
+    return ExtractedText(name, pages, truncated, (time.perf_counter() - started) * 1000)
+
+
+#################### Process pool ######################
+
+_pool = None
+_pool_lock = threading.Lock()
+
+def max_workers():
+    return settings.INGESTION_MAX_WORKERS or os.cpu_count() or 1
+
+def pool_context():
+    """
+    Start workers from a fork server (or spawn them where there is none) rather
+    than forking the server process, whose other threads may hold locks that a
+    forked child would inherit in a locked state.
+    """
+    method = "forkserver" if "forkserver" in multiprocessing.get_all_start_methods() else "spawn"
+    context = multiprocessing.get_context(method)
+    if method == "forkserver":
+        context.set_forkserver_preload([__name__]) # Workers start with the PDF libraries already imported
+    return context
+
+def get_pool():
+    """The shared process pool, created on first use."""
+    global _pool
+    with _pool_lock:
+        if _pool is None:
+            _pool = ProcessPoolExecutor(max_workers=max_workers(), mp_context=pool_context())
+        return _pool
+
+def reset_pool():
+    """Drop a broken pool so the next call starts a fresh one."""
+    global _pool
+    with _pool_lock:
+        if _pool is not None:
+            _pool.shutdown(wait=False, cancel_futures=True)
+        _pool = None
+
+def pool_pids():
+    """PIDs of the pool's worker processes, for memory reporting."""
+    with _pool_lock:
+        if _pool is None:
+            return []
+        return [process.pid for process in (_pool._processes or {}).values()]
+
+
+def use_pool(job_count):
+    return job_count > 1 and max_workers() > 1
+
+def _iter_pooled(fn, jobs):
+    """Run fn(*job) for each job, in the pool when there's more than one, yielding results as they complete."""
+    jobs = list(jobs)
+    if not use_pool(len(jobs)):
+        # Not worth the inter-process round trip
+        for job in jobs:
+            yield fn(*job)
+        return
+
+    pool = get_pool()
+    futures = [pool.submit(fn, *job) for job in jobs]
+    try:
+        for future in as_completed(futures):
+            yield future.result()
+    except BrokenProcessPool:
+        reset_pool()
+        raise
+    finally:
+        # If the caller stops early or a file fails, don't leave queued work behind
+        for future in futures:
+            future.cancel()
+
+def iter_parsed(files, loader="pypdf", split=True):
+    """
+    Parse (name, path) pairs in parallel, yielding a ParsedFile for each as it completes.
+    Results arrive in completion order, not input order.
+    """
+    for result in _iter_pooled(parse_file, ((name, path, loader, split) for name, path in files)):
+        print(f"Parsed {result.name}: {result.pages} pages in {result.parse_ms:.0f} ms")
+        yield result
+
+def iter_extracted(sources, max_pages=None, max_chars=None):
+    """
+    Extract text from (name, path-or-buffer) pairs, in parallel when there are several,
+    yielding an ExtractedText for each as it completes.
+    """
+    sources = list(sources)
+    if use_pool(len(sources)):
+        # Buffers are views onto the upload; worker processes need their own copy
+        sources = [(name, source if isinstance(source, (str, bytes)) else bytes(source)) for name, source in sources]
+
+    for result in _iter_pooled(extract_text, ((name, source, max_pages, max_chars) for name, source in sources)):
+        print(f"Extracted {result.name}: {len(result.pages)} pages in {result.extract_ms:.0f} ms"
+              + (" (truncated)" if result.truncated else ""))
+        yield result
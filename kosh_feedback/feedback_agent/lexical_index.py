@@ -0,0 +1,125 @@
+"""
+BM25 keyword index over the same chunks as the vector index.
+
+Stored in a bm25/ folder inside the index directory as plain NumPy arrays (the
+postings are memory-mapped on load) plus a JSON vocabulary, with row i being
+the same chunk as row i of the FAISS index. Searching needs no embedding call,
+so it is fast, works offline and matches exact trait names and scale labels
+that dense vectors tend to blur.
+"""
+import json
+import math
+import os
+import re
+
+import numpy as np
+
+LEXICAL_DIRNAME = "bm25"
+VOCABULARY_FILENAME = "vocabulary.json"
+OFFSETS_FILENAME = "postings_offsets.npy"
+ROWS_FILENAME = "postings_rows.npy"
+TFS_FILENAME = "postings_tfs.npy"
+LENGTHS_FILENAME = "doc_lengths.npy"
+
+TOKEN_RE = re.compile(r"\w+")
+STOPWORDS = frozenset(
+    "a an and are as at be by for from has have in is it its of on or that the their this to was were "
+    "what when which who will with you your i my me we our they them how do does".split()
+)
+
+
+def tokenize(text):
+    return [t for t in TOKEN_RE.findall(text.lower()) if t not in STOPWORDS]
+
+
+class BM25Index:
+    """Okapi BM25 over postings stored as flat arrays: term t's postings are offsets[t]:offsets[t + 1]."""
+
+    def __init__(self, vocabulary, offsets, rows, tfs, doc_lengths, k1=1.5, b=0.75):
+        self.vocabulary = vocabulary # term -> term id
+        self.offsets = offsets
+        self.rows = rows
+        self.tfs = tfs
+        self.doc_lengths = doc_lengths
+        self.k1 = k1
+        self.b = b
+        self.avg_length = float(doc_lengths.mean()) if len(doc_lengths) else 0.0
+
+    @classmethod
+    def build(cls, texts):
+        postings = {} # term -> {row: term frequency}
+        doc_lengths = np.zeros(len(texts), dtype=np.int32)
+        for row, text in enumerate(texts):
+            tokens = tokenize(text)
+            doc_lengths[row] = len(tokens)
+            for token in tokens:
+                counts = postings.setdefault(token, {})
+                counts[row] = counts.get(row, 0) + 1
+
+        terms = sorted(postings)
+        offsets = np.zeros(len(terms) + 1, dtype=np.int64)
+        np.cumsum([len(postings[t]) for t in terms], out=offsets[1:])
+        rows = np.fromiter((row for t in terms for row in postings[t]), dtype=np.int32, count=int(offsets[-1]))
+        tfs = np.fromiter((tf for t in terms for tf in postings[t].values()), dtype=np.int32, count=int(offsets[-1]))
+        return cls({t: i for i, t in enumerate(terms)}, offsets, rows, tfs, doc_lengths)
+
+    def save(self, index_dir):
+        directory = os.path.join(index_dir, LEXICAL_DIRNAME)
+        os.makedirs(directory, exist_ok=True)
+        np.save(os.path.join(directory, OFFSETS_FILENAME), self.offsets)
+        np.save(os.path.join(directory, ROWS_FILENAME), self.rows)
+        np.save(os.path.join(directory, TFS_FILENAME), self.tfs)
+        np.save(os.path.join(directory, LENGTHS_FILENAME), self.doc_lengths)
+        # Written last, since its presence is what marks the index as complete
+        terms = sorted(self.vocabulary, key=self.vocabulary.get)
+        with open(os.path.join(directory, VOCABULARY_FILENAME), "w", encoding="utf-8") as f:
+            json.dump({"terms": terms, "k1": self.k1, "b": self.b}, f)
+
+    @classmethod
+    def exists(cls, index_dir):
+        return os.path.exists(os.path.join(index_dir, LEXICAL_DIRNAME, VOCABULARY_FILENAME))
+
+    @classmethod
+    def load(cls, index_dir):
+        directory = os.path.join(index_dir, LEXICAL_DIRNAME)
+        with open(os.path.join(directory, VOCABULARY_FILENAME), "r", encoding="utf-8") as f:
+            vocabulary = json.load(f)
+
+        def array(filename):
+            return np.load(os.path.join(directory, filename), mmap_mode="r")
+
+        return cls(
+            {t: i for i, t in enumerate(vocabulary["terms"])},
+            array(OFFSETS_FILENAME),
+            array(ROWS_FILENAME),
+            array(TFS_FILENAME),
+            np.load(os.path.join(directory, LENGTHS_FILENAME)),
+            vocabulary["k1"],
+            vocabulary["b"],
+        )
+
+    def __len__(self):
+        return len(self.doc_lengths)
+
+    def search(self, query, k):
+        """The top k (row, score) pairs for the query, best first."""
+        n = len(self.doc_lengths)
+        if not n:
+            return []
+        scores = np.zeros(n, dtype=np.float32)
+        for token in set(tokenize(query)):
+            term_id = self.vocabulary.get(token)
+            if term_id is None:
+                continue
+            start, end = int(self.offsets[term_id]), int(self.offsets[term_id + 1])
+            rows = np.asarray(self.rows[start:end])
+            tfs = np.asarray(self.tfs[start:end], dtype=np.float32)
+            idf = math.log(1 + (n - len(rows) + 0.5) / (len(rows) + 0.5))
+            norm = self.k1 * (1 - self.b + self.b * self.doc_lengths[rows] / (self.avg_length or 1.0))
+            scores[rows] += idf * tfs * (self.k1 + 1) / (tfs + norm)
+
+        matched = np.flatnonzero(scores)
+        if not len(matched):
+            return []
+        top = matched[np.argsort(-scores[matched], kind="stable")[:k]]
+        return [(int(row), float(scores[row])) for row in top]
@@ -0,0 +1,70 @@
+import json
+import os
+import shutil
+import tempfile
+
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connections
+from django.test.utils import setup_databases, setup_test_environment, teardown_databases, teardown_test_environment
+
+from feedback_agent.benchmarks.fakes import FakeChatModel, FakeEmbeddings
+from feedback_agent.benchmarks.runner import find_regressions, load_report, run_benchmarks
+
+
+class Command(BaseCommand):
+    help = (
+        "Benchmark ingestion, retrieval and the query endpoints offline, with fake OpenAI models, "
+        "a synthetic corpus and a scratch database."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument("--files", type=int, default=20, help="Synthetic research PDFs to index")
+        parser.add_argument("--pages", type=int, default=10, help="Pages per research PDF")
+        parser.add_argument("--searches", type=int, default=200, help="Retrieval searches to time")
+        parser.add_argument("--clients", type=int, default=8, help="Concurrent query_chatgpt clients")
+        parser.add_argument("--turns", type=int, default=3, help="Turns per client conversation")
+        parser.add_argument("--stream-clients", type=int, default=8, help="Concurrent streamed turns")
+        parser.add_argument("--report-pages", type=int, default=4, help="Pages per uploaded report")
+        parser.add_argument("--chat-latency-ms", type=float, default=300, help="Fake LLM time to first token")
+        parser.add_argument("--token-latency-ms", type=float, default=5, help="Fake LLM time per output token")
+        parser.add_argument("--embedding-latency-ms", type=float, default=50, help="Fake embedding call latency")
+        parser.add_argument("--dimensions", type=int, default=1536, help="Fake embedding dimensions")
+        parser.add_argument("--seed", type=int, default=0)
+        parser.add_argument("--workdir", help="Scratch directory (default: a temporary directory, removed afterwards)")
+        parser.add_argument("--output", help="Write the JSON report to this file")
+        parser.add_argument("--baseline", help="Fail if any p95 latency regressed against this JSON report")
+        parser.add_argument("--max-regression", type=float, default=0.2, help="Allowed p95 slowdown, as a fraction")
+
+    def handle(self, *args, **options):
+        workdir = options["workdir"] or tempfile.mkdtemp(prefix="kosh-bench-")
+        os.makedirs(workdir, exist_ok=True)
+        chat = FakeChatModel(first_token_ms=options["chat_latency_ms"], per_token_ms=options["token_latency_ms"])
+        embeddings = FakeEmbeddings(options["dimensions"], latency_ms=options["embedding_latency_ms"])
+
+        # A scratch database, so benchmark conversations and jobs never touch real data
+        connections["default"].settings_dict.setdefault("TEST", {})["NAME"] = f"{workdir}/bench.sqlite3"
+        setup_test_environment()
+        old_config = setup_databases(verbosity=0, interactive=False)
+        try:
+            report = run_benchmarks(
+                workdir, chat, embeddings,
+                files=options["files"], pages_per_file=options["pages"], searches=options["searches"],
+                clients=options["clients"], turns=options["turns"], report_pages=options["report_pages"],
+                stream_clients=options["stream_clients"], seed=options["seed"],
+            )
+        finally:
+            teardown_databases(old_config, verbosity=0)
+            teardown_test_environment()
+            if not options["workdir"]:
+                shutil.rmtree(workdir, ignore_errors=True)
+
+        self.stdout.write(json.dumps(report, indent=2))
+        if options["output"]:
+            with open(options["output"], "w", encoding="utf-8") as f:
+                json.dump(report, f, indent=2)
+
+        if options["baseline"]:
+            regressions = find_regressions(report, load_report(options["baseline"]), options["max_regression"])
+            if regressions:
+                raise CommandError("p95 latency regressed:\n  " + "\n  ".join(regressions))
+            self.stdout.write(self.style.SUCCESS("No p95 regressions against the baseline."))
@@ -0,0 +1,19 @@
+import json
+
+from django.core.management.base import BaseCommand
+
+from feedback_agent.retention import purge_expired
+
+
+class Command(BaseCommand):
+    help = (
+        "Delete generated PDFs, conversations (with their reports, turns and token usage) and indexing jobs "
+        "older than the RETENTION_* settings."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument("--dry-run", action="store_true", help="Only count what would be deleted")
+
+    def handle(self, *args, **options):
+        counts = purge_expired(dry_run=options["dry_run"])
+        self.stdout.write(json.dumps(counts, indent=2))
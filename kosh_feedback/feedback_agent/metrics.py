@@ -0,0 +1,148 @@
+"""
+In-process metrics in the Prometheus text exposition format.
+
+A small registry of counters, gauges and histograms, rendered by the /metrics view.
+Every server process keeps its own registry, so scrape each worker (or run a
+single worker per port) as you would with any multi-process Prometheus setup.
+"""
+import threading
+
+# Seconds; spans range from sub-millisecond index searches to multi-second LLM calls
+DEFAULT_BUCKETS = (0.001, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60)
+
+
+def format_labels(names, values):
+    if not names:
+        return ""
+    escaped = (str(v).replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n") for v in values)
+    return "{" + ",".join(f'{n}="{v}"' for n, v in zip(names, escaped)) + "}"
+
+def format_value(value):
+    return repr(float(value)) if value != int(value) else str(int(value))
+
+
+class Counter:
+
+    def __init__(self, name, help_text, labels=()):
+        self.name = name
+        self.help_text = help_text
+        self.labels = tuple(labels)
+        self._values = {}
+        self._lock = threading.Lock()
+
+    def inc(self, amount=1, **labels):
+        key = tuple(labels.get(n, "") for n in self.labels)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0) + amount
+
+    def render(self):
+        lines = [f"# HELP {self.name} {self.help_text}", f"# TYPE {self.name} counter"]
+        with self._lock:
+            for key, value in sorted(self._values.items()):
+                lines.append(f"{self.name}{format_labels(self.labels, key)} {format_value(value)}")
+        return lines
+
+
+class Gauge:
+
+    def __init__(self, name, help_text, labels=()):
+        self.name = name
+        self.help_text = help_text
+        self.labels = tuple(labels)
+        self._values = {}
+        self._lock = threading.Lock()
+
+    def set(self, value, **labels):
+        key = tuple(labels.get(n, "") for n in self.labels)
+        with self._lock:
+            self._values[key] = value
+
+    def render(self):
+        lines = [f"# HELP {self.name} {self.help_text}", f"# TYPE {self.name} gauge"]
+        with self._lock:
+            for key, value in sorted(self._values.items()):
+                lines.append(f"{self.name}{format_labels(self.labels, key)} {format_value(value)}")
+        return lines
+
+
+class Histogram:
+
+    def __init__(self, name, help_text, labels=(), buckets=DEFAULT_BUCKETS):
+        self.name = name
+        self.help_text = help_text
+        self.labels = tuple(labels)
+        self.buckets = tuple(sorted(buckets))
+        self._series = {} # label values -> [bucket counts..., sum, count]
+        self._lock = threading.Lock()
+
+    def observe(self, value, **labels):
+        key = tuple(labels.get(n, "") for n in self.labels)
+        with self._lock:
+            series = self._series.setdefault(key, [0] * len(self.buckets) + [0.0, 0])
+            for i, bound in enumerate(self.buckets):
+                if value <= bound:
+                    series[i] += 1
+            series[-2] += value
+            series[-1] += 1
+
+    def render(self):
+        lines = [f"# HELP {self.name} {self.help_text}", f"# TYPE {self.name} histogram"]
+        with self._lock:
+            for key, series in sorted(self._series.items()):
+                for bound, count in zip(self.buckets, series):
+                    labels = format_labels(self.labels + ("le",), key + (format_value(bound),))
+                    lines.append(f"{self.name}_bucket{labels} {count}")
+                labels = format_labels(self.labels + ("le",), key + ("+Inf",))
+                lines.append(f"{self.name}_bucket{labels} {series[-1]}")
+                lines.append(f"{self.name}_sum{format_labels(self.labels, key)} {format_value(series[-2])}")
+                lines.append(f"{self.name}_count{format_labels(self.labels, key)} {series[-1]}")
+        return lines
+
+
+_registry = []
+
+def register(metric):
+    _registry.append(metric)
+    return metric
+
+def render_metrics():
+    return "\n".join(line for metric in _registry for line in metric.render()) + "\n"
+
+
+#################### Metrics ######################
+
+SPAN_SECONDS = register(Histogram(
+    "kosh_span_duration_seconds", "Duration of instrumented pipeline stages.", labels=("span",),
+))
+SPAN_ERRORS = register(Counter(
+    "kosh_span_errors_total", "Instrumented stages that raised an exception.", labels=("span",),
+))
+REQUEST_SECONDS = register(Histogram(
+    "kosh_request_duration_seconds", "Time until the response (or, when streaming, its headers) was ready.",
+    labels=("route", "method", "status"),
+))
+LLM_TOKENS = register(Counter(
+    "kosh_llm_tokens_total", "Tokens used by LLM calls, by type (prompt, completion, cached_prompt).",
+    labels=("model", "type"),
+))
+OPENAI_REQUESTS = register(Counter(
+    "kosh_openai_requests_total", "OpenAI API calls by lane and final outcome (after retries).",
+    labels=("lane", "outcome"),
+))
+OPENAI_RETRIES = register(Counter(
+    "kosh_openai_retries_total", "OpenAI API calls retried, by lane and the reason for the retry.",
+    labels=("lane", "reason"),
+))
+OPENAI_QUEUE_SECONDS = register(Histogram(
+    "kosh_openai_queue_seconds", "Time OpenAI calls waited for a concurrency slot.", labels=("lane",),
+))
+OPENAI_CONCURRENCY = register(Gauge(
+    "kosh_openai_concurrency_limit", "Current adaptive concurrency limit of each OpenAI lane.", labels=("lane",),
+))
+OPENAI_CIRCUIT_OPEN = register(Gauge(
+    "kosh_openai_circuit_open", "1 while an OpenAI lane's circuit breaker is open or half open.", labels=("lane",),
+))
+PERSISTED_RECORDS = register(Counter(
+    "kosh_persisted_records_total", "Audit records (reports, turns, token usage) by outcome: written, failed or dropped.",
+    labels=("model", "outcome"),
+))
@@ -0,0 +1,31 @@
+# Generated by Django 5.2.18 on 2026-10-17 15:38
+
+import uuid
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('feedback_agent', '0002_pdfjob'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='IndexJob',
+            fields=[
+                ('id', models.UUIDField(default=uuid.uuid4, editable=False, primary_key=True, serialize=False)),
+                ('status', models.CharField(choices=[('queued', 'Queued'), ('running', 'Running'), ('success', 'Success'), ('error', 'Error')], db_index=True, default='queued', max_length=16)),
+                ('incremental', models.BooleanField(default=True)),
+                ('index_type', models.CharField(max_length=32)),
+                ('index_params', models.JSONField(default=dict)),
+                ('progress', models.JSONField(default=dict)),
+                ('stats', models.JSONField(blank=True, null=True)),
+                ('error', models.TextField(blank=True, default='')),
+                ('created_at', models.DateTimeField(auto_now_add=True)),
+                ('started_at', models.DateTimeField(blank=True, null=True)),
+                ('heartbeat_at', models.DateTimeField(blank=True, null=True)),
+                ('finished_at', models.DateTimeField(blank=True, null=True)),
+            ],
+        ),
+    ]
@@ -0,0 +1,55 @@
+# Generated by Django 5.2.18 on 2026-10-17 15:39
+
+import django.db.models.deletion
+import django.utils.timezone
+import uuid
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('feedback_agent', '0003_indexjob'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='report',
+            name='conversation',
+            field=models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.CASCADE, related_name='reports', to='feedback_agent.conversation'),
+        ),
+        migrations.AddField(
+            model_name='report',
+            name='sha256',
+            field=models.CharField(blank=True, db_index=True, default='', max_length=64),
+        ),
+        migrations.CreateModel(
+            name='Turn',
+            fields=[
+                ('id', models.UUIDField(default=uuid.uuid4, editable=False, primary_key=True, serialize=False)),
+                ('question', models.TextField(blank=True, default='')),
+                ('answer', models.TextField(blank=True, default='')),
+                ('report_sha256', models.CharField(blank=True, default='', max_length=64)),
+                ('cached', models.BooleanField(default=False)),
+                ('streamed', models.BooleanField(default=False)),
+                ('budget_exhausted', models.CharField(blank=True, default='', max_length=16)),
+                ('latency_ms', models.FloatField(blank=True, null=True)),
+                ('created_at', models.DateTimeField(db_index=True, default=django.utils.timezone.now)),
+                ('conversation', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='turns', to='feedback_agent.conversation')),
+                ('pdf_job', models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.SET_NULL, related_name='turns', to='feedback_agent.pdfjob')),
+            ],
+        ),
+        migrations.CreateModel(
+            name='TokenUsage',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('model', models.CharField(max_length=64)),
+                ('purpose', models.CharField(max_length=16)),
+                ('prompt_tokens', models.PositiveIntegerField(default=0)),
+                ('completion_tokens', models.PositiveIntegerField(default=0)),
+                ('cached_prompt_tokens', models.PositiveIntegerField(default=0)),
+                ('estimated', models.BooleanField(default=False)),
+                ('turn', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='token_usage', to='feedback_agent.turn')),
+            ],
+        ),
+    ]
@@ -0,0 +1,22 @@
+# Generated by Django 5.2.18 on 2026-10-17 16:04
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('feedback_agent', '0004_report_conversation_report_sha256_turn_tokenusage'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='indexjob',
+            name='index_dir',
+            field=models.CharField(default='', max_length=500),
+        ),
+        migrations.AddConstraint(
+            model_name='indexjob',
+            constraint=models.UniqueConstraint(condition=models.Q(('status__in', ['queued', 'running'])), fields=('index_dir',), name='one_active_index_job'),
+        ),
+    ]
@@ -2,13 +2,117 @@ from django.db import models
 from django.utils import timezone
 
 import datetime
+import uuid
 
-# Edit this to a report model, then migrate it!
 class Report(models.Model):
-    title=models.CharField(max_length=500)
+    """An uploaded report's extracted text, kept for audit (written in the background, see persistence)."""
+    title=models.CharField(max_length=500) # The uploaded file names
     content=models.TextField()
     timestamp = models.DateTimeField(auto_now_add=True)
+    conversation=models.ForeignKey("Conversation", null=True, blank=True, on_delete=models.CASCADE, related_name="reports")
+    sha256=models.CharField(max_length=64, blank=True, default="", db_index=True)
 
     # string representation of the class
     def __str__(self):
-        return self.title 
\ No newline at end of file
+        return self.title
+
+
+class Conversation(models.Model):
+    """A chat session: the extracted report, recent history and a summary of older turns."""
+    id=models.UUIDField(primary_key=True, default=uuid.uuid4, editable=False)
+    user_report_content=models.TextField(blank=True, default="")
+    summary=models.TextField(blank=True, default="") # Running summary of turns rolled out of history
+    messages=models.JSONField(default=list) # Recent turns, as LangChain message dicts
+    version=models.PositiveIntegerField(default=0) # Bumped on every save, to spot stale cached copies and concurrent saves
+    created_at=models.DateTimeField(auto_now_add=True)
+    updated_at=models.DateTimeField(auto_now=True)
+
+    def __str__(self):
+        return str(self.id)
+
+
+class PdfJob(models.Model):
+    """A session summary PDF waiting to be, or already, rendered by the background queue."""
+    QUEUED = "queued"
+    RUNNING = "running"
+    SUCCESS = "success"
+    ERROR = "error"
+    STATUS_CHOICES = [(QUEUED, "Queued"), (RUNNING, "Running"), (SUCCESS, "Success"), (ERROR, "Error")]
+
+    id=models.UUIDField(primary_key=True, default=uuid.uuid4, editable=False)
+    status=models.CharField(max_length=16, choices=STATUS_CHOICES, default=QUEUED, db_index=True)
+    summary_content=models.TextField()
+    filename=models.CharField(max_length=255)
+    error=models.TextField(blank=True, default="")
+    created_at=models.DateTimeField(auto_now_add=True)
+    started_at=models.DateTimeField(null=True, blank=True)
+    finished_at=models.DateTimeField(null=True, blank=True)
+
+    def __str__(self):
+        return f"{self.filename} ({self.status})"
+
+
+class IndexJob(models.Model):
+    """A background run of setup_vector_db, with its progress so far."""
+    QUEUED = "queued"
+    RUNNING = "running"
+    SUCCESS = "success"
+    ERROR = "error"
+    STATUS_CHOICES = [(QUEUED, "Queued"), (RUNNING, "Running"), (SUCCESS, "Success"), (ERROR, "Error")]
+
+    id=models.UUIDField(primary_key=True, default=uuid.uuid4, editable=False)
+    status=models.CharField(max_length=16, choices=STATUS_CHOICES, default=QUEUED, db_index=True)
+    index_dir=models.CharField(max_length=500, default="") # The index being built; one active job per index
+    incremental=models.BooleanField(default=True)
+    index_type=models.CharField(max_length=32)
+    index_params=models.JSONField(default=dict)
+    progress=models.JSONField(default=dict) # Running statistics from build_index, plus rate and ETA
+    stats=models.JSONField(null=True, blank=True) # build_index's result once finished
+    error=models.TextField(blank=True, default="")
+    created_at=models.DateTimeField(auto_now_add=True)
+    started_at=models.DateTimeField(null=True, blank=True)
+    heartbeat_at=models.DateTimeField(null=True, blank=True) # Last progress update from the worker
+    finished_at=models.DateTimeField(null=True, blank=True)
+
+    class Meta:
+        constraints = [
+            # Only one build per index at a time, however many processes take requests
+            models.UniqueConstraint(
+                fields=["index_dir"], condition=models.Q(status__in=["queued", "running"]), name="one_active_index_job",
+            ),
+        ]
+
+    def __str__(self):
+        return f"{self.id} ({self.status})"
+
+
+class Turn(models.Model):
+    """One question and answer of a conversation, kept for audit."""
+    id=models.UUIDField(primary_key=True, default=uuid.uuid4, editable=False)
+    conversation=models.ForeignKey(Conversation, on_delete=models.CASCADE, related_name="turns")
+    question=models.TextField(blank=True, default="")
+    answer=models.TextField(blank=True, default="")
+    report_sha256=models.CharField(max_length=64, blank=True, default="") # The report the turn was answered against
+    cached=models.BooleanField(default=False) # Served from the semantic cache
+    streamed=models.BooleanField(default=False)
+    budget_exhausted=models.CharField(max_length=16, blank=True, default="") # Why the answer was forced, if it was
+    latency_ms=models.FloatField(null=True, blank=True)
+    pdf_job=models.ForeignKey(PdfJob, null=True, blank=True, on_delete=models.SET_NULL, related_name="turns")
+    created_at=models.DateTimeField(default=timezone.now, db_index=True)
+
+    def __str__(self):
+        return f"{self.conversation_id} @ {self.created_at:%Y-%m-%d %H:%M:%S}"
+
+
+class TokenUsage(models.Model):
+    """Tokens used by one LLM call made while answering a turn."""
+    turn=models.ForeignKey(Turn, on_delete=models.CASCADE, related_name="token_usage")
+    model=models.CharField(max_length=64)
+    purpose=models.CharField(max_length=16) # "chat" (an agent step) or "summary" (history compaction)
+    prompt_tokens=models.PositiveIntegerField(default=0)
+    completion_tokens=models.PositiveIntegerField(default=0)
+    cached_prompt_tokens=models.PositiveIntegerField(default=0)
+    estimated=models.BooleanField(default=False) # Counted locally because the API didn't report usage
+
+    def __str__(self):
+        return f"{self.model} {self.purpose}: {self.prompt_tokens}+{self.completion_tokens}"
@@ -0,0 +1,444 @@
+"""
+The HTTP layer under every OpenAI call: pooled connections, adaptive
+concurrency limits, retries and a circuit breaker.
+
+Traffic is split into lanes - "chat" (llm_call and history summaries) and
+"embeddings" (retriever queries and indexing) - each with its own connection
+pool, limiter and breaker, so a burst of indexing can't queue up chat calls.
+Within the embeddings lane, indexing is bulk traffic: it may only use
+OPENAI_BULK_SHARE of the lane's slots, and never takes a slot while a query
+embedding is waiting for one.
+
+Each lane's limiter adapts like TCP congestion control. Every successful
+response raises the limit by 1/limit (so +1 per round of requests), up to the
+lane's maximum; a 429 halves it. When a response says the request or token
+quota is used up (x-ratelimit-remaining-* is 0), or a 429 carries retry-after,
+the lane pauses until the quota resets instead of sending requests that would
+be rejected.
+
+429s, 5xx responses, timeouts and connection errors are retried with full
+jitter exponential backoff (or after retry-after), up to OPENAI_MAX_RETRIES
+times. The caller's read timeout bounds the whole call, retries included, so
+an agent step never overruns its budget waiting on backoff. After
+OPENAI_BREAKER_FAILURES consecutive failures the lane's circuit opens and
+calls fail at once for OPENAI_BREAKER_RESET_SECONDS, then a single trial call
+decides whether it closes again. retriever_tool's hybrid search falls back to
+keywords only while the embeddings circuit is open.
+
+The OpenAI SDK's own retries are switched off (max_retries=0) so that retries
+only happen here. Only the sync client is routed through this layer; the
+agent's graph nodes make their model calls synchronously.
+"""
+import email.utils
+import random
+import re
+import threading
+import time
+from functools import lru_cache
+
+import httpx
+from django.conf import settings
+
+from .metrics import OPENAI_CIRCUIT_OPEN, OPENAI_CONCURRENCY, OPENAI_QUEUE_SECONDS, OPENAI_REQUESTS, OPENAI_RETRIES
+
+LANES = ("chat", "embeddings")
+
+RETRY_STATUSES = {408, 409, 429, 500, 502, 503, 504}
+
+# A burst of 429s from requests already in flight counts as one signal, not many
+DECREASE_COOLDOWN_SECONDS = 1.0
+
+
+class CircuitOpen(httpx.TransportError):
+    """The lane's circuit breaker is open; the call wasn't attempted."""
+
+
+class QueueTimeout(httpx.PoolTimeout):
+    """No concurrency slot became free before the call's timeout."""
+
+
+#################### Rate-limit headers ######################
+
+_DURATION_PART = re.compile(r"(\d+(?:\.\d+)?)(ms|s|m|h)")
+_DURATION_UNITS = {"ms": 0.001, "s": 1, "m": 60, "h": 3600}
+
+def parse_duration(value):
+    """Seconds in an x-ratelimit-reset-* value such as "20ms", "1s" or "6m0s", or None."""
+    if not value:
+        return None
+    parts = _DURATION_PART.findall(value)
+    if not parts:
+        return None
+    return sum(float(number) * _DURATION_UNITS[unit] for number, unit in parts)
+
+def retry_after_seconds(headers):
+    """The server's requested wait from retry-after-ms or retry-after (seconds or an HTTP date), or None."""
+    try:
+        if headers.get("retry-after-ms"):
+            return float(headers["retry-after-ms"]) / 1000
+    except ValueError:
+        pass
+    value = headers.get("retry-after")
+    if not value:
+        return None
+    try:
+        return float(value)
+    except ValueError:
+        pass
+    try:
+        return max(0.0, email.utils.parsedate_to_datetime(value).timestamp() - time.time())
+    except (TypeError, ValueError):
+        return None
+
+def quota_reset_seconds(headers):
+    """If the response says a request or token quota is exhausted, seconds until it resets; else None."""
+    waits = []
+    for kind in ("requests", "tokens"):
+        remaining = headers.get(f"x-ratelimit-remaining-{kind}")
+        if remaining is not None and remaining.strip() == "0":
+            waits.append(parse_duration(headers.get(f"x-ratelimit-reset-{kind}")) or 1.0)
+    return max(waits) if waits else None
+
+
+#################### Adaptive limiter ######################
+
+class AdaptiveLimiter:
+    """AIMD concurrency limit for one lane, with a bulk share and pauses for exhausted quotas."""
+
+    def __init__(self, name, max_concurrency, min_concurrency=1, bulk_share=0.5):
+        self.name = name
+        self.max_concurrency = max_concurrency
+        self.min_concurrency = min_concurrency
+        self.bulk_share = bulk_share
+        self.limit = float(max_concurrency)
+        self.in_flight = 0
+        self.bulk_in_flight = 0
+        self.paused_until = 0.0
+        self._interactive_waiting = 0
+        self._last_decrease = 0.0
+        self._condition = threading.Condition()
+        OPENAI_CONCURRENCY.set(self.limit, lane=name)
+
+    def _capacity(self, bulk):
+        capacity = max(self.min_concurrency, int(self.limit))
+        if bulk:
+            return max(1, int(capacity * self.bulk_share))
+        return capacity
+
+    def _can_start(self, bulk, now):
+        if now < self.paused_until or self.in_flight >= self._capacity(False):
+            return False
+        if bulk:
+            return self._interactive_waiting == 0 and self.bulk_in_flight < self._capacity(True)
+        return True
+
+    def acquire(self, bulk=False, timeout=None):
+        """Wait for a slot. Returns False if none came free within timeout seconds."""
+        deadline = None if timeout is None else time.monotonic() + timeout
+        with self._condition:
+            if not bulk:
+                self._interactive_waiting += 1
+            try:
+                while True:
+                    now = time.monotonic()
+                    if self._can_start(bulk, now):
+                        break
+                    wait = None if deadline is None else deadline - now
+                    if wait is not None and wait <= 0:
+                        return False
+                    if now < self.paused_until:
+                        wait = self.paused_until - now if wait is None else min(wait, self.paused_until - now)
+                    self._condition.wait(wait)
+            finally:
+                if not bulk:
+                    self._interactive_waiting -= 1
+                    self._condition.notify_all() # Bulk waiters may go now
+            self.in_flight += 1
+            if bulk:
+                self.bulk_in_flight += 1
+            return True
+
+    def release(self, bulk=False):
+        with self._condition:
+            self.in_flight -= 1
+            if bulk:
+                self.bulk_in_flight -= 1
+            self._condition.notify_all()
+
+    def pause(self, seconds):
+        """Start no new requests for seconds (e.g. until a quota resets)."""
+        with self._condition:
+            self.paused_until = max(self.paused_until, time.monotonic() + seconds)
+
+    def on_success(self):
+        with self._condition:
+            if self.limit < self.max_concurrency:
+                self.limit = min(self.max_concurrency, self.limit + 1 / self.limit)
+                OPENAI_CONCURRENCY.set(self.limit, lane=self.name)
+                self._condition.notify_all()
+
+    def on_throttled(self):
+        with self._condition:
+            now = time.monotonic()
+            if now - self._last_decrease >= DECREASE_COOLDOWN_SECONDS:
+                self._last_decrease = now
+                self.limit = max(self.min_concurrency, self.limit / 2)
+                OPENAI_CONCURRENCY.set(self.limit, lane=self.name)
+
+    def stats(self):
+        with self._condition:
+            return {
+                "limit": round(self.limit, 2),
+                "in_flight": self.in_flight,
+                "bulk_in_flight": self.bulk_in_flight,
+                "paused_for_s": round(max(0.0, self.paused_until - time.monotonic()), 2),
+            }
+
+
+#################### Circuit breaker ######################
+
+class CircuitBreaker:
+    """Closed -> open after failure_threshold consecutive failures -> half open after reset_seconds."""
+
+    def __init__(self, name, failure_threshold, reset_seconds):
+        self.name = name
+        self.failure_threshold = failure_threshold
+        self.reset_seconds = reset_seconds
+        self.failures = 0
+        self.opened_at = None
+        self._trial_in_flight = False
+        self._lock = threading.Lock()
+
+    @property
+    def state(self):
+        if self.opened_at is None:
+            return "closed"
+        if time.monotonic() - self.opened_at < self.reset_seconds:
+            return "open"
+        return "half_open"
+
+    def allow(self):
+        """Whether a call may go ahead. While half open, only one trial call at a time does."""
+        with self._lock:
+            state = self.state
+            if state == "closed":
+                return True
+            if state == "half_open" and not self._trial_in_flight:
+                self._trial_in_flight = True
+                return True
+            return False
+
+    def record_success(self):
+        with self._lock:
+            self.failures = 0
+            self._trial_in_flight = False
+            if self.opened_at is not None:
+                print(f"OpenAI {self.name} circuit closed")
+                self.opened_at = None
+                OPENAI_CIRCUIT_OPEN.set(0, lane=self.name)
+
+    def record_failure(self):
+        with self._lock:
+            self.failures += 1
+            reopen = self._trial_in_flight
+            self._trial_in_flight = False
+            if reopen or (self.opened_at is None and self.failures >= self.failure_threshold):
+                if self.opened_at is None:
+                    print(f"OpenAI {self.name} circuit opened after {self.failures} consecutive failures")
+                self.opened_at = time.monotonic()
+                OPENAI_CIRCUIT_OPEN.set(1, lane=self.name)
+
+
+#################### Transport ######################
+
+class ReleasingStream(httpx.SyncByteStream):
+    """A response body that gives its concurrency slot back once it has been read or closed."""
+
+    def __init__(self, stream, release):
+        self.stream = stream
+        self.release = release
+        self._released = False
+
+    def __iter__(self):
+        yield from self.stream
+
+    def close(self):
+        try:
+            self.stream.close()
+        finally:
+            if not self._released:
+                self._released = True
+                self.release()
+
+
+class ResilientTransport(httpx.BaseTransport):
+    """
+    Sends each request through a lane's limiter and breaker, retrying failures.
+    A slot is held from sending the request until the response body is closed,
+    so streamed completions count against the limit for as long as they stream.
+    """
+
+    def __init__(self, lane, transport, bulk=False):
+        self.lane = lane
+        self.transport = transport
+        self.bulk = bulk
+
+    def backoff(self, attempt, retry_after):
+        if retry_after is not None:
+            return retry_after + random.uniform(0, settings.OPENAI_BACKOFF_BASE_SECONDS)
+        ceiling = min(settings.OPENAI_BACKOFF_MAX_SECONDS, settings.OPENAI_BACKOFF_BASE_SECONDS * 2 ** attempt)
+        return random.uniform(0, ceiling)
+
+    def handle_request(self, request):
+        limiter, breaker = self.lane.limiter, self.lane.breaker
+        timeouts = request.extensions.get("timeout") or {}
+        # The caller's read timeout covers the whole call, retries and queueing included
+        call_deadline = time.monotonic() + timeouts["read"] if timeouts.get("read") else None
+        attempt = 0
+
+        while True:
+            if breaker.state == "open": # Fail fast rather than queue for a call that won't be made
+                OPENAI_REQUESTS.inc(lane=self.lane.name, outcome="circuit_open")
+                raise CircuitOpen(f"OpenAI {self.lane.name} circuit is open", request=request)
+
+            queue_started = time.perf_counter()
+            queue_timeout = settings.OPENAI_QUEUE_TIMEOUT_SECONDS
+            if call_deadline is not None:
+                queue_timeout = max(0.0, min(queue_timeout, call_deadline - time.monotonic()))
+            if not limiter.acquire(self.bulk, queue_timeout):
+                OPENAI_REQUESTS.inc(lane=self.lane.name, outcome="queue_timeout")
+                raise QueueTimeout(f"No free OpenAI {self.lane.name} slot within {queue_timeout:.1f}s", request=request)
+            OPENAI_QUEUE_SECONDS.observe(time.perf_counter() - queue_started, lane=self.lane.name)
+
+            if not breaker.allow(): # Half open, and another call is already the trial
+                limiter.release(self.bulk)
+                OPENAI_REQUESTS.inc(lane=self.lane.name, outcome="circuit_open")
+                raise CircuitOpen(f"OpenAI {self.lane.name} circuit is open", request=request)
+
+            if call_deadline is not None:
+                request.extensions = {**request.extensions, "timeout": {
+                    **timeouts, "read": max(0.001, call_deadline - time.monotonic()),
+                }}
+
+            try:
+                response = self.transport.handle_request(request)
+            except (httpx.TimeoutException, httpx.NetworkError, httpx.RemoteProtocolError) as e:
+                limiter.release(self.bulk)
+                breaker.record_failure()
+                outcome = "timeout" if isinstance(e, httpx.TimeoutException) else "network_error"
+                if not self.should_retry(attempt, None, call_deadline):
+                    OPENAI_REQUESTS.inc(lane=self.lane.name, outcome=outcome)
+                    raise
+                self.sleep_before_retry(attempt, None, outcome)
+                attempt += 1
+                continue
+            except BaseException:
+                limiter.release(self.bulk)
+                breaker.record_failure()
+                raise
+
+            status = response.status_code
+            retry_after = retry_after_seconds(response.headers)
+            quota_wait = quota_reset_seconds(response.headers)
+            if quota_wait is not None:
+                limiter.pause(quota_wait)
+
+            if status == 429:
+                limiter.on_throttled()
+                breaker.record_success() # Throttled, but up
+                if retry_after is not None:
+                    limiter.pause(retry_after)
+                outcome = "rate_limited"
+            elif status >= 500:
+                breaker.record_failure()
+                outcome = "server_error"
+            else:
+                limiter.on_success()
+                breaker.record_success()
+                outcome = "ok" if status < 400 else "client_error"
+
+            if status in RETRY_STATUSES and self.should_retry(attempt, retry_after, call_deadline):
+                response.close()
+                limiter.release(self.bulk)
+                self.sleep_before_retry(attempt, retry_after, outcome)
+                attempt += 1
+                continue
+
+            OPENAI_REQUESTS.inc(lane=self.lane.name, outcome=outcome)
+            return self.with_release(response)
+
+    def should_retry(self, attempt, retry_after, call_deadline):
+        if attempt >= settings.OPENAI_MAX_RETRIES:
+            return False
+        if call_deadline is None:
+            return True
+        # Don't start a wait that already outlasts the caller's timeout
+        soonest = retry_after if retry_after is not None else 0.0
+        return time.monotonic() + soonest < call_deadline
+
+    def sleep_before_retry(self, attempt, retry_after, reason):
+        OPENAI_RETRIES.inc(lane=self.lane.name, reason=reason)
+        time.sleep(self.backoff(attempt, retry_after))
+
+    def with_release(self, response):
+        """The response, with its body wrapped to release the slot when it's closed."""
+        if response.is_closed: # Body already read in full
+            self.lane.limiter.release(self.bulk)
+        else:
+            response.stream = ReleasingStream(response.stream, lambda: self.lane.limiter.release(self.bulk))
+        return response
+
+    def close(self):
+        pass # The lane's pool is shared by its clients and lives as long as the process
+
+
+#################### Lanes ######################
+
+class Lane:
+    """A connection pool, limiter and breaker shared by the clients of one kind of traffic."""
+
+    def __init__(self, name, max_concurrency):
+        self.name = name
+        self.transport = httpx.HTTPTransport(limits=httpx.Limits(
+            max_connections=settings.OPENAI_MAX_CONNECTIONS,
+            max_keepalive_connections=settings.OPENAI_MAX_CONNECTIONS,
+            keepalive_expiry=settings.OPENAI_KEEPALIVE_SECONDS,
+        ))
+        self.limiter = AdaptiveLimiter(name, max_concurrency, bulk_share=settings.OPENAI_BULK_SHARE)
+        self.breaker = CircuitBreaker(name, settings.OPENAI_BREAKER_FAILURES, settings.OPENAI_BREAKER_RESET_SECONDS)
+        OPENAI_CIRCUIT_OPEN.set(0, lane=name)
+
+    def stats(self):
+        return {**self.limiter.stats(), "circuit": self.breaker.state}
+
+
+@lru_cache(maxsize=None)
+def get_lane(name):
+    if name not in LANES:
+        raise ValueError(f"Unknown OpenAI lane {name!r}; expected one of {', '.join(LANES)}.")
+    max_concurrency = {
+        "chat": settings.OPENAI_CHAT_MAX_CONCURRENCY,
+        "embeddings": settings.OPENAI_EMBEDDINGS_MAX_CONCURRENCY,
+    }[name]
+    return Lane(name, max_concurrency)
+
+@lru_cache(maxsize=None)
+def http_client(lane, bulk=False):
+    """An httpx.Client for the OpenAI SDK (http_client=...) whose requests go through lane."""
+    return httpx.Client(
+        transport=ResilientTransport(get_lane(lane), get_lane(lane).transport, bulk=bulk),
+        timeout=httpx.Timeout(settings.OPENAI_TIMEOUT_SECONDS, connect=settings.OPENAI_CONNECT_TIMEOUT_SECONDS),
+        follow_redirects=True,
+    )
+
+def retry_after(name):
+    """Whole seconds a client should wait before retrying a call that failed in lane (at least 1)."""
+    lane = get_lane(name)
+    waits = [lane.limiter.paused_until - time.monotonic()]
+    if lane.breaker.opened_at is not None:
+        waits.append(lane.breaker.opened_at + lane.breaker.reset_seconds - time.monotonic())
+    return max(1, round(max(waits)))
+
+def lane_stats():
+    """Limiter and breaker state of each lane created so far in this process."""
+    return {name: get_lane(name).stats() for name in LANES}
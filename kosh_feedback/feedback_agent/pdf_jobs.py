@@ -0,0 +1,134 @@
+"""
+Background rendering of session summary PDFs.
+
+pdf_tool only records a PdfJob row and returns its ID and eventual URL, so the
+chat turn doesn't wait on ReportLab. Jobs are rendered by a small in-process
+worker pool; the job table is the queue, so no external broker is needed.
+Claiming a job is a conditional UPDATE, so a job is only ever rendered once even
+when several server processes pick up the same leftover work.
+"""
+import os
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from datetime import timedelta
+
+from django.conf import settings
+from django.db import close_old_connections
+from django.utils import timezone
+
+from reportlab.lib.pagesizes import letter
+from reportlab.lib.styles import getSampleStyleSheet
+from reportlab.platypus import SimpleDocTemplate, Paragraph, Spacer
+from reportlab.lib.units import inch
+
+from .models import PdfJob
+from .tracing import span
+
+PDF_SUBDIR = "generated_pdfs"
+
+
+def pdf_path(filename):
+    return os.path.join(settings.MEDIA_ROOT, PDF_SUBDIR, filename)
+
+def pdf_url(filename):
+    # This assumes MEDIA_URL is correctly set and your web server
+    # (or Django dev server) is serving files from MEDIA_ROOT
+    return f"{settings.MEDIA_URL}{PDF_SUBDIR}/{filename}"
+
+def render_pdf(summary_content, pdf_filepath):
+    """Build the summary PDF with ReportLab."""
+    os.makedirs(os.path.dirname(pdf_filepath), exist_ok=True) # Ensure directory exists
+    doc = SimpleDocTemplate(pdf_filepath, pagesize=letter)
+    styles = getSampleStyleSheet()
+    story = []
+
+    story.append(Paragraph("<b>Kosh Feedback Session Summary</b>", styles['h1']))
+    story.append(Spacer(1, 0.2 * inch))
+
+    formatted_summary = summary_content.replace('\n', '<br/>')
+    story.append(Paragraph(formatted_summary, styles['Normal']))
+    story.append(Spacer(1, 0.2 * inch))
+
+    doc.build(story)
+
+
+#################### Worker pool ######################
+
+_executor = None
+_executor_lock = threading.Lock()
+
+_enqueue_lock = threading.Lock()
+
+def get_executor():
+    """The shared worker pool."""
+    global _executor
+    with _executor_lock:
+        if _executor is None:
+            _executor = ThreadPoolExecutor(max_workers=settings.PDF_RENDER_WORKERS, thread_name_prefix="pdf-render")
+        return _executor
+
+def recover_pending():
+    """Requeue jobs stuck in RUNNING (their worker died) and return the IDs of all queued jobs."""
+    stale_before = timezone.now() - timedelta(seconds=settings.PDF_JOB_STALE_SECONDS)
+    PdfJob.objects.filter(status=PdfJob.RUNNING, started_at__lt=stale_before).update(status=PdfJob.QUEUED)
+    return list(PdfJob.objects.filter(status=PdfJob.QUEUED).values_list("id", flat=True))
+
+def run_job(job_id):
+    """Render one job. Runs on a worker thread."""
+    try:
+        claimed = PdfJob.objects.filter(pk=job_id, status=PdfJob.QUEUED).update(
+            status=PdfJob.RUNNING, started_at=timezone.now())
+        if not claimed:
+            return # Already taken by another worker
+
+        job = PdfJob.objects.get(pk=job_id)
+        try:
+            with span("pdf_render", job_id=str(job_id), characters=len(job.summary_content)):
+                render_pdf(job.summary_content, pdf_path(job.filename))
+        except Exception as e:
+            print(f"Error generating PDF: {e}")
+            PdfJob.objects.filter(pk=job_id).update(status=PdfJob.ERROR, error=str(e), finished_at=timezone.now())
+            return
+        PdfJob.objects.filter(pk=job_id).update(status=PdfJob.SUCCESS, finished_at=timezone.now())
+    finally:
+        close_old_connections() # Worker threads hold their own DB connections
+
+
+#################### API ######################
+
+def recover():
+    """
+    Take over jobs whose worker died, in this process or another. run_job's claim
+    makes sure a job still queued in a live worker only runs once.
+    """
+    executor = get_executor()
+    with _enqueue_lock:
+        for job_id in recover_pending():
+            executor.submit(run_job, job_id)
+
+def enqueue(summary_content):
+    """Record a job and hand it to the worker pool. Returns the PdfJob."""
+    recover()
+    job = PdfJob(summary_content=summary_content)
+    job.filename = f"career_coach_summary_{job.id}.pdf"
+    job.save()
+    get_executor().submit(run_job, job.id)
+    return job
+
+def job_info(job):
+    """What the API (and the LLM) is told about a job."""
+    info = {
+        "status": job.status,
+        "job_id": str(job.id),
+        "url": pdf_url(job.filename),
+        "filename": job.filename,
+        "status_url": f"/api/pdf_jobs/{job.id}/",
+    }
+    if job.status == PdfJob.QUEUED or job.status == PdfJob.RUNNING:
+        info["message"] = "PDF summary is being generated and will be available at the URL shortly."
+    elif job.status == PdfJob.SUCCESS:
+        info["message"] = "PDF summary successfully generated."
+    else:
+        info["message"] = f"Failed to generate PDF summary: {job.error}"
+        info["url"] = None
+    return info
@@ -0,0 +1,248 @@
+"""
+Background, batched writes of conversation sessions and the audit trail:
+uploaded reports, turns and the LLM token usage of each turn.
+
+Views build the model instances (which needs no queries) and enqueue() only
+puts them on an in-process queue, so a chat turn never waits on the database
+for its audit records. A single writer thread takes up to
+PERSISTENCE_BATCH_SIZE records at a time, waiting at most
+PERSISTENCE_FLUSH_SECONDS for a batch to fill, and writes each batch with one
+bulk_create per model in a single transaction. If a batch can't be written as
+a whole (say, a conversation was purged in the meantime), its records are
+saved one by one and only the bad ones are dropped. When the queue is full,
+new records are dropped and counted rather than slowing requests down.
+
+Session rows (see sessions) go through the same queue, ahead of the turns that
+refer to them, but are never dropped: save_conversation waits for room in a
+full queue, and with persistence turned off writes the row straight away.
+Each is a conditional UPDATE on the version it was made from; when another
+server process saved the conversation first, the turn is added on top of that
+version instead of overwriting it.
+
+The same thread runs the retention cleanup (see retention) every
+RETENTION_CLEANUP_INTERVAL_SECONDS.
+"""
+import atexit
+import queue
+import threading
+import time
+from dataclasses import dataclass
+
+from django.conf import settings
+from django.db import IntegrityError, close_old_connections, transaction
+from django.utils import timezone
+
+from .metrics import PERSISTED_RECORDS
+from .models import Conversation, Report, TokenUsage, Turn
+from .report_index import report_hash
+from .retention import purge_expired
+
+# Parents before children, so a batch's foreign keys resolve
+WRITE_ORDER = (Report, Turn, TokenUsage)
+
+# Everything of a session row that a save changes
+CONVERSATION_FIELDS = ("user_report_content", "summary", "messages", "version")
+
+# Times a session write is reapplied on top of newer versions before it's given up
+CONVERSATION_WRITE_ATTEMPTS = 5
+
+
+@dataclass
+class ConversationWrite:
+    """A new version of a session row, and what it changed since the version it was made from."""
+    conversation: Conversation
+    base_version: int
+    new_messages: list = None # Message dicts added since base_version; None when it only applies on top of it
+    new_report: bool = False # Whether it replaced the report
+
+_queue = None
+_writer = None
+_writer_lock = threading.Lock()
+
+
+#################### Writer ######################
+
+def get_queue():
+    """The record queue, starting the writer thread on first use."""
+    global _queue, _writer
+    with _writer_lock:
+        if _writer is None:
+            _queue = queue.Queue(maxsize=settings.PERSISTENCE_QUEUE_SIZE)
+            _writer = threading.Thread(target=run_writer, name="persistence", daemon=True)
+            _writer.start()
+            atexit.register(flush, settings.PERSISTENCE_FLUSH_SECONDS * 5)
+        return _queue
+
+def take_batch(records_queue, wait):
+    """Up to PERSISTENCE_BATCH_SIZE queued groups of records; waits up to wait seconds for the first."""
+    try:
+        batch = [records_queue.get(timeout=wait)]
+    except queue.Empty:
+        return []
+    deadline = time.monotonic() + settings.PERSISTENCE_FLUSH_SECONDS
+    while sum(len(group) for group in batch) < settings.PERSISTENCE_BATCH_SIZE:
+        left = deadline - time.monotonic()
+        if left <= 0:
+            break
+        try:
+            batch.append(records_queue.get(timeout=left))
+        except queue.Empty:
+            break
+    return batch
+
+def write_conversation(write):
+    """
+    Update the session row if it's still at write.base_version, or create it. If
+    another write got there first, add write's messages (and report, if it
+    replaced it) to the newer version and try again. Returns whether it was written.
+    """
+    conversation = write.conversation
+    base_version = write.base_version
+    for _ in range(CONVERSATION_WRITE_ATTEMPTS):
+        fields = {name: getattr(conversation, name) for name in CONVERSATION_FIELDS}
+        if Conversation.objects.filter(pk=conversation.pk, version=base_version).update(
+                updated_at=timezone.now(), **fields):
+            return True
+
+        current = Conversation.objects.filter(pk=conversation.pk).values(*CONVERSATION_FIELDS).first()
+        if current is None:
+            try:
+                with transaction.atomic():
+                    Conversation.objects.create(id=conversation.pk, **fields)
+                return True
+            except IntegrityError:
+                continue # Created by another process since we looked
+        if write.new_messages is None:
+            return False
+
+        conversation.messages = current["messages"] + write.new_messages
+        conversation.summary = current["summary"]
+        if not write.new_report:
+            conversation.user_report_content = current["user_report_content"]
+        conversation.version = current["version"] + 1
+        base_version = current["version"]
+    return False
+
+def write_conversations(writes):
+    """Write session rows in the order they were saved."""
+    for write in writes:
+        try:
+            written = write_conversation(write)
+        except Exception as e:
+            print(f"Could not write conversation {write.conversation.pk}: {e!r}")
+            written = False
+        PERSISTED_RECORDS.inc(model="Conversation", outcome="written" if written else "failed")
+
+def write_batch(records):
+    """bulk_create the records, model by model; falls back to saving them one at a time."""
+    # Sessions first, so the turns queued with them can refer to them
+    conversations = [r for r in records if type(r) is ConversationWrite]
+    if conversations:
+        write_conversations(conversations)
+        records = [r for r in records if type(r) is not ConversationWrite]
+        if not records:
+            return
+
+    by_model = {model: [r for r in records if type(r) is model] for model in WRITE_ORDER}
+    try:
+        with transaction.atomic():
+            for model, objs in by_model.items():
+                if objs:
+                    model.objects.bulk_create(objs)
+    except Exception as e:
+        print(f"Batch of {len(records)} audit records failed ({e!r}), saving them one by one")
+        for model, objs in by_model.items():
+            for obj in objs:
+                try:
+                    obj.save(force_insert=True)
+                except Exception as e:
+                    print(f"Dropping {model.__name__} record: {e!r}")
+                    PERSISTED_RECORDS.inc(model=model.__name__, outcome="failed")
+                else:
+                    PERSISTED_RECORDS.inc(model=model.__name__, outcome="written")
+        return
+    for model, objs in by_model.items():
+        if objs:
+            PERSISTED_RECORDS.inc(len(objs), model=model.__name__, outcome="written")
+
+def run_writer():
+    records_queue = _queue
+    last_cleanup = None
+    while True:
+        # Wake up at least once a minute so the cleanup runs on an idle server too
+        batch = take_batch(records_queue, wait=60)
+        try:
+            if batch:
+                write_batch([record for group in batch for record in group])
+
+            interval = settings.RETENTION_CLEANUP_INTERVAL_SECONDS
+            if interval and (last_cleanup is None or time.monotonic() - last_cleanup >= interval):
+                last_cleanup = time.monotonic()
+                try:
+                    print(f"Retention cleanup: {purge_expired()}")
+                except Exception as e:
+                    print(f"Retention cleanup failed: {e!r}")
+        finally:
+            for _ in batch:
+                records_queue.task_done()
+            close_old_connections() # The writer thread holds its own DB connection
+
+
+#################### API ######################
+
+def enqueue(*records):
+    """Queue model instances to be written together. Never blocks; drops them if the queue is full."""
+    if not settings.PERSISTENCE_ENABLED or not records:
+        return
+    try:
+        get_queue().put_nowait(records)
+    except queue.Full:
+        for record in records:
+            PERSISTED_RECORDS.inc(model=type(record).__name__, outcome="dropped")
+
+def save_conversation(write):
+    """Queue a ConversationWrite, waiting for room if the queue is full."""
+    if not settings.PERSISTENCE_ENABLED:
+        write_conversations([write])
+        return
+    get_queue().put((write,))
+
+def flush(timeout=None):
+    """Wait until everything queued so far is written (or timeout seconds pass). Returns whether it was."""
+    if _queue is None:
+        return True
+    if timeout is None:
+        _queue.join()
+        return True
+    deadline = time.monotonic() + timeout
+    while _queue.unfinished_tasks:
+        if time.monotonic() >= deadline:
+            return False
+        time.sleep(0.01)
+    return True
+
+def save_report(session, files):
+    """Record the report just uploaded to session."""
+    enqueue(Report(
+        conversation_id=session.id,
+        title=", ".join(f.name for f in files)[:500],
+        content=session.report,
+        sha256=report_hash(session.report),
+    ))
+
+def save_turn(session, question, answer, trace=None, cached=False, streamed=False,
+              budget_exhausted=None, latency_ms=None, pdf_info=None):
+    """Record a finished turn, with the tokens of every LLM call the trace saw."""
+    turn = Turn(
+        conversation_id=session.id,
+        question=question or "",
+        answer=answer or "",
+        report_sha256=report_hash(session.report) if session.report else "",
+        cached=cached,
+        streamed=streamed,
+        budget_exhausted=budget_exhausted or "",
+        latency_ms=latency_ms,
+        pdf_job_id=(pdf_info or {}).get("job_id"),
+    )
+    usage = [TokenUsage(turn=turn, **call) for call in (trace.llm_usage if trace is not None else [])]
+    enqueue(turn, *usage)
@@ -0,0 +1,176 @@
+"""
+Prompt assembly for llm_call.
+
+Messages are laid out most-stable first so the provider's prompt cache can reuse
+the longest possible prefix across the steps of a tool loop and across turns:
+
+    system prompt -> client report -> summary of earlier turns -> history
+
+The system prompt is built once at import, and the report and summary messages
+are memoised, so the prefix is byte-identical from step to step. A long report
+is represented by its opening only; report_tool looks up the rest on demand
+(see report_index).
+
+fit_to_budget() keeps the whole prompt inside CONTEXT_WINDOW_TOKENS by trimming
+retrieved documents and then dropping the oldest history turns.
+"""
+import hashlib
+from functools import lru_cache
+
+from django.conf import settings
+from langchain_core.messages import HumanMessage, SystemMessage, ToolMessage
+
+from .report_index import SECTION_SEPARATOR, is_long, overview
+from .tokens import MESSAGE_OVERHEAD_TOKENS, count_message_tokens, count_tokens, message_text
+
+# System prompt to guide the LLM on tool usage and content generation
+SYSTEM_PROMPT = (
+    "You are a compassionate and insightful career coach. Your primary goal is to provide "
+    "comprehensive, detailed and verbose analysis and actionable guidance based on the client's psychometric reports "
+    "and our conversation.\n\n"
+    "**Context for Analysis:**\n"
+    "- Use the `retriever_tool` to access information from our pool of research resources when needed. "
+    "  Provide a precise search `query` to this tool, or pass several related searches at once as a list in `queries`.\n"
+    "- The client's uploaded psychometric report content is available to you. "
+    "  Integrate insights from this 'User Report Content' into your analysis.\n"
+    "- When only an overview of a long report is included, use the `report_tool` to look up the sections of the "
+    "  report relevant to the question (e.g. specific traits, scores or recommendations) before answering.\n\n"
+    "**Tool Usage Guidelines:**\n"
+    "- If the client asks to **end the session**, **generate a summary**, or requests a **PDF of the session/report**, "
+    "  you **must** use the `pdf_tool`.\n"
+    "- When calling the `pdf_tool`, you **must** provide the *entire summary content* as the `summary_content` argument. "
+    "  This `summary_content` should be a comprehensive text that includes:\n"
+    "    1.  An in-depth analysis of the user's psychometric reports, elaborating on strengths and weaknesses.\n"
+    "    2.  A detailed and long summary of the entire conversation up to this point.\n"
+    "    3.  Clear, actionable recommendations for the user's immediate next steps in their career journey.\n"
+    "    Ensure this summary is well-formatted and ready for PDF generation.\n\n"
+    "**Response Formatting:**\n"
+    "- Always format your direct responses using Markdown, compatible with <ReactMarkdown>.\n"
+    "- Provide an in-depth analysis, elaborating on each major sub-point with clear, detailed explanations.\n"
+    "- Offer clear, actionable, and empathetic advice.\n"
+    "- **Crucially, cite specific parts of the retrieved documents (e.g., 'According to Document 3...') when using information from the `retriever_tool`.**\n"
+    "Your final answer should be a well-structured, thorough, verbose and comprehensive and helpful Markdown response to the client, or a tool call."
+)
+
+SYSTEM_MESSAGE = SystemMessage(content=SYSTEM_PROMPT)
+
+# Appended (after the history, so the cached prefix is unchanged) once the turn's execution budget is spent
+FINAL_ANSWER_MESSAGE = SystemMessage(content=(
+    "You have reached the limit of research steps for this turn. Do not call any tools. "
+    "Answer the client now using the report and the documents already retrieved, and mention "
+    "briefly if there is something you could not look up."
+))
+
+# Retrieved documents are never trimmed below this many tokens per tool result
+TOOL_RESULT_MIN_TOKENS = 300
+DOCUMENT_SEPARATOR = "\n\nDocument "
+
+# Tools whose results are ranked blocks that can be trimmed, and what separates the blocks
+TRIMMABLE_TOOLS = {"retriever_tool": DOCUMENT_SEPARATOR, "report_tool": SECTION_SEPARATOR}
+
+
+#################### Stable prefix ######################
+
+@lru_cache(maxsize=256)
+def report_message(report):
+    """The whole report, or for a long one its opening plus a pointer to report_tool."""
+    if not is_long(report):
+        return SystemMessage(content=f"--- Client's Psychometric Report ---\n{report}\n--- End Client's Psychometric Report ---")
+    return SystemMessage(content=(
+        f"--- Client's Psychometric Report (overview) ---\n{overview(report)}\n"
+        f"--- End of overview. The full report is about {count_tokens(report)} tokens long; "
+        f"search it with report_tool. ---"
+    ))
+
+@lru_cache(maxsize=256)
+def summary_message(summary):
+    return SystemMessage(content=f"--- Summary of Earlier Conversation ---\n{summary}\n--- End Summary ---")
+
+@lru_cache(maxsize=512)
+def prefix_tokens(text):
+    """Token count of a prefix message's text, counted once per distinct prefix."""
+    return count_tokens(text) + MESSAGE_OVERHEAD_TOKENS
+
+def prompt_cache_key(report):
+    """Route requests sharing a report to the same provider cache shard."""
+    return hashlib.sha256((report or "").encode("utf-8")).hexdigest()[:32]
+
+
+#################### Budget ######################
+
+def trim_tool_result(content, max_tokens, separator=DOCUMENT_SEPARATOR):
+    """
+    Shorten a retriever result to max_tokens by dropping its last documents
+    (results are ranked, so the tail matters least), cutting into the first
+    document only if it alone is too long.
+    """
+    if count_tokens(content) <= max_tokens:
+        return content
+
+    blocks = content.split(separator)
+    while len(blocks) > 1 and count_tokens(separator.join(blocks)) > max_tokens:
+        blocks.pop()
+    trimmed = separator.join(blocks)
+    if count_tokens(trimmed) > max_tokens:
+        trimmed = trimmed[:max_tokens * 4] # Roughly four characters per token
+    return trimmed + "\n\n[Further retrieved documents were omitted to fit the context window.]"
+
+def fit_to_budget(messages, available_tokens):
+    """
+    Trim conversation messages to fit available_tokens:
+      1. shrink retrieved documents and report sections in tool results, oldest first,
+         down to TOOL_RESULT_MIN_TOKENS
+      2. drop the oldest turns, never the current one (the last HumanMessage onwards)
+    Tool calls and their results always stay together.
+    """
+    messages = list(messages)
+    used = count_message_tokens(messages)
+    if used <= available_tokens:
+        return messages
+
+    for i, message in enumerate(messages):
+        if used <= available_tokens:
+            break
+        if not isinstance(message, ToolMessage) or message.name not in TRIMMABLE_TOOLS:
+            continue
+        current = count_tokens(message_text(message))
+        target = max(TOOL_RESULT_MIN_TOKENS, current - (used - available_tokens))
+        if target < current:
+            trimmed = trim_tool_result(message.content, target, TRIMMABLE_TOOLS[message.name])
+            messages[i] = message.model_copy(update={"content": trimmed})
+            used += count_tokens(trimmed) - current
+
+    # Cut at the start of a later turn until it fits; the last HumanMessage is the furthest cut
+    turn_starts = [i for i, m in enumerate(messages) if isinstance(m, HumanMessage)]
+    cut = 0
+    for start in turn_starts[1:]:
+        if used <= available_tokens:
+            break
+        used -= count_message_tokens(messages[cut:start])
+        cut = start
+    messages = messages[cut:]
+
+    if used > available_tokens:
+        print(f"Prompt still {used} tokens over a {available_tokens} token budget after trimming")
+    return messages
+
+def build_prompt(state, final_answer=False):
+    """
+    Assemble the messages for one llm_call step: stable prefix first, then budgeted history.
+    With final_answer, the model is told to answer without further tool calls.
+    """
+    prefix = [SYSTEM_MESSAGE]
+    if state.get("user_report_content"):
+        prefix.append(report_message(state["user_report_content"]))
+    if state.get("conversation_summary"):
+        prefix.append(summary_message(state["conversation_summary"]))
+
+    available = (
+        settings.CONTEXT_WINDOW_TOKENS
+        - settings.RESPONSE_RESERVE_TOKENS
+        - sum(prefix_tokens(m.content) for m in prefix)
+    )
+    if final_answer:
+        available -= prefix_tokens(FINAL_ANSWER_MESSAGE.content)
+        return prefix + fit_to_budget(state["messages"], available) + [FINAL_ANSWER_MESSAGE]
+    return prefix + fit_to_budget(state["messages"], available)
@@ -0,0 +1,156 @@
+"""
+Ephemeral search index over a client's uploaded report.
+
+A report longer than REPORT_INLINE_MAX_TOKENS is not put into every prompt.
+The prompt keeps its opening as an overview, and report_tool searches the rest:
+the report is split with the same splitter settings as setup_vector_db and
+indexed in memory (a flat FAISS index plus BM25, as a MappedIndex), so the
+hybrid multi-query search used for research documents works on it unchanged.
+
+Indexes are keyed by a hash of the report text and kept in an LRU of
+REPORT_INDEX_CACHE_SIZE per worker process; nothing is written to disk except
+the embedding vectors, through the usual embedding cache. prefetch() starts
+building as soon as a report is uploaded, so the index is usually ready by the
+time the model first asks for it. A worker that has evicted (or never built) a
+session's index rebuilds it on demand from the cached vectors.
+
+If the report's chunks can't be embedded, the search falls back to BM25 only.
+"""
+import hashlib
+import re
+import threading
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+from functools import lru_cache
+
+import faiss
+from django.conf import settings
+from langchain_core.documents import Document
+
+from .ingestion import split_documents
+from .lexical_index import BM25Index
+from .resources import get_embeddings
+from .retrieval import multi_query_search
+from .tokens import count_tokens
+from .tracing import span
+from .vector_index import ChunkStore, MappedIndex
+
+# Starts each file's text when several PDFs are uploaded together
+FILE_HEADER = "=== Report file: {} ==="
+FILE_HEADER_RE = re.compile(r"^=== Report file: (.*) ===$", re.MULTILINE)
+
+SECTION_SEPARATOR = "\n\nSection "
+
+
+def file_header(name):
+    return FILE_HEADER.format(name)
+
+def report_hash(report):
+    return hashlib.sha256(report.encode("utf-8")).hexdigest()
+
+@lru_cache(maxsize=256)
+def is_long(report):
+    """Whether the report is searched with report_tool rather than inlined whole."""
+    return bool(report) and count_tokens(report) > settings.REPORT_INLINE_MAX_TOKENS
+
+@lru_cache(maxsize=256)
+def overview(report):
+    """The opening of a long report, up to REPORT_OVERVIEW_TOKENS, cut at a line break where possible."""
+    budget_chars = settings.REPORT_OVERVIEW_TOKENS * 4 # Roughly four characters per token
+    head = report[:budget_chars]
+    while head and count_tokens(head) > settings.REPORT_OVERVIEW_TOKENS:
+        head = head[:int(len(head) * 0.9)]
+    cut = head.rfind("\n")
+    return head[:cut] if cut > len(head) // 2 else head
+
+def split_report(report):
+    """Chunk the report per uploaded file. Each chunk's metadata has its section number and file."""
+    files = []
+    headers = list(FILE_HEADER_RE.finditer(report))
+    if not headers:
+        files.append((None, report))
+    else:
+        if report[:headers[0].start()].strip():
+            files.append((None, report[:headers[0].start()]))
+        for i, header in enumerate(headers):
+            end = headers[i + 1].start() if i + 1 < len(headers) else len(report)
+            files.append((header.group(1), report[header.end():end]))
+
+    docs = [Document(page_content=text, metadata={"file": name} if name else {}) for name, text in files]
+    chunks = split_documents(docs)
+    for section, chunk in enumerate(chunks, start=1):
+        chunk.metadata["section"] = section
+    return chunks
+
+
+#################### Index cache ######################
+
+def build(report):
+    """In-memory MappedIndex over the report's chunks."""
+    chunks = split_report(report)
+    texts = [chunk.page_content for chunk in chunks]
+    metadatas = [chunk.metadata for chunk in chunks]
+    ids = [f"report-{chunk.metadata['section']}" for chunk in chunks]
+    with span("report_index_build", chunks=len(chunks)):
+        return MappedIndex.from_texts(texts, get_embeddings(), metadatas=metadatas, ids=ids)
+
+def build_lexical_only(report):
+    """Keyword-only index for when the chunks can't be embedded; searched with mode="lexical"."""
+    chunks = split_report(report)
+    texts = [chunk.page_content for chunk in chunks]
+    return MappedIndex(
+        faiss.IndexFlatL2(1), ChunkStore.from_texts(texts),
+        [f"report-{chunk.metadata['section']}" for chunk in chunks], [chunk.metadata for chunk in chunks],
+        get_embeddings(), BM25Index.build(texts),
+    )
+
+@lru_cache(maxsize=1)
+def get_build_executor():
+    return ThreadPoolExecutor(max_workers=2, thread_name_prefix="report-index")
+
+_indexes = OrderedDict() # report hash -> Future of a MappedIndex
+_indexes_lock = threading.Lock()
+
+def _future_for(report):
+    key = report_hash(report)
+    with _indexes_lock:
+        future = _indexes.get(key)
+        if future is None or (future.done() and future.exception() is not None):
+            future = get_build_executor().submit(build, report)
+            _indexes[key] = future
+        _indexes.move_to_end(key)
+        while len(_indexes) > settings.REPORT_INDEX_CACHE_SIZE:
+            _indexes.popitem(last=False)
+        return future
+
+def prefetch(report):
+    """Start indexing a long report in the background. Short reports aren't indexed."""
+    if is_long(report):
+        _future_for(report)
+
+def get_report_index(report, timeout=None):
+    """The report's index, building it if needed. Raises if the build fails or outlasts timeout."""
+    return _future_for(report).result(timeout=timeout)
+
+
+#################### Search ######################
+
+def search(report, queries):
+    """The report sections most relevant to queries, in the order they appear in the report."""
+    k = settings.REPORT_RETRIEVAL_K
+    max_tokens = settings.REPORT_RETRIEVAL_MAX_TOKENS
+    try:
+        store = get_report_index(report, timeout=settings.REPORT_INDEX_BUILD_TIMEOUT_SECONDS)
+        docs = multi_query_search(store, queries, k=k, max_tokens=max_tokens)
+    except Exception as e:
+        print(f"Report index unavailable, using keyword search only: {e!r}")
+        docs = multi_query_search(build_lexical_only(report), queries, k=k, max_tokens=max_tokens, mode="lexical")
+    return sorted(docs, key=lambda doc: doc.metadata["section"])
+
+def format_sections(docs):
+    """report_tool's output: one block per section, separated by SECTION_SEPARATOR so they can be trimmed."""
+    blocks = []
+    for doc in docs:
+        source = f" (from {doc.metadata['file']})" if doc.metadata.get("file") else ""
+        blocks.append(f"{doc.metadata['section']}{source}:\n{doc.page_content}")
+    return SECTION_SEPARATOR.lstrip("\n") + SECTION_SEPARATOR.join(blocks)
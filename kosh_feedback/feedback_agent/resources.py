@@ -0,0 +1,151 @@
+"""
+Process-wide registry for the LLM client, embeddings and vector store.
+
+Nothing is created at import time: each resource is built on first use, once per
+process, behind a lock. The vector store is reloaded when the index on disk is
+replaced (by setup_vector_db in this or any other worker process), so a rebuilt
+index is picked up without a restart. Call warm_up() to pay the loading cost
+before the first request instead of during it.
+"""
+import os
+import threading
+import time
+
+from django.conf import settings
+from langchain_openai import ChatOpenAI
+
+from .embedding_cache import cached_openai_embeddings
+from .index_types import apply_search_params
+from .indexing import MANIFEST_FILENAME
+from .openai_client import http_client
+from .vector_index import MappedIndex, FAISS_FILENAME
+
+
+class IndexNotAvailable(Exception):
+    """Raised when the research index has not been built yet (or can't be read)."""
+
+
+_lock = threading.RLock()
+_llm = None
+_embeddings = None
+_indexing_embeddings = None
+_vectorstore = None
+_vectorstore_version = None
+_last_version_check = 0.0
+
+
+#################### LLM and embeddings ######################
+
+def get_llm():
+    global _llm
+    if _llm is None:
+        with _lock:
+            if _llm is None:
+                # stream_usage so streamed calls report token counts for tracing too
+                _llm = ChatOpenAI(
+                    model=settings.CHAT_MODEL, temperature=0.3, stream_usage=True,
+                    http_client=http_client("chat"), max_retries=0, # Retries happen in openai_client
+                )
+    return _llm
+
+def get_embeddings():
+    """Embeddings for live traffic: retriever queries and the semantic cache."""
+    global _embeddings
+    if _embeddings is None:
+        with _lock:
+            if _embeddings is None:
+                _embeddings = cached_openai_embeddings(http_client=http_client("embeddings"))
+    return _embeddings
+
+def get_indexing_embeddings():
+    """Embeddings for bulk indexing, which only gets the embeddings lane's slots that queries leave free."""
+    global _indexing_embeddings
+    if _indexing_embeddings is None:
+        with _lock:
+            if _indexing_embeddings is None:
+                _indexing_embeddings = cached_openai_embeddings(http_client=http_client("embeddings", bulk=True))
+    return _indexing_embeddings
+
+
+#################### Vector store ######################
+
+def index_version(index_dir=None):
+    """
+    Identify the index currently on disk, or None if there isn't one.
+    A swapped-in index is a new file, so its inode and mtime both change.
+    """
+    index_dir = index_dir or settings.VECTORSTORE_DIR
+    for filename in (MANIFEST_FILENAME, FAISS_FILENAME):
+        try:
+            stat = os.stat(os.path.join(index_dir, filename))
+        except FileNotFoundError:
+            continue
+        return (filename, stat.st_ino, stat.st_mtime_ns)
+    return None
+
+def load_vector_db():
+    """Memory-map the index in VECTORSTORE_DIR. Nothing is unpickled."""
+    try:
+        # Resolve the symlink once, so every file comes from the same index version
+        store = MappedIndex.load(os.path.realpath(settings.VECTORSTORE_DIR), get_embeddings())
+    except (OSError, RuntimeError, ValueError) as e:
+        raise IndexNotAvailable(f"No usable vector index at {settings.VECTORSTORE_DIR}: {e}") from e
+    apply_search_params(store.index, settings.VECTOR_INDEX_SEARCH_PARAMS)
+    return store
+
+def get_vectorstore():
+    """
+    The loaded vector store. Every INDEX_RELOAD_CHECK_SECONDS the index on disk is
+    checked and, if it has been replaced, reloaded. If the new index can't be
+    loaded (say, it was replaced again mid-load), the loaded one keeps serving
+    until the next check.
+    """
+    global _vectorstore, _vectorstore_version, _last_version_check
+
+    now = time.monotonic()
+    if _vectorstore is not None and now - _last_version_check < settings.INDEX_RELOAD_CHECK_SECONDS:
+        return _vectorstore
+
+    with _lock:
+        _last_version_check = now
+        version = index_version()
+        if _vectorstore is None or version != _vectorstore_version:
+            if version is None:
+                if _vectorstore is not None:
+                    return _vectorstore
+                raise IndexNotAvailable(f"No vector index at {settings.VECTORSTORE_DIR}. Run setup_vector_db first.")
+            if _vectorstore is not None:
+                print(f"Vector index changed on disk, reloading from {settings.VECTORSTORE_DIR}")
+            try:
+                store = load_vector_db()
+            except IndexNotAvailable as e:
+                if _vectorstore is None:
+                    raise
+                print(f"Keeping the loaded vector index: {e}")
+                return _vectorstore
+            _vectorstore = store
+            _vectorstore_version = version
+        return _vectorstore
+
+def get_retriever():
+    return get_vectorstore().as_retriever()
+
+def invalidate_vectorstore():
+    """Force the next get_vectorstore() call to check the disk (e.g. right after re-indexing)."""
+    global _last_version_check
+    with _lock:
+        _last_version_check = 0.0
+
+
+#################### Warm-up ######################
+
+def warm_up():
+    """Create the LLM client and embeddings and load the index now. Never raises."""
+    started = time.perf_counter()
+    get_llm()
+    get_embeddings()
+    try:
+        get_vectorstore()
+    except IndexNotAvailable as e:
+        print(f"Warm-up: {e}")
+    print(f"Warm-up finished in {(time.perf_counter() - started) * 1000:.0f} ms")
@@ -0,0 +1,101 @@
+"""
+Retention cleanup: deletes generated PDFs and rows past their retention period.
+
+  - PDF jobs (and their files in media/generated_pdfs) finished more than
+    RETENTION_PDF_DAYS ago, plus any PDF file there that no job refers to and
+    that is older than that
+  - conversations idle for RETENTION_CONVERSATION_DAYS, with their reports,
+    turns and token usage
+  - indexing jobs finished more than RETENTION_JOB_DAYS ago
+
+A period of None keeps everything of that kind. Rows are deleted in batches of
+DELETE_BATCH_SIZE so the cleanup never holds a long write lock. It runs in the
+background (see persistence) and from `manage.py purge_expired`.
+"""
+import os
+from datetime import datetime, timedelta
+
+from django.conf import settings
+from django.utils import timezone
+
+from .models import Conversation, IndexJob, PdfJob
+from .pdf_jobs import PDF_SUBDIR, pdf_path
+from .tracing import span
+
+DELETE_BATCH_SIZE = 500
+
+
+def delete_in_batches(queryset, dry_run=False):
+    """Delete the queryset's rows DELETE_BATCH_SIZE at a time. Returns how many there were."""
+    model = queryset.model
+    pks = list(queryset.values_list("pk", flat=True))
+    if not dry_run:
+        for start in range(0, len(pks), DELETE_BATCH_SIZE):
+            model.objects.filter(pk__in=pks[start:start + DELETE_BATCH_SIZE]).delete()
+    return len(pks)
+
+def remove_file(path, dry_run=False):
+    """Delete a file if it exists. Returns whether there was one."""
+    if not os.path.exists(path):
+        return False
+    if not dry_run:
+        try:
+            os.remove(path)
+        except FileNotFoundError:
+            return False
+    return True
+
+def cutoff(days, now):
+    return now - timedelta(days=days) if days is not None else None
+
+
+#################### Cleanup ######################
+
+def purge_pdfs(before, dry_run=False):
+    """Finished PDF jobs created before `before`, their files, and orphaned PDF files older than that."""
+    finished = PdfJob.objects.filter(status__in=(PdfJob.SUCCESS, PdfJob.ERROR), created_at__lt=before)
+    files_removed = 0
+    for filename in finished.values_list("filename", flat=True).iterator():
+        files_removed += remove_file(pdf_path(filename), dry_run)
+    jobs_removed = delete_in_batches(finished, dry_run)
+
+    # Files left behind by jobs deleted some other way
+    directory = os.path.join(settings.MEDIA_ROOT, PDF_SUBDIR)
+    old_files = []
+    if os.path.isdir(directory):
+        with os.scandir(directory) as entries:
+            old_files = [
+                entry.name for entry in entries
+                if entry.is_file() and entry.name.endswith(".pdf")
+                and datetime.fromtimestamp(entry.stat().st_mtime, tz=before.tzinfo) < before
+            ]
+    known = set()
+    for start in range(0, len(old_files), DELETE_BATCH_SIZE):
+        batch = old_files[start:start + DELETE_BATCH_SIZE]
+        known.update(PdfJob.objects.filter(filename__in=batch).values_list("filename", flat=True))
+    orphans_removed = sum(remove_file(pdf_path(name), dry_run) for name in old_files if name not in known)
+
+    return {"pdf_jobs": jobs_removed, "pdf_files": files_removed + orphans_removed}
+
+def purge_expired(now=None, dry_run=False):
+    """Apply every retention period. Returns how many rows and files of each kind were (or would be) deleted."""
+    now = now or timezone.now()
+    counts = {"pdf_jobs": 0, "pdf_files": 0, "conversations": 0, "index_jobs": 0}
+    with span("retention_cleanup", dry_run=dry_run) as attributes:
+        pdf_before = cutoff(settings.RETENTION_PDF_DAYS, now)
+        if pdf_before is not None:
+            counts.update(purge_pdfs(pdf_before, dry_run))
+
+        conversation_before = cutoff(settings.RETENTION_CONVERSATION_DAYS, now)
+        if conversation_before is not None:
+            # Reports, turns and token usage go with their conversation
+            counts["conversations"] = delete_in_batches(
+                Conversation.objects.filter(updated_at__lt=conversation_before), dry_run)
+
+        job_before = cutoff(settings.RETENTION_JOB_DAYS, now)
+        if job_before is not None:
+            counts["index_jobs"] = delete_in_batches(
+                IndexJob.objects.filter(status__in=(IndexJob.SUCCESS, IndexJob.ERROR), finished_at__lt=job_before),
+                dry_run)
+        attributes.update(counts)
+    return counts
@@ -0,0 +1,183 @@
+"""
+Multi-query hybrid retrieval over the research index.
+
+All queries of a tool call are embedded in one batch and searched as a single
+matrix, and each query is also run against the BM25 keyword index built next to
+the vector index. The rankings are merged with reciprocal rank fusion, so a
+chunk that matches a trait name exactly can rank well even when its embedding
+is not among the nearest. Near-duplicate chunks (copies, or neighbours sharing
+most of their text through the splitter's overlap) are dropped, and the
+remainder is picked with maximal marginal relevance until RETRIEVAL_MAX_TOKENS
+is used up.
+
+If the query embedding fails or takes longer than
+RETRIEVAL_EMBEDDING_TIMEOUT_SECONDS, the keyword results are used on their own,
+so retrieval keeps working without the embeddings API.
+"""
+import re
+from concurrent.futures import ThreadPoolExecutor
+from concurrent.futures import TimeoutError as FutureTimeoutError
+from functools import lru_cache
+
+import numpy as np
+from django.conf import settings
+
+from .tokens import count_tokens
+from .tracing import span
+
+WORD_RE = re.compile(r"\w+")
+SHINGLE_SIZE = 3
+
+
+def shingles(text):
+    words = WORD_RE.findall(text.lower())
+    if len(words) < SHINGLE_SIZE:
+        return {tuple(words)}
+    return {tuple(words[i:i + SHINGLE_SIZE]) for i in range(len(words) - SHINGLE_SIZE + 1)}
+
+def overlap(a, b):
+    """Share of the smaller shingle set found in the other - 1.0 when one chunk contains the other."""
+    if not a or not b:
+        return 0.0
+    return len(a & b) / min(len(a), len(b))
+
+def normalize(vectors):
+    vectors = np.asarray(vectors, dtype=np.float32)
+    norms = np.linalg.norm(vectors, axis=1, keepdims=True)
+    norms[norms == 0] = 1.0
+    return vectors / norms
+
+
+def candidate_vectors(store, rows, texts):
+    """Stored vectors for the candidate rows, re-embedding (from the cache) if the index can't reconstruct them."""
+    try:
+        return store.vectors(rows)
+    except RuntimeError:
+        return np.asarray(store.embeddings.embed_documents(texts), dtype=np.float32)
+
+def mmr_order(relevance, doc_vectors, lambda_mult):
+    """Order documents by maximal marginal relevance, given each document's relevance in [0, 1]."""
+    similarity = doc_vectors @ doc_vectors.T
+
+    order = []
+    remaining = list(range(len(doc_vectors)))
+    while remaining:
+        if order:
+            redundancy = similarity[np.ix_(remaining, order)].max(axis=1)
+        else:
+            redundancy = np.zeros(len(remaining))
+        scores = lambda_mult * relevance[remaining] - (1 - lambda_mult) * redundancy
+        order.append(remaining.pop(int(np.argmax(scores))))
+    return order
+
+
+#################### Rankings ######################
+
+@lru_cache(maxsize=1)
+def get_embedding_executor():
+    return ThreadPoolExecutor(max_workers=4, thread_name_prefix="query-embed")
+
+def embed_queries(store, queries, timeout):
+    """
+    Unit query vectors, or None if embedding fails or takes longer than timeout.
+    A late embedding call is left to finish in the background, which still warms the cache.
+    """
+    future = get_embedding_executor().submit(store.embeddings.embed_documents, queries)
+    try:
+        with span("query_embedding", queries=len(queries)):
+            return normalize(future.result(timeout=timeout))
+    except FutureTimeoutError:
+        print(f"Query embedding took over {timeout}s, using keyword search only")
+    except Exception as e:
+        print(f"Could not embed queries, using keyword search only: {e}")
+    return None
+
+def dense_rankings(store, query_vectors, fetch_k):
+    """One FAISS search for all queries. Returns a list of rows per query, nearest first."""
+    with span("faiss_search", queries=len(query_vectors), k=fetch_k):
+        _, rows = store.search_vectors(query_vectors, fetch_k)
+    return [[int(row) for row in query_rows if row != -1] for query_rows in rows]
+
+def lexical_rankings(store, queries, fetch_k):
+    """BM25 rows per query, best first."""
+    with span("bm25_search", queries=len(queries), k=fetch_k):
+        return [[row for row, _ in store.lexical.search(query, fetch_k)] for query in queries]
+
+def rrf_scores(rankings, rrf_k):
+    """Reciprocal rank fusion: a row scores the sum of 1 / (rrf_k + rank) over the rankings it appears in."""
+    scores = {}
+    for ranking in rankings:
+        for rank, row in enumerate(ranking, start=1):
+            scores[row] = scores.get(row, 0.0) + 1.0 / (rrf_k + rank)
+    return scores
+
+
+#################### Search ######################
+
+def multi_query_search(store, queries, k=None, fetch_k=None, lambda_mult=None, max_tokens=None, mode=None):
+    """
+    Search the store with several queries at once. Returns deduplicated Documents, best first.
+    mode is "hybrid" (the default, RETRIEVAL_MODE), "dense" or "lexical".
+    """
+    queries = [q for q in dict.fromkeys(q.strip() for q in queries) if q]
+    if not queries:
+        return []
+    k = k or min(settings.RETRIEVAL_K * len(queries), settings.RETRIEVAL_MAX_DOCUMENTS)
+    fetch_k = fetch_k or settings.RETRIEVAL_FETCH_K
+    lambda_mult = settings.RETRIEVAL_MMR_LAMBDA if lambda_mult is None else lambda_mult
+    max_tokens = max_tokens or settings.RETRIEVAL_MAX_TOKENS
+    mode = mode or settings.RETRIEVAL_MODE
+    if store.lexical is None:
+        mode = "dense" # Index written before the keyword index existed
+
+    rankings = []
+    query_vectors = None
+    if mode == "dense":
+        # Nothing to fall back to, so embedding errors are raised as before
+        with span("query_embedding", queries=len(queries)):
+            query_vectors = normalize(store.embeddings.embed_documents(queries))
+    elif mode == "hybrid":
+        query_vectors = embed_queries(store, queries, settings.RETRIEVAL_EMBEDDING_TIMEOUT_SECONDS)
+    if query_vectors is not None:
+        rankings.extend(dense_rankings(store, query_vectors, fetch_k))
+    if mode != "dense":
+        rankings.extend(lexical_rankings(store, queries, fetch_k))
+
+    scores = rrf_scores(rankings, settings.RETRIEVAL_RRF_K)
+    candidates = sorted(scores, key=scores.get, reverse=True)
+
+    # Drop copies and heavily overlapping neighbours of better-ranked chunks
+    kept, kept_shingles = [], []
+    for row in candidates:
+        row_shingles = shingles(store.chunks[row])
+        if any(overlap(row_shingles, s) >= settings.RETRIEVAL_DUPLICATE_THRESHOLD for s in kept_shingles):
+            continue
+        kept.append(row)
+        kept_shingles.append(row_shingles)
+    if not kept:
+        return []
+
+    texts = [store.chunks[row] for row in kept]
+    if query_vectors is None:
+        # Keyword only: re-embedding the candidates for MMR would need the API we're avoiding
+        order = range(len(kept))
+    else:
+        doc_vectors = normalize(candidate_vectors(store, kept, texts))
+        if mode == "dense":
+            relevance = (doc_vectors @ query_vectors.T).max(axis=1) # Best cosine similarity to any query
+        else:
+            fused = np.array([scores[row] for row in kept])
+            relevance = fused / fused.max()
+        order = mmr_order(relevance, doc_vectors, lambda_mult)
+
+    documents = []
+    used_tokens = 0
+    for i in order:
+        tokens = count_tokens(texts[i])
+        if documents and used_tokens + tokens > max_tokens:
+            continue # Try smaller chunks further down the order
+        documents.append(store.document(kept[i]))
+        used_tokens += tokens
+        if len(documents) >= k:
+            break
+    return documents
@@ -0,0 +1,154 @@
+"""
+Semantic cache of answers to opening questions.
+
+Many sessions open with near-identical questions ("what are my strengths?") about
+the same report. Answers are cached per report (by content hash) together with
+the embedding of the question. A new question is a hit when its embedding's
+cosine similarity to a cached question about the same report reaches
+SEMANTIC_CACHE_THRESHOLD. Entries expire after SEMANTIC_CACHE_TTL_SECONDS and the
+least recently used are evicted beyond SEMANTIC_CACHE_MAX_ENTRIES.
+
+Only the first question of a conversation is looked up, since later answers
+depend on the history. Answers that called pdf_tool are never stored.
+"""
+import hashlib
+import threading
+import time
+from collections import OrderedDict
+from dataclasses import dataclass
+
+import numpy as np
+from django.conf import settings
+
+from .resources import get_embeddings
+
+
+@dataclass
+class CacheEntry:
+    report_hash: str
+    question: str
+    vector: np.ndarray # Unit length
+    response: str
+    latency_ms: float # What the original answer cost; saved on every hit
+    created_at: float
+
+
+class SemanticCache:
+
+    def __init__(self, threshold, ttl_seconds, max_entries):
+        self.threshold = threshold
+        self.ttl_seconds = ttl_seconds
+        self.max_entries = max_entries
+        self._lock = threading.Lock()
+        self._entries = OrderedDict() # id -> CacheEntry, least recently used first
+        self._by_report = {} # report hash -> set of entry ids
+        self._next_id = 0
+        self.hits = 0
+        self.misses = 0
+        self.latency_saved_ms = 0.0
+
+    def _remove(self, entry_id):
+        entry = self._entries.pop(entry_id)
+        ids = self._by_report[entry.report_hash]
+        ids.discard(entry_id)
+        if not ids:
+            del self._by_report[entry.report_hash]
+
+    def lookup(self, report_hash, vector):
+        """The best cached entry for this report within the threshold, or None."""
+        now = time.time()
+        with self._lock:
+            candidates = []
+            for entry_id in list(self._by_report.get(report_hash, ())):
+                if now - self._entries[entry_id].created_at > self.ttl_seconds:
+                    self._remove(entry_id)
+                else:
+                    candidates.append(entry_id)
+
+            if candidates:
+                similarities = np.stack([self._entries[i].vector for i in candidates]) @ vector
+                best = int(np.argmax(similarities))
+                if similarities[best] >= self.threshold:
+                    entry_id = candidates[best]
+                    self._entries.move_to_end(entry_id)
+                    entry = self._entries[entry_id]
+                    self.hits += 1
+                    self.latency_saved_ms += entry.latency_ms
+                    return entry
+
+            self.misses += 1
+            return None
+
+    def store(self, report_hash, question, vector, response, latency_ms):
+        with self._lock:
+            entry_id = self._next_id
+            self._next_id += 1
+            self._entries[entry_id] = CacheEntry(report_hash, question, vector, response, latency_ms, time.time())
+            self._by_report.setdefault(report_hash, set()).add(entry_id)
+            while len(self._entries) > self.max_entries:
+                self._remove(next(iter(self._entries)))
+
+    def stats(self):
+        with self._lock:
+            lookups = self.hits + self.misses
+            return {
+                "entries": len(self._entries),
+                "hits": self.hits,
+                "misses": self.misses,
+                "hit_rate": self.hits / lookups if lookups else 0.0,
+                "latency_saved_ms": round(self.latency_saved_ms, 1),
+            }
+
+
+_cache = None
+_cache_lock = threading.Lock()
+
+def get_cache():
+    global _cache
+    with _cache_lock:
+        if _cache is None:
+            _cache = SemanticCache(
+                settings.SEMANTIC_CACHE_THRESHOLD,
+                settings.SEMANTIC_CACHE_TTL_SECONDS,
+                settings.SEMANTIC_CACHE_MAX_ENTRIES,
+            )
+        return _cache
+
+
+#################### Helpers for the views ######################
+
+@dataclass
+class CacheKey:
+    report_hash: str
+    question: str
+    vector: np.ndarray
+
+def cache_key_for(session, question):
+    """
+    The cache key for this turn, or None if the turn isn't cacheable
+    (caching disabled, a follow-up question, or the question couldn't be embedded).
+    """
+    if not settings.SEMANTIC_CACHE_ENABLED or session.messages or session.summary or not question:
+        return None
+    try:
+        vector = np.asarray(get_embeddings().embed_query(question), dtype=np.float32)
+    except Exception as e:
+        print(f"Semantic cache skipped, could not embed question: {e}")
+        return None
+    norm = np.linalg.norm(vector)
+    if not norm:
+        return None
+    report_hash = hashlib.sha256((session.report or "").encode("utf-8")).hexdigest()
+    return CacheKey(report_hash, question, vector / norm)
+
+def lookup(key):
+    """A cached answer for the key, or None."""
+    if key is None:
+        return None
+    entry = get_cache().lookup(key.report_hash, key.vector)
+    return entry.response if entry else None
+
+def store(key, response, latency_ms, used_pdf_tool):
+    if key is None or used_pdf_tool or not response:
+        return
+    get_cache().store(key.report_hash, key.question, key.vector, response, latency_ms)
@@ -0,0 +1,246 @@
+"""
+Server-side conversation sessions.
+
+Each conversation keeps its extracted report text, its recent turns and a running
+summary of older turns in the Conversation table, so follow-up questions don't
+need the PDFs re-uploaded and re-parsed. Sessions are cached in-process and
+revalidated against the row's version number, which is cheaper than loading
+the report text again.
+
+Saving a session only caches it and queues its row for the persistence writer,
+so a turn never waits on the database. Until the row is written, the cached
+copy is newer than the table and is the one used. Two turns of a conversation
+may run at once: whichever is saved second adds its question and answer to the
+version the first saved, here or (see persistence) in the database.
+
+History is kept under SESSION_HISTORY_TOKEN_BUDGET: once it grows past that,
+the oldest turns are rolled into the summary. Summarising calls the LLM, so it
+runs on a background thread after the turn has been answered.
+"""
+import dataclasses
+import threading
+import uuid
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+from dataclasses import dataclass, field
+
+from django.conf import settings
+from django.db import close_old_connections
+from langchain_core.messages import AIMessage, HumanMessage, SystemMessage, messages_from_dict, messages_to_dict
+
+from . import persistence
+from .models import Conversation
+from .resources import get_llm
+from .tokens import count_message_tokens
+from .tracing import record_llm_usage, span
+
+SUMMARY_PROMPT = (
+    "You maintain a running summary of a career coaching conversation. "
+    "Merge the new turns into the existing summary. Keep the client's goals, concerns, "
+    "key insights from their psychometric report, advice already given and any commitments "
+    "or next steps. Be concise and factual; write in the third person."
+)
+
+
+@dataclass
+class Session:
+    id: uuid.UUID
+    report: str = ""
+    summary: str = ""
+    messages: list = field(default_factory=list)
+    version: int = 0
+    # Length of the history and report as of `version`, to tell what a turn added
+    saved_messages: int = 0
+    saved_report: str = ""
+
+    def copy(self):
+        return dataclasses.replace(self, messages=list(self.messages))
+
+
+_cache = OrderedDict()
+_cache_lock = threading.Lock()
+_write_lock = threading.RLock() # Orders this process's writes of a session with their version numbers
+
+def _cache_put(session):
+    with _cache_lock:
+        _cache[session.id] = session.copy()
+        _cache.move_to_end(session.id)
+        while len(_cache) > settings.SESSION_CACHE_SIZE:
+            _cache.popitem(last=False)
+
+def _cache_get(session_id):
+    with _cache_lock:
+        session = _cache.get(session_id)
+        if session is None:
+            return None
+        _cache.move_to_end(session_id)
+        return session.copy()
+
+
+#################### Loading and saving ######################
+
+def get_session(conversation_id=None):
+    """The session for conversation_id, or a new one if it's missing or unknown."""
+    try:
+        session_id = uuid.UUID(str(conversation_id)) if conversation_id else None
+    except ValueError:
+        session_id = None
+    if session_id is None:
+        return Session(id=uuid.uuid4())
+
+    db_version = Conversation.objects.filter(pk=session_id).values_list("version", flat=True).first()
+    cached = _cache_get(session_id)
+    if cached is not None and (db_version is None or cached.version >= db_version):
+        return cached # Possibly newer than the row, while its write is still queued
+    if db_version is None:
+        return Session(id=uuid.uuid4())
+
+    conversation = Conversation.objects.get(pk=session_id)
+    session = Session(
+        id=conversation.id,
+        report=conversation.user_report_content,
+        summary=conversation.summary,
+        messages=messages_from_dict(conversation.messages),
+        version=conversation.version,
+        saved_messages=len(conversation.messages),
+        saved_report=conversation.user_report_content,
+    )
+    _cache_put(session)
+    return session
+
+def record_turn(session, question, answer):
+    """Add a question and the final answer to the history. Intermediate tool calls aren't kept."""
+    session.messages.append(HumanMessage(content=question or ""))
+    session.messages.append(AIMessage(content=answer or ""))
+
+def write_session(session, merge=True):
+    """
+    Cache the session and queue its row to be written. With merge, what the session
+    added since it was loaded is applied on top of any version saved in the meantime.
+    """
+    with _write_lock:
+        new_messages = session.messages[session.saved_messages:]
+        new_report = session.report != session.saved_report
+        cached = _cache_get(session.id)
+        if merge and cached is not None and cached.version > session.version:
+            # Another turn of this conversation was saved since this one started
+            session.messages = cached.messages + new_messages
+            session.summary = cached.summary
+            if not new_report:
+                session.report = cached.report
+            session.version = cached.version
+
+        base_version = session.version
+        session.version += 1
+        session.saved_messages = len(session.messages)
+        session.saved_report = session.report
+        _cache_put(session)
+        persistence.save_conversation(persistence.ConversationWrite(
+            Conversation(
+                id=session.id,
+                user_report_content=session.report,
+                summary=session.summary,
+                messages=messages_to_dict(session.messages),
+                version=session.version,
+            ),
+            base_version=base_version,
+            new_messages=messages_to_dict(new_messages) if merge else None,
+            new_report=new_report,
+        ))
+
+def save_session(session):
+    """Persist and cache the session, and compact its history in the background if it's over budget."""
+    write_session(session)
+    if count_message_tokens(session.messages) > settings.SESSION_HISTORY_TOKEN_BUDGET:
+        schedule_compaction(session)
+
+
+#################### History budget ######################
+
+_compactor = None
+_compactor_lock = threading.Lock()
+_compacting = set() # Sessions with a compaction queued or running
+
+def get_compactor():
+    """The thread that summarises old turns."""
+    global _compactor
+    with _compactor_lock:
+        if _compactor is None:
+            _compactor = ThreadPoolExecutor(max_workers=1, thread_name_prefix="compact-history")
+        return _compactor
+
+def schedule_compaction(session):
+    """Compact the session's history on the background thread, unless that's already queued."""
+    with _compactor_lock:
+        if session.id in _compacting:
+            return
+        _compacting.add(session.id)
+    get_compactor().submit(run_compaction, session.copy())
+
+def run_compaction(session):
+    """Summarise the session's oldest turns and save the result. Runs on the compaction thread."""
+    try:
+        compact_history(session)
+    except Exception as e:
+        print(f"Could not compact conversation {session.id}: {e!r}")
+    finally:
+        with _compactor_lock:
+            _compacting.discard(session.id)
+        close_old_connections() # The compaction thread holds its own DB connection
+
+def compaction_cut(messages):
+    """
+    Where to cut the history so that what's left uses at most half of
+    SESSION_HISTORY_TOKEN_BUDGET (always keeping the latest turn). Turns are only
+    split at HumanMessage boundaries. Returns 0 when nothing needs to go.
+    """
+    budget = settings.SESSION_HISTORY_TOKEN_BUDGET
+    if count_message_tokens(messages) <= budget:
+        return 0
+
+    turn_starts = [i for i, m in enumerate(messages) if isinstance(m, HumanMessage)]
+    cut = turn_starts[-1] if turn_starts else len(messages)
+    for start in reversed(turn_starts):
+        if count_message_tokens(messages[start:]) > budget // 2:
+            break
+        cut = start
+    return cut
+
+def compact_history(session):
+    """
+    If the history is over SESSION_HISTORY_TOKEN_BUDGET, roll the oldest turns into
+    the summary and save the session. Turns added while the summary was being
+    written are kept; if the history changed in any other way, it's left for the
+    next turn to compact.
+    """
+    cut = compaction_cut(session.messages)
+    if not cut:
+        return
+    old_messages = session.messages[:cut]
+    try:
+        summary = summarize(session.summary, old_messages)
+    except Exception as e:
+        # Keep the full history and try again next turn rather than losing it
+        print(f"Could not summarise conversation {session.id}: {e}")
+        return
+
+    with _write_lock:
+        latest = get_session(session.id)
+        if latest.summary != session.summary or latest.messages[:cut] != old_messages:
+            return
+        latest.summary = summary
+        latest.messages = latest.messages[cut:]
+        write_session(latest, merge=False) # If another process saved a turn first, it's left for the next one
+
+def summarize(previous_summary, messages):
+    transcript = "\n\n".join(
+        f"{'Client' if isinstance(m, HumanMessage) else 'Coach'}: {m.content}" for m in messages
+    )
+    prompt = [
+        SystemMessage(content=SUMMARY_PROMPT),
+        HumanMessage(content=f"Existing summary:\n{previous_summary or '(none)'}\n\nNew turns:\n{transcript}"),
+    ]
+    with span("summarize_history", model=settings.CHAT_MODEL, messages=len(messages)) as attributes:
+        response = get_llm().invoke(prompt)
+        record_llm_usage(attributes, response, prompt, settings.CHAT_MODEL, purpose="summary")
+    return response.content
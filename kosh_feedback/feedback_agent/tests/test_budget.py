@@ -0,0 +1,61 @@
+import shutil
+import tempfile
+from contextlib import ExitStack
+
+from django.test import SimpleTestCase
+from langchain_core.messages import AIMessage, HumanMessage
+
+from feedback_agent.benchmarks.fakes import FakeChatModel, FakeEmbeddings
+from feedback_agent.benchmarks.runner import offline_models, scratch_settings
+from feedback_agent.budget import ExecutionBudget, budget_from, run_config
+from feedback_agent.views import app, tool_agent
+
+
+def budget(max_steps=8, max_tokens=100_000, max_tool_calls=8, deadline_seconds=60):
+    return ExecutionBudget(max_steps, max_tokens, max_tool_calls, deadline_seconds, final_answer_reserve_seconds=1)
+
+
+class ExecutionBudgetTests(SimpleTestCase):
+
+    def setUp(self):
+        directory = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, directory, ignore_errors=True)
+        stack = ExitStack()
+        self.addCleanup(stack.close)
+        stack.enter_context(scratch_settings(directory))
+        stack.enter_context(offline_models(FakeChatModel(tool_rounds=10), FakeEmbeddings(16)))
+
+    def run_turn(self, run_budget):
+        state = {"messages": [HumanMessage(content="What are my strengths?")], "user_report_content": "A report."}
+        return app.invoke(state, config=run_config(run_budget))["messages"]
+
+    def test_step_limit_forces_a_final_answer(self):
+        run_budget = budget(max_steps=3)
+        messages = self.run_turn(run_budget)
+        self.assertEqual(run_budget.exhausted_reason, "steps")
+        self.assertEqual(run_budget.steps, 3) # Two tool rounds, then the answer
+        self.assertIsInstance(messages[-1], AIMessage)
+        self.assertFalse(messages[-1].tool_calls)
+        self.assertTrue(messages[-1].content)
+
+    def test_deadline_forces_an_immediate_answer(self):
+        run_budget = budget(deadline_seconds=0)
+        messages = self.run_turn(run_budget)
+        self.assertEqual(run_budget.exhausted_reason, "deadline")
+        self.assertEqual((run_budget.steps, run_budget.tool_calls), (1, 0))
+        self.assertEqual(len(messages), 2)
+
+    def test_tool_calls_over_budget_are_skipped(self):
+        run_budget = budget(max_tool_calls=1)
+        calls = [{"name": "retriever_tool", "args": {"query": f"query {i}"}, "id": f"call_{i}"} for i in range(3)]
+        state = {"messages": [AIMessage(content="", tool_calls=calls)]}
+        results = tool_agent(state, run_config(run_budget))["messages"]
+        self.assertEqual([m.tool_call_id for m in results], ["call_0", "call_1", "call_2"])
+        self.assertFalse(results[0].content.startswith("Skipped"))
+        self.assertTrue(all(m.content.startswith("Skipped") for m in results[1:]))
+        self.assertEqual(run_budget.tool_calls, 1)
+        self.assertEqual(run_budget.must_answer(), "tool_calls")
+
+    def test_runs_need_a_budget(self):
+        with self.assertRaises(ValueError):
+            budget_from({"configurable": {}})
@@ -0,0 +1,80 @@
+import shutil
+import tempfile
+
+import numpy as np
+from django.test import SimpleTestCase
+
+from feedback_agent.benchmarks.fakes import FakeEmbeddings
+from feedback_agent.embedding_cache import CachedEmbeddings, EmbeddingStore, cache_key
+
+
+class EmbeddingCacheTests(SimpleTestCase):
+
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.directory, ignore_errors=True)
+
+    def cached(self, max_entries=100, fake=None):
+        fake = fake or FakeEmbeddings(8)
+        return CachedEmbeddings(fake, EmbeddingStore(self.directory, max_entries), "fake", max_concurrency=1), fake
+
+    def test_miss_then_hit(self):
+        embeddings, fake = self.cached()
+        first = embeddings.embed_documents(["alpha", "beta", "alpha"])
+        self.assertEqual(fake.texts, 2) # Repeats within a call are embedded once
+        np.testing.assert_allclose(first[0], fake._vector("alpha"), rtol=1e-6)
+
+        second = embeddings.embed_documents(["beta", "alpha"])
+        self.assertEqual(fake.texts, 2)
+        self.assertEqual(second, [first[1], first[0]])
+
+        np.testing.assert_allclose(embeddings.embed_query("alpha"), first[0])
+        self.assertEqual(fake.texts, 2)
+
+    def test_evicts_least_recently_used(self):
+        embeddings, fake = self.cached(max_entries=3)
+        embeddings.embed_documents(["a", "b", "c"])
+        embeddings.embed_query("a") # b is now least recently used
+        embeddings.store.flush()
+        embeddings.embed_query("d")
+        self.assertEqual(len(embeddings.store), 3)
+
+        fake.texts = 0
+        embeddings.embed_documents(["a", "c", "d"])
+        self.assertEqual(fake.texts, 0)
+        embeddings.embed_query("b")
+        self.assertEqual(fake.texts, 1)
+
+    def test_grows_past_initial_capacity(self):
+        embeddings, fake = self.cached(max_entries=5000)
+        texts = [f"text {i}" for i in range(2500)]
+        embeddings.embed_documents(texts)
+        fake.texts = 0
+        vectors = embeddings.embed_documents(texts)
+        self.assertEqual(fake.texts, 0)
+        np.testing.assert_allclose(vectors[-1], fake._vector(texts[-1]), rtol=1e-6)
+
+    def test_reopen_keeps_entries(self):
+        embeddings, fake = self.cached()
+        vector = embeddings.embed_query("kept")
+        embeddings.store.flush()
+
+        reopened, fake = self.cached()
+        self.assertEqual(reopened.embed_query("kept"), vector)
+        self.assertEqual(fake.texts, 0)
+
+    def test_stores_in_other_processes_share_entries(self):
+        # Two stores on one directory stand in for two worker processes
+        first, _ = self.cached()
+        second, fake = self.cached()
+        first.embed_documents(["shared"])
+        second.embed_documents(["shared", "own"])
+        self.assertEqual(fake.texts, 1)
+        self.assertEqual(len(first.store), 2)
+
+    def test_rejects_other_dimensions(self):
+        store = EmbeddingStore(self.directory, 10)
+        store.put_many({cache_key("fake", "x"): [0.0] * 8})
+        with self.assertRaises(ValueError):
+            store.put_many({cache_key("fake", "y"): [0.0] * 4})
+        self.assertEqual(len(store), 1)
@@ -0,0 +1,128 @@
+import glob
+import os
+import shutil
+import tempfile
+
+from django.test import SimpleTestCase, override_settings
+
+from feedback_agent.benchmarks.corpus import generate_corpus, synthetic_pdf
+from feedback_agent.benchmarks.fakes import FakeEmbeddings
+from feedback_agent.indexing import build_index, checkpoint_dir_for, load_manifest
+from feedback_agent.vector_index import MappedIndex
+
+
+class FlakyEmbeddings(FakeEmbeddings):
+    """FakeEmbeddings that fail on one call, as a dropped connection would."""
+
+    def __init__(self, dimensions, fail_on_call):
+        super().__init__(dimensions)
+        self.fail_on_call = fail_on_call
+
+    def embed_documents(self, texts):
+        if self.calls + 1 == self.fail_on_call:
+            self.calls += 1
+            raise ConnectionError("embedding call failed")
+        return super().embed_documents(texts)
+
+
+# Parse in this process; the pool adds nothing for a few small PDFs
+@override_settings(INGESTION_MAX_WORKERS=1)
+class BuildIndexTests(SimpleTestCase):
+
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.directory, ignore_errors=True)
+        self.data_dir = os.path.join(self.directory, "RAG_data")
+        self.index_dir = os.path.join(self.directory, "vectorstores", "index")
+        generate_corpus(self.data_dir, files=3, pages_per_file=2, seed=0)
+
+    def build(self, embeddings, **kwargs):
+        return build_index(self.data_dir, self.index_dir, embeddings, **kwargs)
+
+    def versions(self):
+        return glob.glob(f"{self.index_dir}.v*")
+
+    def test_unchanged_files_embed_nothing(self):
+        embeddings = FakeEmbeddings(16)
+        first = self.build(embeddings, incremental=False)
+        self.assertEqual(first["mode"], "full")
+        self.assertEqual(embeddings.texts, first["chunks_total"])
+
+        embeddings.texts = 0
+        second = self.build(embeddings)
+        self.assertEqual((second["mode"], second["files_unchanged"], second["files_indexed"]), ("incremental", 3, 0))
+        self.assertEqual(embeddings.texts, 0)
+        self.assertEqual(second["chunks_total"], first["chunks_total"])
+
+    def test_added_and_removed_files(self):
+        embeddings = FakeEmbeddings(16)
+        self.build(embeddings, incremental=False)
+        removed = load_manifest(self.index_dir)["files"]["synthetic-0000.pdf"]["chunks"]
+        os.remove(os.path.join(self.data_dir, "synthetic-0000.pdf"))
+        with open(os.path.join(self.data_dir, "added.pdf"), "wb") as f:
+            f.write(synthetic_pdf(2, seed=42))
+
+        embeddings.texts = 0
+        stats = self.build(embeddings)
+        self.assertEqual((stats["files_unchanged"], stats["files_indexed"], stats["files_removed"]), (2, 1, 1))
+        self.assertEqual(stats["chunks_removed"], len(removed))
+
+        manifest = load_manifest(self.index_dir)
+        self.assertEqual(sorted(manifest["files"]), ["added.pdf", "synthetic-0001.pdf", "synthetic-0002.pdf"])
+        self.assertEqual(embeddings.texts, len(manifest["files"]["added.pdf"]["chunks"]))
+
+        store = MappedIndex.load(self.index_dir, embeddings)
+        self.assertEqual(len(store), stats["chunks_total"])
+        self.assertFalse({c["id"] for c in removed} & set(store.ids))
+
+    def test_index_type_change_embeds_nothing(self):
+        embeddings = FakeEmbeddings(16)
+        first = self.build(embeddings, incremental=False)
+
+        embeddings.texts = 0
+        stats = self.build(embeddings, index_type="sq8")
+        self.assertEqual(stats["index"]["type"], "sq8")
+        self.assertEqual(load_manifest(self.index_dir)["index"]["type"], "sq8")
+        # ...and back again, from the raw vectors kept with the lossy index
+        stats = self.build(embeddings, index_type="flat")
+        self.assertEqual(stats["index"]["type"], "flat")
+        self.assertEqual(stats["chunks_total"], first["chunks_total"])
+        self.assertEqual(embeddings.texts, 0)
+
+    def test_swap_replaces_and_removes_the_old_version(self):
+        embeddings = FakeEmbeddings(16)
+        self.build(embeddings, incremental=False)
+        first = os.path.realpath(self.index_dir)
+
+        self.build(embeddings, incremental=False)
+        self.assertTrue(os.path.islink(self.index_dir))
+        self.assertNotEqual(os.path.realpath(self.index_dir), first)
+        self.assertFalse(os.path.exists(first))
+        self.assertEqual(self.versions(), [os.path.realpath(self.index_dir)])
+
+    def test_failed_build_leaves_the_live_index(self):
+        self.build(FakeEmbeddings(16), incremental=False)
+        live = os.path.realpath(self.index_dir)
+
+        with self.assertRaises(ConnectionError):
+            self.build(FlakyEmbeddings(16, fail_on_call=2), incremental=False)
+        self.assertEqual(os.path.realpath(self.index_dir), live)
+        self.assertEqual(self.versions(), [live])
+        chunks = sum(len(f["chunks"]) for f in load_manifest(self.index_dir)["files"].values())
+        self.assertEqual(len(MappedIndex.load(self.index_dir, FakeEmbeddings(16))), chunks)
+
+    def test_resumes_from_checkpoint_after_failure(self):
+        # One batch per file with batch_size=1000, so the third call is the third file
+        embeddings = FlakyEmbeddings(16, fail_on_call=3)
+        with self.assertRaises(ConnectionError):
+            self.build(embeddings, incremental=False, checkpoint=True, batch_size=1000)
+        self.assertFalse(os.path.exists(self.index_dir))
+        embedded_before = embeddings.texts
+
+        embeddings.texts = 0
+        stats = self.build(embeddings, incremental=False, checkpoint=True, batch_size=1000)
+        self.assertEqual(stats["chunks_resumed"], embedded_before)
+        self.assertEqual(stats["chunks_embedded"], embeddings.texts)
+        self.assertEqual(stats["chunks_resumed"] + stats["chunks_embedded"], stats["chunks_total"])
+        self.assertEqual(len(MappedIndex.load(self.index_dir, embeddings)), stats["chunks_total"])
+        self.assertFalse(os.path.exists(checkpoint_dir_for(self.index_dir)))
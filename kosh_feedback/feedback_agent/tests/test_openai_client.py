@@ -0,0 +1,139 @@
+import time
+from types import SimpleNamespace
+from unittest import mock
+
+import httpx
+from django.test import SimpleTestCase, override_settings
+
+from feedback_agent.openai_client import AdaptiveLimiter, CircuitBreaker, CircuitOpen, ResilientTransport
+
+URL = "https://api.openai.test/v1/embeddings"
+
+
+class AdaptiveLimiterTests(SimpleTestCase):
+
+    def test_halves_on_throttle_and_grows_by_one_per_round(self):
+        limiter = AdaptiveLimiter("chat", max_concurrency=8)
+        limiter.on_throttled()
+        self.assertEqual(limiter.limit, 4)
+        limiter.on_throttled() # Same burst of 429s
+        self.assertEqual(limiter.limit, 4)
+
+        for _ in range(4):
+            limiter.on_success()
+        self.assertAlmostEqual(limiter.limit, 4.92, places=2) # About one more slot after a round of four
+        for _ in range(100):
+            limiter.on_success()
+        self.assertEqual(limiter.limit, 8)
+
+    def test_bulk_waits_for_interactive(self):
+        limiter = AdaptiveLimiter("embeddings", max_concurrency=4, bulk_share=0.5)
+        self.assertTrue(limiter.acquire(bulk=True, timeout=0))
+        self.assertTrue(limiter.acquire(bulk=True, timeout=0))
+        self.assertFalse(limiter.acquire(bulk=True, timeout=0)) # Bulk share used up
+        self.assertTrue(limiter.acquire(bulk=False, timeout=0))
+
+    def test_pause_holds_new_requests(self):
+        limiter = AdaptiveLimiter("chat", max_concurrency=2)
+        limiter.pause(60)
+        self.assertFalse(limiter.acquire(timeout=0.01))
+
+
+class CircuitBreakerTests(SimpleTestCase):
+
+    def test_opens_then_half_opens_then_closes(self):
+        breaker = CircuitBreaker("chat", failure_threshold=2, reset_seconds=0.05)
+        breaker.record_failure()
+        self.assertEqual(breaker.state, "closed")
+        breaker.record_failure()
+        self.assertEqual(breaker.state, "open")
+        self.assertFalse(breaker.allow())
+
+        time.sleep(0.06)
+        self.assertEqual(breaker.state, "half_open")
+        self.assertTrue(breaker.allow())
+        self.assertFalse(breaker.allow()) # Only one trial call at a time
+        breaker.record_success()
+        self.assertEqual(breaker.state, "closed")
+        self.assertTrue(breaker.allow())
+
+    def test_failed_trial_reopens(self):
+        breaker = CircuitBreaker("chat", failure_threshold=1, reset_seconds=0.05)
+        breaker.record_failure()
+        time.sleep(0.06)
+        self.assertTrue(breaker.allow())
+        breaker.record_failure()
+        self.assertEqual(breaker.state, "open")
+
+
+@override_settings(OPENAI_MAX_RETRIES=3, OPENAI_BACKOFF_BASE_SECONDS=0.01, OPENAI_BACKOFF_MAX_SECONDS=0.1,
+                   OPENAI_QUEUE_TIMEOUT_SECONDS=1)
+class ResilientTransportTests(SimpleTestCase):
+
+    def setUp(self):
+        self.lane = SimpleNamespace(
+            name="embeddings",
+            limiter=AdaptiveLimiter("embeddings", max_concurrency=8),
+            breaker=CircuitBreaker("embeddings", failure_threshold=3, reset_seconds=60),
+        )
+        self.requests = 0
+        sleep = mock.patch("feedback_agent.openai_client.time.sleep")
+        self.sleep = sleep.start()
+        self.addCleanup(sleep.stop)
+
+    def resilient_client(self, responses, timeout=None):
+        """A client whose requests get each of responses in turn (the last one repeats)."""
+        def handler(request):
+            response = responses[min(self.requests, len(responses) - 1)]
+            self.requests += 1
+            if isinstance(response, Exception):
+                raise response
+            return response
+        transport = ResilientTransport(self.lane, httpx.MockTransport(handler))
+        return httpx.Client(transport=transport, timeout=timeout)
+
+    def sleeps(self):
+        return [c.args[0] for c in self.sleep.call_args_list]
+
+    def test_retries_server_errors(self):
+        client = self.resilient_client([httpx.Response(503), httpx.Response(500), httpx.Response(200, json={})])
+        self.assertEqual(client.post(URL).status_code, 200)
+        self.assertEqual(self.requests, 3)
+        self.assertEqual(len(self.sleeps()), 2)
+        self.assertEqual(self.lane.breaker.failures, 0)
+        self.assertEqual(self.lane.limiter.in_flight, 0)
+
+    def test_retries_connection_errors(self):
+        client = self.resilient_client([httpx.ConnectTimeout("timed out"), httpx.Response(200, json={})])
+        self.assertEqual(client.post(URL).status_code, 200)
+        self.assertEqual(self.requests, 2)
+
+    def test_gives_up_after_max_retries(self):
+        self.lane.breaker.failure_threshold = 10
+        client = self.resilient_client([httpx.Response(502)])
+        self.assertEqual(client.post(URL).status_code, 502)
+        self.assertEqual(self.requests, 4)
+
+    def test_rate_limit_halves_the_limit_and_waits_retry_after(self):
+        client = self.resilient_client([httpx.Response(429, headers={"retry-after-ms": "20"}), httpx.Response(200, json={})])
+        self.assertEqual(client.post(URL).status_code, 200)
+        self.assertEqual(self.lane.limiter.limit, 4 + 1 / 4)
+        [wait] = self.sleeps()
+        self.assertGreaterEqual(wait, 0.02)
+        self.assertLess(wait, 0.02 + 0.01)
+
+    def test_retries_stop_at_the_callers_deadline(self):
+        client = self.resilient_client([httpx.Response(429, headers={"retry-after": "5"})], timeout=1.0)
+        self.assertEqual(client.post(URL).status_code, 429)
+        self.assertEqual(self.requests, 1) # A 5 second wait would outlast the 1 second timeout
+        self.assertEqual(self.sleeps(), [])
+
+    def test_open_circuit_fails_fast(self):
+        with override_settings(OPENAI_MAX_RETRIES=2):
+            self.assertEqual(self.resilient_client([httpx.Response(500)]).post(URL).status_code, 500)
+        self.assertEqual(self.lane.breaker.state, "open")
+
+        with self.assertRaises(CircuitOpen):
+            self.resilient_client([httpx.Response(200, json={})]).post(URL)
+        self.assertEqual(self.requests, 3) # The second call never reached the server
+        self.assertEqual(self.lane.limiter.in_flight, 0)
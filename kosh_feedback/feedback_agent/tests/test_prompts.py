@@ -0,0 +1,42 @@
+from django.test import SimpleTestCase
+from langchain_core.messages import AIMessage, HumanMessage
+
+from feedback_agent.prompts import fit_to_budget
+from feedback_agent.tokens import count_message_tokens
+
+
+def turn(n):
+    return [HumanMessage(content=f"question {n} " + "word " * 100), AIMessage(content=f"answer {n} " + "word " * 100)]
+
+def conversation(turns):
+    """turns complete turns followed by the current question."""
+    messages = [m for n in range(turns) for m in turn(n)]
+    return messages + [HumanMessage(content="current question " + "word " * 100)]
+
+
+class FitToBudgetTests(SimpleTestCase):
+
+    def test_fits_unchanged(self):
+        messages = conversation(3)
+        self.assertEqual(fit_to_budget(messages, count_message_tokens(messages)), messages)
+
+    def test_drops_only_the_oldest_turns_needed(self):
+        messages = conversation(4)
+        # Room for everything but the first two turns
+        budget = count_message_tokens(messages[4:])
+        self.assertEqual(fit_to_budget(messages, budget), messages[4:])
+
+    def test_drops_one_turn_when_one_is_enough(self):
+        messages = conversation(4)
+        budget = count_message_tokens(messages) - 1
+        self.assertEqual(fit_to_budget(messages, budget), messages[2:])
+
+    def test_never_drops_the_current_question(self):
+        messages = conversation(6)
+        result = fit_to_budget(messages, count_message_tokens(turn(0)[:1]))
+        self.assertEqual(result, messages[-1:])
+
+    def test_current_turn_keeps_its_tool_loop(self):
+        messages = conversation(2) + [AIMessage(content="thinking " + "word " * 100)]
+        result = fit_to_budget(messages, 1)
+        self.assertEqual(result, messages[-2:])
@@ -0,0 +1,75 @@
+import shutil
+import tempfile
+from types import SimpleNamespace
+
+import numpy as np
+from django.test import SimpleTestCase
+from langchain_core.documents import Document
+
+from feedback_agent.lexical_index import BM25Index
+from feedback_agent.retrieval import mmr_order, multi_query_search, overlap, rrf_scores, shingles
+
+TEXTS = [
+    "Resilience is the capacity to recover quickly from setbacks at work.",
+    "Conscientiousness predicts job performance across most occupations.",
+    "Resilience is the capacity to recover quickly from setbacks at work.", # Copy of row 0
+    "Leaders high in openness seek out new experiences and ideas.",
+    "Emotional intelligence helps managers handle conflict within teams.",
+]
+
+
+class RetrievalTests(SimpleTestCase):
+
+    def test_rrf_rewards_rows_ranked_by_several_queries(self):
+        scores = rrf_scores([[1, 2, 3], [3, 1]], rrf_k=60)
+        self.assertAlmostEqual(scores[1], 1 / 61 + 1 / 62)
+        self.assertAlmostEqual(scores[3], 1 / 63 + 1 / 61)
+        self.assertEqual(sorted(scores, key=scores.get, reverse=True), [1, 3, 2])
+
+    def test_shingle_overlap(self):
+        chunk = shingles("the client shows strong resilience under pressure and adapts to change")
+        neighbour = shingles("shows strong resilience under pressure and adapts to change quickly")
+        self.assertEqual(overlap(chunk, shingles("strong resilience under pressure")), 1.0) # Contained
+        self.assertGreaterEqual(overlap(chunk, neighbour), 0.8)
+        self.assertEqual(overlap(chunk, shingles("conscientiousness predicts job performance")), 0.0)
+
+    def test_mmr_skips_redundant_documents(self):
+        relevance = np.array([1.0, 0.99, 0.5])
+        vectors = np.array([[1.0, 0.0], [1.0, 0.0], [0.0, 1.0]], dtype=np.float32)
+        self.assertEqual(mmr_order(relevance, vectors, lambda_mult=1.0), [0, 1, 2])
+        self.assertEqual(mmr_order(relevance, vectors, lambda_mult=0.5), [0, 2, 1])
+
+    def test_keyword_search_drops_duplicates(self):
+        store = SimpleNamespace(
+            chunks=TEXTS,
+            lexical=BM25Index.build(TEXTS),
+            document=lambda row: Document(page_content=TEXTS[row], metadata={"row": row}),
+        )
+        documents = multi_query_search(store, ["resilience after setbacks", "openness to ideas"], mode="lexical")
+        rows = [d.metadata["row"] for d in documents]
+        self.assertEqual(sorted(rows), [0, 3])
+
+
+class BM25IndexTests(SimpleTestCase):
+
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.directory, ignore_errors=True)
+
+    def test_exact_terms_rank_first(self):
+        index = BM25Index.build(TEXTS)
+        self.assertEqual(index.search("conscientiousness", 3)[0][0], 1)
+        self.assertEqual(index.search("the of and", 3), []) # Stopwords only
+        self.assertEqual(index.search("astrology", 3), [])
+
+    def test_save_load_round_trip(self):
+        index = BM25Index.build(TEXTS)
+        self.assertFalse(BM25Index.exists(self.directory))
+        index.save(self.directory)
+        self.assertTrue(BM25Index.exists(self.directory))
+
+        loaded = BM25Index.load(self.directory)
+        self.assertEqual(len(loaded), len(index))
+        self.assertEqual(loaded.vocabulary, index.vocabulary)
+        for query in ("resilience at work", "leaders openness", "managers conflict teams"):
+            self.assertEqual(loaded.search(query, 5), index.search(query, 5))
@@ -0,0 +1,84 @@
+import uuid
+from contextlib import ExitStack
+from unittest import mock
+
+import numpy as np
+from django.test import SimpleTestCase, override_settings
+from langchain_core.messages import AIMessage, HumanMessage
+
+from feedback_agent import semantic_cache
+from feedback_agent.benchmarks.fakes import FakeChatModel, FakeEmbeddings
+from feedback_agent.benchmarks.runner import offline_models
+from feedback_agent.semantic_cache import SemanticCache
+from feedback_agent.sessions import Session
+
+
+def unit(*values):
+    vector = np.asarray(values, dtype=np.float32)
+    return vector / np.linalg.norm(vector)
+
+
+class SemanticCacheTests(SimpleTestCase):
+
+    def test_hit_needs_the_threshold_and_the_same_report(self):
+        cache = SemanticCache(threshold=0.95, ttl_seconds=60, max_entries=10)
+        cache.store("report", "What are my strengths?", unit(1, 0), "Your strengths...", latency_ms=800)
+
+        self.assertEqual(cache.lookup("report", unit(1, 0.1)).response, "Your strengths...") # cos ~0.995
+        self.assertIsNone(cache.lookup("report", unit(1, 0.5))) # cos ~0.89
+        self.assertIsNone(cache.lookup("other report", unit(1, 0)))
+        self.assertEqual((cache.hits, cache.misses, cache.latency_saved_ms), (1, 2, 800))
+
+    def test_entries_expire(self):
+        cache = SemanticCache(threshold=0.9, ttl_seconds=60, max_entries=10)
+        with mock.patch("feedback_agent.semantic_cache.time.time", return_value=1000.0):
+            cache.store("report", "q", unit(1, 0), "answer", latency_ms=1)
+        with mock.patch("feedback_agent.semantic_cache.time.time", return_value=1059.0):
+            self.assertIsNotNone(cache.lookup("report", unit(1, 0)))
+        with mock.patch("feedback_agent.semantic_cache.time.time", return_value=1061.0):
+            self.assertIsNone(cache.lookup("report", unit(1, 0)))
+        self.assertEqual(cache.stats()["entries"], 0)
+
+    def test_evicts_least_recently_used(self):
+        cache = SemanticCache(threshold=0.99, ttl_seconds=60, max_entries=2)
+        cache.store("report", "a", unit(1, 0, 0), "A", latency_ms=1)
+        cache.store("report", "b", unit(0, 1, 0), "B", latency_ms=1)
+        cache.lookup("report", unit(1, 0, 0)) # b is now least recently used
+        cache.store("report", "c", unit(0, 0, 1), "C", latency_ms=1)
+
+        self.assertEqual(cache.lookup("report", unit(1, 0, 0)).response, "A")
+        self.assertIsNone(cache.lookup("report", unit(0, 1, 0)))
+        self.assertEqual(cache.lookup("report", unit(0, 0, 1)).response, "C")
+
+
+@override_settings(SEMANTIC_CACHE_ENABLED=True, SEMANTIC_CACHE_THRESHOLD=0.95)
+class CacheRulesTests(SimpleTestCase):
+
+    def setUp(self):
+        stack = ExitStack()
+        self.addCleanup(stack.close)
+        stack.enter_context(offline_models(FakeChatModel(), FakeEmbeddings(16)))
+        stack.enter_context(mock.patch.object(semantic_cache, "_cache", SemanticCache(0.95, 60, 10)))
+
+    def session(self, **fields):
+        return Session(id=uuid.uuid4(), report="The report.", **fields)
+
+    def test_first_question_round_trip(self):
+        key = semantic_cache.cache_key_for(self.session(), "What are my strengths?")
+        semantic_cache.store(key, "Your strengths...", latency_ms=500, used_pdf_tool=False)
+        again = semantic_cache.cache_key_for(self.session(), "What are my strengths?")
+        self.assertEqual(semantic_cache.lookup(again), "Your strengths...")
+
+    def test_follow_up_questions_are_not_cached(self):
+        history = [HumanMessage(content="Hi"), AIMessage(content="Hello")]
+        self.assertIsNone(semantic_cache.cache_key_for(self.session(messages=history), "What are my strengths?"))
+        self.assertIsNone(semantic_cache.cache_key_for(self.session(summary="Earlier turns."), "What are my strengths?"))
+
+    def test_pdf_answers_are_not_stored(self):
+        key = semantic_cache.cache_key_for(self.session(), "Give me a PDF summary")
+        semantic_cache.store(key, "Your PDF is ready.", latency_ms=500, used_pdf_tool=True)
+        self.assertIsNone(semantic_cache.lookup(key))
+
+    @override_settings(SEMANTIC_CACHE_ENABLED=False)
+    def test_disabled(self):
+        self.assertIsNone(semantic_cache.cache_key_for(self.session(), "What are my strengths?"))
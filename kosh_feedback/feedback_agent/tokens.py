@@ -0,0 +1,42 @@
+"""
+Token counting for prompt budgeting.
+
+Uses tiktoken's encoding for CHAT_MODEL when it can be loaded. tiktoken downloads
+encodings on first use, so when that isn't possible we fall back to the usual
+estimate of four characters per token.
+"""
+from functools import lru_cache
+
+from django.conf import settings
+
+# Roughly what the chat API adds per message for role and separators
+MESSAGE_OVERHEAD_TOKENS = 4
+
+
+@lru_cache(maxsize=4)
+def _encoding(model):
+    try:
+        import tiktoken
+        return tiktoken.encoding_for_model(model)
+    except Exception as e:
+        print(f"tiktoken encoding for {model} unavailable, estimating token counts: {e}")
+        return None
+
+def count_tokens(text, model=None):
+    if not text:
+        return 0
+    encoding = _encoding(model or settings.CHAT_MODEL)
+    if encoding is None:
+        return len(text) // 4 + 1
+    return len(encoding.encode(text, disallowed_special=()))
+
+def message_text(message):
+    """The text content of a message, including any tool call arguments."""
+    content = message.content
+    if isinstance(content, list):
+        content = " ".join(part.get("text", "") if isinstance(part, dict) else str(part) for part in content)
+    tool_calls = getattr(message, "tool_calls", None) or []
+    return content + "".join(str(call.get("args", "")) for call in tool_calls)
+
+def count_message_tokens(messages, model=None):
+    return sum(count_tokens(message_text(m), model) + MESSAGE_OVERHEAD_TOKENS for m in messages)
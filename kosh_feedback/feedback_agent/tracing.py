@@ -0,0 +1,190 @@
+"""
+Spans for the stages of a request: PDF extraction, LLM calls, tool calls,
+index searches and PDF rendering.
+
+Every span is observed in the kosh_span_duration_seconds histogram (see metrics)
+and, with TRACE_LOG_SPANS, logged as a JSON line on the feedback_agent.trace
+logger. Spans that happen while a request is being served are also collected
+on that request's Trace. With TIMING_HEADER on, TimingMiddleware returns the
+trace as a Server-Timing header, which browser dev tools display per request.
+
+The trace lives in a context variable. Worker threads started with
+contextvars.copy_context() (as the tool executor does) share it.
+"""
+import contextvars
+import json
+import logging
+import threading
+import time
+import uuid
+from contextlib import contextmanager
+
+from asgiref.sync import iscoroutinefunction, markcoroutinefunction
+from django.conf import settings
+
+from .metrics import LLM_TOKENS, REQUEST_SECONDS, SPAN_ERRORS, SPAN_SECONDS
+from .tokens import count_message_tokens
+
+logger = logging.getLogger("feedback_agent.trace")
+
+_current_trace = contextvars.ContextVar("kosh_trace", default=None)
+
+
+class Trace:
+    """The spans recorded, and LLM tokens used, while serving one request."""
+
+    def __init__(self):
+        self.id = uuid.uuid4().hex[:12]
+        self.started = time.perf_counter()
+        self.spans = [] # (name, duration ms)
+        self.llm_usage = [] # One dict per LLM call, as recorded by record_llm_usage
+        self._lock = threading.Lock()
+
+    def add(self, name, duration_ms):
+        with self._lock:
+            self.spans.append((name, duration_ms))
+
+    def add_llm_usage(self, usage):
+        with self._lock:
+            self.llm_usage.append(usage)
+
+    def summary(self):
+        """Total time and count per span name, in the order each name first occurred."""
+        totals = {}
+        with self._lock:
+            for name, duration_ms in self.spans:
+                entry = totals.setdefault(name, {"count": 0, "total_ms": 0.0})
+                entry["count"] += 1
+                entry["total_ms"] += duration_ms
+        for entry in totals.values():
+            entry["total_ms"] = round(entry["total_ms"], 1)
+        totals["total"] = {"count": 1, "total_ms": round((time.perf_counter() - self.started) * 1000, 1)}
+        return totals
+
+    def server_timing(self):
+        return ", ".join(
+            f'{name};dur={entry["total_ms"]};desc="{entry["count"]}x"' for name, entry in self.summary().items()
+        )
+
+
+def current_trace():
+    return _current_trace.get()
+
+@contextmanager
+def use_trace(trace):
+    """Make trace the current trace, e.g. inside a streaming response's generator."""
+    token = _current_trace.set(trace)
+    try:
+        yield trace
+    finally:
+        try:
+            _current_trace.reset(token)
+        except ValueError:
+            pass # Closed from another context, e.g. a streaming response torn down by the server
+
+
+#################### Spans ######################
+
+def record(name, duration_ms, error=None, **attributes):
+    """Record a finished span, e.g. one timed in another process."""
+    SPAN_SECONDS.observe(duration_ms / 1000, span=name)
+    if error:
+        SPAN_ERRORS.inc(span=name)
+    trace = current_trace()
+    if trace is not None:
+        trace.add(name, duration_ms)
+    if settings.TRACE_LOG_SPANS:
+        logger.info(json.dumps({
+            "span": name,
+            "duration_ms": round(duration_ms, 2),
+            "trace_id": trace.id if trace else None,
+            **({"error": error} if error else {}),
+            **attributes,
+        }, default=str))
+
+@contextmanager
+def span(name, **attributes):
+    """
+    Time the enclosed block as a span. Yields the attributes dict so the block can
+    add to it (e.g. token counts once they're known).
+    """
+    started = time.perf_counter()
+    error = None
+    try:
+        yield attributes
+    except BaseException as e:
+        error = type(e).__name__
+        raise
+    finally:
+        record(name, (time.perf_counter() - started) * 1000, error, **attributes)
+
+def record_llm_usage(attributes, message, prompt_messages, model, purpose="chat"):
+    """
+    Add an LLM call's token counts to its span's attributes, to kosh_llm_tokens_total
+    and to the current trace (from which the turn's usage is persisted).
+    """
+    usage = getattr(message, "usage_metadata", None)
+    if usage:
+        prompt_tokens = usage.get("input_tokens", 0)
+        completion_tokens = usage.get("output_tokens", 0)
+        cached_tokens = (usage.get("input_token_details") or {}).get("cache_read", 0)
+    else:
+        # The client didn't report usage - estimate it
+        prompt_tokens = count_message_tokens(prompt_messages, model)
+        completion_tokens = count_message_tokens([message], model)
+        cached_tokens = 0
+        attributes["tokens_estimated"] = True
+    attributes.update(prompt_tokens=prompt_tokens, completion_tokens=completion_tokens, cached_prompt_tokens=cached_tokens)
+    LLM_TOKENS.inc(prompt_tokens, model=model, type="prompt")
+    LLM_TOKENS.inc(completion_tokens, model=model, type="completion")
+    if cached_tokens:
+        LLM_TOKENS.inc(cached_tokens, model=model, type="cached_prompt")
+    trace = current_trace()
+    if trace is not None:
+        trace.add_llm_usage({
+            "model": model,
+            "purpose": purpose,
+            "prompt_tokens": prompt_tokens,
+            "completion_tokens": completion_tokens,
+            "cached_prompt_tokens": cached_tokens,
+            "estimated": not usage,
+        })
+
+
+#################### Middleware ######################
+
+class TimingMiddleware:
+    """Start a Trace per request and record its duration; add Server-Timing with TIMING_HEADER."""
+
+    sync_capable = True
+    async_capable = True
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+        self.is_async = iscoroutinefunction(get_response)
+        if self.is_async:
+            markcoroutinefunction(self)
+
+    def __call__(self, request):
+        if self.is_async:
+            return self.__acall__(request)
+        with use_trace(Trace()) as trace:
+            response = self.get_response(request)
+        return self.finish(request, response, trace)
+
+    async def __acall__(self, request):
+        with use_trace(Trace()) as trace:
+            response = await self.get_response(request)
+        return self.finish(request, response, trace)
+
+    def finish(self, request, response, trace):
+        # The matched route, not the path, so IDs in URLs don't each become a series
+        match = getattr(request, "resolver_match", None)
+        route = match.route if match else "unmatched"
+        REQUEST_SECONDS.observe(
+            time.perf_counter() - trace.started, route=route, method=request.method, status=response.status_code,
+        )
+        # A streaming response's trace is only complete at the end of the stream
+        if settings.TIMING_HEADER and not response.streaming:
+            response["Server-Timing"] = trace.server_timing()
+        return response
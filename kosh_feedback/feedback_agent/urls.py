@@ -4,5 +4,11 @@ from . import views
 urlpatterns = [
     # API paths only - we use React frontend
     path("api/query_chatgpt/", views.query_chatgpt),
+    path("api/query_chatgpt/stream/", views.stream_chatgpt),
     path("api/setup_vector_db/", views.setup_vector_db),
+    path("api/setup_vector_db/compare/", views.compare_vector_indexes),
+    path("api/setup_vector_db/jobs/<uuid:job_id>/", views.index_job_status),
+    path("api/semantic_cache/stats/", views.semantic_cache_stats),
+    path("api/pdf_jobs/<uuid:job_id>/", views.pdf_job_status),
+    path("metrics", views.metrics),
 ]
\ No newline at end of file
@@ -0,0 +1,197 @@
+"""
+Read-only, memory-mapped vector index.
+
+An index directory holds three parts, none of them pickled:
+  - index.faiss: the FAISS index, loaded with mmap so every worker process
+    shares one page-cache copy instead of holding a private one
+  - chunks.bin + chunk_offsets.npy: all chunk texts as one UTF-8 blob, with
+    row i spanning offsets[i]:offsets[i + 1]; also memory-mapped
+  - metadata.json: chunk IDs and LangChain document metadata, as plain JSON
+  - vectors.npy: the raw float32 vectors, memory-mapped; only written for lossy
+    (quantized) index types, which can't reconstruct them exactly
+  - bm25/: a keyword index over the same rows (see lexical_index)
+
+MappedIndex is a LangChain VectorStore over that layout, so it can be used
+through as_retriever() like the FAISS store it replaces.
+"""
+import json
+import os
+
+import faiss
+import numpy as np
+from langchain_core.documents import Document
+from langchain_core.vectorstores import VectorStore
+
+from .lexical_index import BM25Index
+
+FAISS_FILENAME = "index.faiss"
+CHUNKS_FILENAME = "chunks.bin"
+OFFSETS_FILENAME = "chunk_offsets.npy"
+METADATA_FILENAME = "metadata.json"
+VECTORS_FILENAME = "vectors.npy"
+
+STORE_VERSION = 1
+
+# Older FAISS builds only mmap inverted lists; IO_FLAG_MMAP_IFC also maps flat codes
+MMAP_FLAGS = getattr(faiss, "IO_FLAG_MMAP_IFC", faiss.IO_FLAG_MMAP) | faiss.IO_FLAG_READ_ONLY
+
+
+class ChunkStore:
+    """Chunk texts stored back to back, addressed by row through an offsets array."""
+
+    def __init__(self, data, offsets):
+        self.data = data
+        self.offsets = offsets
+
+    @classmethod
+    def from_texts(cls, texts):
+        encoded = [text.encode("utf-8") for text in texts]
+        offsets = np.zeros(len(encoded) + 1, dtype=np.int64)
+        np.cumsum([len(b) for b in encoded], out=offsets[1:])
+        return cls(b"".join(encoded), offsets)
+
+    @classmethod
+    def load(cls, directory):
+        offsets = np.load(os.path.join(directory, OFFSETS_FILENAME), mmap_mode="r")
+        chunks_path = os.path.join(directory, CHUNKS_FILENAME)
+        # np.memmap can't map an empty file
+        data = np.memmap(chunks_path, dtype=np.uint8, mode="r") if os.path.getsize(chunks_path) else b""
+        return cls(data, offsets)
+
+    def save(self, directory):
+        with open(os.path.join(directory, CHUNKS_FILENAME), "wb") as f:
+            f.write(self.data if isinstance(self.data, bytes) else self.data.tobytes())
+        np.save(os.path.join(directory, OFFSETS_FILENAME), np.asarray(self.offsets))
+
+    def __len__(self):
+        return len(self.offsets) - 1
+
+    def __getitem__(self, row):
+        start, end = int(self.offsets[row]), int(self.offsets[row + 1])
+        return bytes(self.data[start:end]).decode("utf-8")
+
+
+def write_vectors(directory, vectors):
+    """Save the raw vectors next to an index, replacing any there atomically."""
+    path = os.path.join(directory, VECTORS_FILENAME)
+    with open(f"{path}.tmp", "wb") as f:
+        np.save(f, np.asarray(vectors, dtype=np.float32))
+    os.replace(f"{path}.tmp", path)
+
+def write_store(directory, index, texts, metadatas, ids, vectors=None):
+    """
+    Write a complete index directory, with the raw vectors if given. The caller
+    is responsible for swapping it into place.
+    """
+    os.makedirs(directory, exist_ok=True)
+    faiss.write_index(index, os.path.join(directory, FAISS_FILENAME))
+    ChunkStore.from_texts(texts).save(directory)
+    with open(os.path.join(directory, METADATA_FILENAME), "w", encoding="utf-8") as f:
+        json.dump({"version": STORE_VERSION, "ids": list(ids), "metadatas": list(metadatas)}, f)
+    BM25Index.build(texts).save(directory)
+    if vectors is not None:
+        write_vectors(directory, vectors)
+
+def is_store(directory):
+    return all(
+        os.path.exists(os.path.join(directory, filename))
+        for filename in (FAISS_FILENAME, CHUNKS_FILENAME, OFFSETS_FILENAME, METADATA_FILENAME)
+    )
+
+
+class MappedIndex(VectorStore):
+    """VectorStore over a FAISS index and a ChunkStore, with L2 scores like LangChain's FAISS."""
+
+    def __init__(self, index, chunks, ids, metadatas, embeddings, lexical=None, raw_vectors=None):
+        self.index = index
+        self.chunks = chunks
+        self.ids = ids
+        self.metadatas = metadatas
+        self._embeddings = embeddings
+        self.lexical = lexical # BM25Index over the same rows, or None for stores written before it existed
+        self.raw_vectors = raw_vectors # Memory-mapped exact vectors of a lossy index, or None
+
+    @classmethod
+    def load(cls, directory, embeddings, mmap=True):
+        if not is_store(directory):
+            raise FileNotFoundError(f"{directory} is not a complete index directory")
+        index_path = os.path.join(directory, FAISS_FILENAME)
+        index = faiss.read_index(index_path, MMAP_FLAGS) if mmap else faiss.read_index(index_path)
+        with open(os.path.join(directory, METADATA_FILENAME), "r", encoding="utf-8") as f:
+            metadata = json.load(f)
+        if metadata.get("version") != STORE_VERSION:
+            raise ValueError(f"Unsupported index store version {metadata.get('version')}")
+        lexical = BM25Index.load(directory) if BM25Index.exists(directory) else None
+        vectors_path = os.path.join(directory, VECTORS_FILENAME)
+        raw_vectors = np.load(vectors_path, mmap_mode="r") if os.path.exists(vectors_path) else None
+        if raw_vectors is not None and len(raw_vectors) != index.ntotal:
+            raw_vectors = None # Left over from another build - don't trust it
+        return cls(
+            index, ChunkStore.load(directory), metadata["ids"], metadata["metadatas"], embeddings, lexical, raw_vectors,
+        )
+
+    @classmethod
+    def from_texts(cls, texts, embedding, metadatas=None, ids=None, **kwargs):
+        """Build an in-memory index (nothing is written to disk)."""
+        texts = list(texts)
+        vectors = np.asarray(embedding.embed_documents(texts), dtype=np.float32)
+        index = faiss.IndexFlatL2(vectors.shape[1] if len(vectors) else len(embedding.embed_query("")))
+        if len(vectors):
+            index.add(vectors)
+        return cls(
+            index,
+            ChunkStore.from_texts(texts),
+            list(ids) if ids is not None else [str(i) for i in range(len(texts))],
+            list(metadatas) if metadatas is not None else [{} for _ in texts],
+            embedding,
+            BM25Index.build(texts),
+        )
+
+    @property
+    def embeddings(self):
+        return self._embeddings
+
+    def __len__(self):
+        return self.index.ntotal
+
+    #################### Rows ######################
+
+    def document(self, row):
+        return Document(id=self.ids[row], page_content=self.chunks[row], metadata=self.metadatas[row])
+
+    def vectors(self, rows):
+        """
+        The stored vectors for the given rows: from the raw vectors if saved,
+        otherwise reconstructed (which is only exact for exact index types).
+        """
+        if not rows:
+            return np.zeros((0, self.index.d), dtype=np.float32)
+        if self.raw_vectors is not None:
+            return np.asarray(self.raw_vectors[np.asarray(rows, dtype=np.int64)], dtype=np.float32)
+        return np.vstack([self.index.reconstruct(int(row)) for row in rows])
+
+    #################### Search ######################
+
+    def search_vectors(self, vectors, k):
+        """Search a matrix of query vectors at once. Returns FAISS (distances, rows)."""
+        vectors = np.asarray(vectors, dtype=np.float32)
+        if self.index.ntotal == 0:
+            empty = np.full((len(vectors), k), -1, dtype=np.int64)
+            return np.zeros((len(vectors), k), dtype=np.float32), empty
+        return self.index.search(vectors, min(k, self.index.ntotal))
+
+    def similarity_search_with_score_by_vector(self, embedding, k=4, **kwargs):
+        distances, rows = self.search_vectors([embedding], k)
+        return [(self.document(int(row)), float(d)) for d, row in zip(distances[0], rows[0]) if row != -1]
+
+    def similarity_search_by_vector(self, embedding, k=4, **kwargs):
+        return [doc for doc, _ in self.similarity_search_with_score_by_vector(embedding, k, **kwargs)]
+
+    def similarity_search_with_score(self, query, k=4, **kwargs):
+        return self.similarity_search_with_score_by_vector(self._embeddings.embed_query(query), k, **kwargs)
+
+    def similarity_search(self, query, k=4, **kwargs):
+        return [doc for doc, _ in self.similarity_search_with_score(query, k, **kwargs)]
+
+    def _select_relevance_score_fn(self):
+        return self._euclidean_relevance_score_fn
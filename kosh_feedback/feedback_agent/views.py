@@ -1,13 +1,23 @@
-import os
-import tempfile
 import traceback
-import uuid 
 import json
+import time
+import contextvars
+from concurrent.futures import ThreadPoolExecutor, TimeoutError as FutureTimeoutError
+from functools import lru_cache
 
 from typing import TypedDict, Annotated, Sequence, Optional
 
+import numpy as np
+import openai
+
 from django.shortcuts import render
 from django.conf import settings
+from django.db import close_old_connections
+from django.http import HttpResponse, StreamingHttpResponse
+from django.views.decorators.csrf import csrf_exempt
+from django.views.decorators.http import require_POST
+
+from asgiref.sync import sync_to_async
 
 from rest_framework import status
 from rest_framework.decorators import api_view
@@ -15,27 +25,31 @@ from rest_framework.response import Response
 
 from .serializers import *
 from .models import *
-
-# To generate PDF ##
-from reportlab.lib.pagesizes import letter
-from reportlab.pdfgen import canvas
-from reportlab.lib.styles import getSampleStyleSheet
-from reportlab.platypus import SimpleDocTemplate, Paragraph, Spacer
-from reportlab.lib.units import inch
-from reportlab.lib.enums import TA_JUSTIFY
+from .indexing import all_vectors, has_exact_vectors
+from .index_types import INDEX_TYPES, compare_index_types
+from .resources import get_llm, get_indexing_embeddings, get_vectorstore, IndexNotAvailable
+from .retrieval import multi_query_search
+from .ingestion import iter_extracted, take_within_budget
+from .sessions import get_session, record_turn, save_session
+from .prompts import build_prompt, prompt_cache_key
+from . import semantic_cache
+from . import report_index
+from . import pdf_jobs
+from . import index_jobs
+from . import persistence
+from .metrics import render_metrics
+from .tracing import span, record, record_llm_usage, current_trace, use_trace
+from .budget import ExecutionBudget, RunCancelled, CANCEL_POLL_SECONDS, run_config, budget_from
+from . import openai_client
 
 # Reducer function to manage state
 from operator import add as add_messages ##
 
 # Setup Vector DB and RAG stuff
-from langchain_community.document_loaders import PyPDFLoader
-from langchain_community.document_loaders import PyMuPDFLoader
-from langchain.text_splitter import RecursiveCharacterTextSplitter
-from langchain_community.vectorstores import FAISS
-from langchain_openai import ChatOpenAI, OpenAIEmbeddings
 from langchain.prompts import ChatPromptTemplate
-from langchain_core.messages import BaseMessage, SystemMessage, HumanMessage, ToolMessage
-from langchain_core.tools import tool
+from langchain_core.messages import BaseMessage, HumanMessage, AIMessage, ToolMessage
+from langchain_core.tools import tool, InjectedToolArg
+from langchain_core.runnables import RunnableConfig
 
 # Langgraph
 from langgraph.graph import StateGraph, START, END
@@ -48,58 +62,143 @@ load_dotenv()
 
 #################### Helper functions ######################
 
-# Load vector store 
-def load_vector_db():
-    index_dir = os.path.join(settings.BASE_DIR, "vectorstores", "sample_index")
-    embeddings = OpenAIEmbeddings(model="text-embedding-3-small")
-    vectorstore = FAISS.load_local(index_dir, embeddings, allow_dangerous_deserialization=True)
-    return vectorstore
+def upload_source(f):
+    """
+    What to hand the PDF parser for an uploaded file, avoiding copies:
+    Django's spooled temp file path for large uploads, or a view of the
+    in-memory buffer for small ones.
+    """
+    if hasattr(f, "temporary_file_path"):
+        return f.temporary_file_path()
+    if hasattr(f.file, "getbuffer"):
+        return f.file.getbuffer()
+    return f.read()
 
 # Process all user PDFs as texts
 def process_pdf_files(files):
-    all_text = ""
-    for f in files:
-        # Create a temp file that won't auto-delete (Windows compatibility)
-        with tempfile.NamedTemporaryFile(delete=False, suffix=".pdf") as tmp_file:
-            tmp_file.write(f.read())
-            tmp_file_path = tmp_file.name
-
-        try:
-            loader = PyMuPDFLoader(tmp_file_path)
-            docs = loader.load()
-            for d in docs:
-                all_text += d.page_content + "\n"
-        finally:
-            os.remove(tmp_file_path)  # Clean up
-    return all_text
+    """
+    Extract the text of all uploaded PDFs, in upload order, within the
+    REPORT_MAX_PAGES / REPORT_MAX_CHARS budget shared across the uploads.
+    """
+    max_pages = settings.REPORT_MAX_PAGES
+    max_chars = settings.REPORT_MAX_CHARS
+
+    with span("pdf_extraction", files=len(files)) as attributes:
+        extracted = {}
+        for result in iter_extracted(((i, upload_source(f)) for i, f in enumerate(files)), max_pages, max_chars):
+            extracted[result.name] = result
+            # Timed where it ran, which may be a pool process
+            record("pdf_extract_file", result.extract_ms, pages=len(result.pages), truncated=result.truncated)
+
+        # Apply the budget across all uploads, in upload order. With several files, each one's
+        # text starts with a header so report sections can be traced back to their file.
+        all_pages = (
+            f"{report_index.file_header(files[i].name)}\n{page}" if len(files) > 1 and j == 0 else page
+            for i in range(len(files)) for j, page in enumerate(extracted[i].pages)
+        )
+        pages, truncated = take_within_budget(all_pages, max_pages, max_chars)
+        if truncated or any(result.truncated for result in extracted.values()):
+            pages.append(f"[Report truncated to fit the {max_pages} page / {max_chars} character limit.]")
+        attributes.update(pages=len(pages), truncated=truncated)
+    return "\n".join(pages)
 
 # Set up vector store - Run to process RAG data into vector store
 @api_view(['POST'])
 def setup_vector_db(request):
-    data_folder = os.path.join(settings.BASE_DIR, "RAG_data") 
-    all_chunks = []
-
-    # Step 1: Chunk all PDFs
-    for filename in os.listdir(data_folder):
-        if filename.endswith(".pdf"):
-            pdf_path = os.path.join(data_folder, filename)
-            loader = PyPDFLoader(pdf_path)
-            docs = loader.load()
-
-            text_splitter = RecursiveCharacterTextSplitter(chunk_size=500, chunk_overlap=50)
-            chunks = text_splitter.split_documents(docs)
-            all_chunks.extend(chunks)
+    """
+    Start indexing the RAG_data PDFs in the background and return the job (202).
+    Only new or changed PDFs are embedded unless mode=full is posted, which
+    rebuilds the whole index. index_type and index_params override
+    VECTOR_INDEX_TYPE and VECTOR_INDEX_PARAMS. A job that failed resumes from
+    its last checkpoint when posted again. While a job is queued or running,
+    that job is returned with 409.
+    """
+    incremental = request.data.get("mode", "incremental") != "full"
+    index_type = request.data.get("index_type") or settings.VECTOR_INDEX_TYPE
+    index_params = request.data.get("index_params") or settings.VECTOR_INDEX_PARAMS
+    if index_type not in INDEX_TYPES:
+        return Response({"error": f"index_type must be one of {', '.join(INDEX_TYPES)}."}, status=status.HTTP_400_BAD_REQUEST)
+    if not isinstance(index_params, dict):
+        return Response({"error": "index_params must be an object."}, status=status.HTTP_400_BAD_REQUEST)
+
+    job, created = index_jobs.enqueue(incremental, index_type, index_params)
+    if not created:
+        return Response(
+            {"error": "An indexing job is already queued or running.", "job": index_jobs.job_info(job)},
+            status=status.HTTP_409_CONFLICT,
+        )
+    return Response(index_jobs.job_info(job), status=status.HTTP_202_ACCEPTED)
+
+@api_view(['GET'])
+def index_job_status(request, job_id):
+    """Progress of an indexing job started by setup_vector_db: files and chunks done, rate and ETA."""
+    try:
+        job = IndexJob.objects.get(pk=job_id)
+    except IndexJob.DoesNotExist:
+        return Response({"error": "Unknown indexing job."}, status=status.HTTP_404_NOT_FOUND)
+    return Response(index_jobs.job_info(job))
 
-    # Step 2: Embed all chunks
-    embeddings = OpenAIEmbeddings(model="text-embedding-3-small")
-    db = FAISS.from_documents(all_chunks, embeddings)
+@api_view(['POST'])
+def compare_vector_indexes(request):
+    """
+    Report recall@k and search latency of each index type against exact (flat)
+    search, over the vectors of the current index. Posted queries are embedded;
+    without them, a sample of indexed chunks is used as queries. To keep this
+    quick enough for a request, larger indexes are compared on a random sample
+    of INDEX_COMPARE_MAX_VECTORS of their vectors.
+    """
+    try:
+        k = int(request.data.get("k", 10))
+    except (TypeError, ValueError):
+        k = 0
+    if k < 1:
+        return Response({"error": "k must be a positive integer."}, status=status.HTTP_400_BAD_REQUEST)
+    index_types = request.data.get("index_types") or list(INDEX_TYPES)
+    if not isinstance(index_types, list):
+        return Response({"error": "index_types must be a list."}, status=status.HTTP_400_BAD_REQUEST)
+    unknown = [str(t) for t in index_types if t not in INDEX_TYPES]
+    if unknown:
+        return Response({"error": f"Unknown index types: {', '.join(unknown)}."}, status=status.HTTP_400_BAD_REQUEST)
+    index_params = request.data.get("index_params") or {}
+    if not isinstance(index_params, dict):
+        return Response({"error": "index_params must be an object."}, status=status.HTTP_400_BAD_REQUEST)
+    posted_queries = request.data.get("queries") or []
+    if not isinstance(posted_queries, list) or not all(isinstance(q, str) for q in posted_queries):
+        return Response({"error": "queries must be a list of strings."}, status=status.HTTP_400_BAD_REQUEST)
+    if len(posted_queries) > settings.INDEX_COMPARE_MAX_QUERIES:
+        return Response(
+            {"error": f"At most {settings.INDEX_COMPARE_MAX_QUERIES} queries can be compared."},
+            status=status.HTTP_400_BAD_REQUEST,
+        )
 
-    # Step 3: Save vectorstore
-    index_dir = os.path.join(settings.BASE_DIR, "vectorstores", "sample_index")
-    os.makedirs(index_dir, exist_ok=True)
-    db.save_local(index_dir)
+    try:
+        store = get_vectorstore()
+    except IndexNotAvailable as e:
+        return Response({"error": str(e)}, status=status.HTTP_400_BAD_REQUEST)
+    if not has_exact_vectors(store, settings.VECTORSTORE_DIR):
+        # Re-embedding the whole corpus has no place on a request thread
+        return Response(
+            {"error": "This index was built without its raw vectors. Run setup_vector_db once to add them."},
+            status=status.HTTP_409_CONFLICT,
+        )
+    vectors = all_vectors(store, settings.VECTORSTORE_DIR, max_count=settings.INDEX_COMPARE_MAX_VECTORS)
+    if not len(vectors):
+        return Response({"error": "The index is empty."}, status=status.HTTP_400_BAD_REQUEST)
+
+    if posted_queries:
+        queries = np.asarray(get_indexing_embeddings().embed_documents(posted_queries), dtype=np.float32)
+    else:
+        sample = np.random.default_rng(0).choice(
+            len(vectors), min(settings.INDEX_COMPARE_MAX_QUERIES, len(vectors)), replace=False)
+        queries = vectors[sample]
 
-    return Response({"message": f"Indexed {len(all_chunks)} chunks from {len(os.listdir(data_folder))} PDF(s)."})
+    try:
+        report = compare_index_types(vectors, queries, k, index_types, index_params)
+    except ValueError as e:
+        return Response({"error": str(e)}, status=status.HTTP_400_BAD_REQUEST)
+    return Response({
+        "vectors": len(vectors), "index_vectors": len(store), "queries": len(queries), "k": k, "report": report,
+    })
 
 
 # --- LangGraph Agent Setup ---
@@ -108,9 +207,7 @@ class State(TypedDict):
     """Store state values here"""
     messages: Annotated[Sequence[BaseMessage], add_messages] # List of messages
     user_report_content: Optional[str] # To store the user's uploaded report text
-
-llm = ChatOpenAI(model="gpt-4o", temperature=0.3)
-retriever = load_vector_db()
+    conversation_summary: Optional[str] # Summary of earlier turns no longer in messages
 
 #################################
 # Tool definition
@@ -121,41 +218,26 @@ def pdf_tool(summary_content: str) -> str:
     The 'summary_content' argument should be the complete text for the PDF,
     including analysis of the user's report, conversation summary, and next steps.
     """
-    unique_id = uuid.uuid4() 
-    # Create a unique filename for the PDF
-    pdf_filename = f"career_coach_summary_{unique_id}.pdf"
-    
-    pdf_output_dir = os.path.join(settings.MEDIA_ROOT, "generated_pdfs")
-    os.makedirs(pdf_output_dir, exist_ok=True) # Ensure directory exists
-    pdf_filepath = os.path.join(pdf_output_dir, pdf_filename)
-
+    # Rendering happens in the background queue - return the job's details straight away
     try:
-        doc = SimpleDocTemplate(pdf_filepath, pagesize=letter)
-        styles = getSampleStyleSheet()
-        story = []
-
-        story.append(Paragraph("<b>Kosh Feedback Session Summary</b>", styles['h1']))
-        story.append(Spacer(1, 0.2 * inch))
-
-        formatted_summary = summary_content.replace('\n', '<br/>')
-        story.append(Paragraph(formatted_summary, styles['Normal']))
-        story.append(Spacer(1, 0.2 * inch))
-
-        doc.build(story)
-
-        # Construct the URL to the PDF. This assumes MEDIA_URL is correctly set
-        # and your web server (or Django dev server) is serving files from MEDIA_ROOT
-        pdf_url = f"{settings.MEDIA_URL}generated_pdfs/{pdf_filename}"
-        return f'{{"status": "success", "message": "PDF summary successfully generated.", "url": "{pdf_url}", "filename": "{pdf_filename}"}}'
-
+        job = pdf_jobs.enqueue(summary_content)
+        return json.dumps(pdf_jobs.job_info(job))
     except Exception as e:
-        print(f"Error generating PDF: {e}")
-        return f'{{"status": "error", "message": "Failed to generate PDF summary: {str(e)}", "url": null, "filename": null}}'
+        print(f"Error queueing PDF: {e}")
+        return json.dumps({"status": "error", "message": f"Failed to generate PDF summary: {e}", "url": None, "filename": None})
 
 @tool
-def retriever_tool(query: str) -> str:
-    """This tool searches and returns the information from our vectorstore of research."""
-    docs = retriever.invoke(query)
+def retriever_tool(query: str = "", queries: Optional[list[str]] = None) -> str:
+    """
+    This tool searches and returns the information from our vectorstore of research.
+    Pass one search `query`, or several related searches at once as a list in `queries`.
+    """
+    all_queries = ([query] if query else []) + list(queries or [])
+    try:
+        docs = multi_query_search(get_vectorstore(), all_queries)
+    except IndexNotAvailable as e:
+        print(e)
+        return "The research vectorstore is not available right now, so no research could be retrieved."
 
     if not docs:
         return "I found no relevant information in the vectorstore"
@@ -166,82 +248,167 @@ def retriever_tool(query: str) -> str:
     
     return "\n\n".join(results)
 
-tools = [pdf_tool, retriever_tool]
+@tool
+def report_tool(
+    query: str = "", queries: Optional[list[str]] = None, report: Annotated[Optional[str], InjectedToolArg] = None,
+) -> str:
+    """
+    This tool searches the client's uploaded psychometric report and returns its most relevant sections.
+    Pass one search `query`, or several related searches at once as a list in `queries`.
+    """
+    all_queries = ([query] if query else []) + list(queries or [])
+    if not report:
+        return "The client has not uploaded a report."
+    if not report_index.is_long(report):
+        return "The client's full report is already included above; no search is needed."
+
+    docs = report_index.search(report, all_queries)
+    if not docs:
+        return "I found no relevant sections in the client's report"
+    return report_index.format_sections(docs)
+
+tools = [pdf_tool, retriever_tool, report_tool]
 tools_dict = {our_tool.name: our_tool for our_tool in tools} # Creating a dictionary of our tools
 
 ################################
 # Node definition
-llm = llm.bind_tools(tools) # Enables tool calling
+@lru_cache(maxsize=1)
+def get_tool_llm():
+    """The shared LLM client with our tools bound (enables tool calling)."""
+    return get_llm().bind_tools(tools)
+
+@lru_cache(maxsize=1)
+def get_final_answer_llm():
+    """The LLM with tools bound but disabled, for the forced final answer once the budget is spent."""
+    return get_llm().bind_tools(tools, tool_choice="none")
 
 def should_continue(state: State):
     """Check if the last message contains tool calls"""
     result = state['messages'][-1]
     return hasattr(result, 'tool_calls') and len(result.tool_calls) > 0
 
-def tool_agent(state: State) -> State:
-    """Execute tool calls from the LLM's response."""
+def run_tool_call(t, report=None):
+    """Execute a single tool call from the LLM's response and return its result. report is the session's report text."""
+    if t['name'] == 'pdf_tool':
+        # The LLM should have provided 'summary_content' in its args for the PDF tool
+        summary_content = t['args'].get('summary_content', '')
+        if not summary_content:
+            return "Error: PDF tool called but no 'summary_content' provided by the LLM."
+        return tools_dict[t['name']].invoke(summary_content) # Invoke with the generated content
+    elif t['name'] == 'retriever_tool':
+        return tools_dict[t['name']].invoke({'query': t['args'].get('query', ''), 'queries': t['args'].get('queries')})
+    elif t['name'] == 'report_tool':
+        return tools_dict[t['name']].invoke({
+            'query': t['args'].get('query', ''), 'queries': t['args'].get('queries'), 'report': report,
+        })
+    else:
+        # Handle cases where the LLM tries to call an unknown tool
+        return f"Unknown tool: {t['name']}. Please ensure only available tools are used. Arguments provided: {t['args']}"
+
+def run_tool_call_in_worker(t, report=None):
+    try:
+        with span(f"tool.{t['name']}", tool_call_id=t['id']):
+            return run_tool_call(t, report)
+    finally:
+        close_old_connections() # Tools may touch the DB from this pool thread
+
+@lru_cache(maxsize=1)
+def get_tool_executor():
+    """Shared, bounded pool for running a turn's tool calls concurrently."""
+    return ThreadPoolExecutor(max_workers=settings.TOOL_MAX_WORKERS, thread_name_prefix="tool")
+
+def tool_timeout(name):
+    return settings.TOOL_TIMEOUTS.get(name, settings.TOOL_TIMEOUT_SECONDS)
+
+def wait_for_tool(future, until, budget):
+    """Wait for a tool call until the monotonic time until, giving up early if the run is cancelled."""
+    while True:
+        budget.check_cancelled()
+        left = until - time.monotonic()
+        if left <= 0:
+            raise FutureTimeoutError()
+        try:
+            return future.result(timeout=min(left, CANCEL_POLL_SECONDS))
+        except FutureTimeoutError:
+            continue
+
+def tool_agent(state: State, config: RunnableConfig) -> State:
+    """
+    Execute tool calls from the LLM's response concurrently. Each call has its own
+    timeout, and a failing or slow call only affects its own ToolMessage.
+    Calls beyond the turn's tool call budget are skipped, and every call must
+    finish before the budget's deadline.
+    ToolMessages are returned in the same order as the tool calls.
+    """
+    budget = budget_from(config)
+    budget.check_cancelled()
     tool_calls = state['messages'][-1].tool_calls
+    allowed = budget.take_tool_calls(len(tool_calls))
+    executor = get_tool_executor()
+
+    # copy_context keeps each call attached to this run's callbacks (streaming events, tracing)
+    submitted_at = time.monotonic()
+    report = state.get('user_report_content')
+    futures = [
+        executor.submit(contextvars.copy_context().run, run_tool_call_in_worker, t, report)
+        for t in tool_calls[:allowed]
+    ]
+
     results = []
-    for t in tool_calls:
-
-        if t['name'] == 'pdf_tool':
-            # The LLM should have provided 'summary_content' in its args for the PDF tool
-            summary_content = t['args'].get('summary_content', '')
-            if not summary_content:
-                result = "Error: PDF tool called but no 'summary_content' provided by the LLM."
-            else:
-                result = tools_dict[t['name']].invoke(summary_content) # Invoke with the generated content
-        elif t['name'] == 'retriever_tool':
-            result = tools_dict[t['name']].invoke(t['args'].get('query', ''))
-        else:
-            # Handle cases where the LLM tries to call an unknown tool
-            result = f"Unknown tool: {t['name']}. Please ensure only available tools are used. Arguments provided: {t['args']}"
-        
+    for t, future in zip(tool_calls, futures):
+        timeout = tool_timeout(t['name'])
+        try:
+            result = wait_for_tool(future, min(submitted_at + timeout, budget.tool_deadline()), budget)
+        except RunCancelled:
+            for pending in futures:
+                pending.cancel()
+            raise
+        except FutureTimeoutError:
+            future.cancel()
+            print(f"Tool {t['name']} timed out after {time.monotonic() - submitted_at:.1f}s")
+            result = f"Error: {t['name']} timed out. Continue without its result."
+        except Exception as e:
+            print(traceback.format_exc())
+            result = f"Error: {t['name']} failed: {e}"
+
         results.append(ToolMessage(tool_call_id=t['id'], name=t['name'], content=str(result)))
 
+    # Every tool call needs a reply, including the ones over budget
+    for t in tool_calls[allowed:]:
+        results.append(ToolMessage(
+            tool_call_id=t['id'], name=t['name'],
+            content="Skipped: the tool call limit for this turn was reached. Answer with what you have.",
+        ))
+
     print("Tools Execution Complete. Back to the model!")
     return {'messages': results} # This returns the ToolMessage(s) to the state
 
-def llm_call(state:State) -> State:
-    # Updated system prompt to guide the LLM on tool usage and content generation
-    system_prompt_content = (
-        "You are a compassionate and insightful career coach. Your primary goal is to provide "
-        "comprehensive, detailed and verbose analysis and actionable guidance based on the client's psychometric reports "
-        "and our conversation.\n\n"
-        "**Context for Analysis:**\n"
-        "- Use the `retriever_tool` to access information from our pool of research resources when needed. "
-        "  Provide a precise search `query` to this tool.\n"
-        "- The client's uploaded psychometric report content is available to you. "
-        "  Integrate insights from this 'User Report Content' into your analysis.\n\n"
-        "**Tool Usage Guidelines:**\n"
-        "- If the client asks to **end the session**, **generate a summary**, or requests a **PDF of the session/report**, "
-        "  you **must** use the `pdf_tool`.\n"
-        "- When calling the `pdf_tool`, you **must** provide the *entire summary content* as the `summary_content` argument. "
-        "  This `summary_content` should be a comprehensive text that includes:\n"
-        "    1.  An in-depth analysis of the user's psychometric reports, elaborating on strengths and weaknesses.\n"
-        "    2.  A detailed and long summary of the entire conversation up to this point.\n"
-        "    3.  Clear, actionable recommendations for the user's immediate next steps in their career journey.\n"
-        "    Ensure this summary is well-formatted and ready for PDF generation.\n\n"
-        "**Response Formatting:**\n"
-        "- Always format your direct responses using Markdown, compatible with <ReactMarkdown>.\n"
-        "- Provide an in-depth analysis, elaborating on each major sub-point with clear, detailed explanations.\n"
-        "- Offer clear, actionable, and empathetic advice.\n"
-        "- **Crucially, cite specific parts of the retrieved documents (e.g., 'According to Document 3...') when using information from the `retriever_tool`.**\n"
-        "Your final answer should be a well-structured, thorough, verbose and comprehensive and helpful Markdown response to the client, or a tool call."
-    )
-    system_message = SystemMessage(content=system_prompt_content)
-    
-    # Prepare messages for LLM, including system prompt and user_report_content if present
-    messages_for_llm = [system_message]
-    
-    # Inject user's report content as a SystemMessage if available in the state
-    if state.get("user_report_content"):
-        messages_for_llm.append(SystemMessage(content=f"--- Client's Psychometric Report ---\n{state['user_report_content']}\n--- End Client's Psychometric Report ---"))
+def llm_call(state:State, config: RunnableConfig) -> State:
+    budget = budget_from(config)
+    budget.check_cancelled()
+    # Once the budget is spent, one last call with tools disabled gives the final answer
+    final_reason = budget.must_answer()
+    if final_reason:
+        budget.exhausted_reason = final_reason
+        print(f"Execution budget reached ({final_reason}), forcing a final answer")
+
+    # System prompt, then the client's report and earlier-conversation summary, then history -
+    # most stable first, so consecutive steps share a cacheable prefix
+    messages_for_llm = build_prompt(state, final_answer=bool(final_reason))
+
+    # Never wait on the API past the deadline (the final answer gets its reserved time)
+    kwargs = {"timeout": max(budget.remaining_seconds(), settings.AGENT_FINAL_ANSWER_RESERVE_SECONDS)}
+    if settings.OPENAI_PROMPT_CACHE_KEY:
+        kwargs["prompt_cache_key"] = prompt_cache_key(state.get("user_report_content"))
+    llm = get_final_answer_llm() if final_reason else get_tool_llm()
+    with span("llm_call", model=settings.CHAT_MODEL, messages=len(messages_for_llm), final=bool(final_reason)) as attributes:
+        response = llm.invoke(messages_for_llm, **kwargs)
+        record_llm_usage(attributes, response, messages_for_llm, settings.CHAT_MODEL)
+        attributes["tool_calls"] = len(getattr(response, "tool_calls", None) or [])
+    budget.charge_step(attributes["prompt_tokens"] + attributes["completion_tokens"])
+    if final_reason and getattr(response, "tool_calls", None):
+        response = AIMessage(content=response.content or "") # Tools are off; don't route back to tool_agent
 
-    messages_for_llm.extend(list(state["messages"])) # Add the actual conversation history
-    
-    response = llm.invoke(messages_for_llm) # Use the correctly named bound LLM instance
-    
     return {"messages": [response]} # Updates the state via add_messages
 
 ################################
@@ -265,44 +432,247 @@ app = graph.compile()
 ################################
 # Invocation / API call
 
+def parse_pdf_tool_output(content):
+    """Parse the JSON string returned by the pdf_tool into a dict."""
+    try:
+        return json.loads(content)
+    except json.JSONDecodeError:
+        return {"status": "error", "message": content}
+
+def initial_state_for(session, user_question):
+    """Graph input for a new turn: the session's history plus the new question."""
+    return {
+        "messages": session.messages + [HumanMessage(content=user_question)],
+        "user_report_content": session.report or None,
+        "conversation_summary": session.summary or None,
+    }
+
+def sse_event(event, data):
+    """Format a single Server-Sent Event frame."""
+    return f"event: {event}\ndata: {json.dumps(data, default=str)}\n\n"
+
+# Retries were exhausted or the circuit is open (see openai_client) - the client should come back later
+OPENAI_UNAVAILABLE = (openai.APIConnectionError, openai.RateLimitError, openai.InternalServerError)
+SERVICE_BUSY_MESSAGE = "The AI service is busy or unavailable right now. Please try again shortly."
+
 @api_view(['POST'])
 def query_chatgpt(request):
     user_question = request.POST.get("message") # User's current text message/query
     files = request.FILES.getlist("files")     # List of uploaded PDF files
 
-    user_doc_text = ""
-    if files: # Only process if files are uploaded
-        user_doc_text = process_pdf_files(files)
+    # Continue the conversation if the client sent its ID; the report is kept server-side
+    session = get_session(request.POST.get("conversation_id"))
+    if files: # Only process if files are uploaded - a new upload replaces the stored report
+        session.report = process_pdf_files(files)
+        report_index.prefetch(session.report) # Index a long report while the model starts on the question
 
-    messages = [HumanMessage(content=user_question)]
-
-    initial_state = {
-        "messages": messages,
-        "user_report_content": user_doc_text if user_doc_text else None
-    }
+    initial_state = initial_state_for(session, user_question)
 
     try:
-        result = app.invoke(initial_state)
+        # Opening questions already answered for this report are served from the semantic cache
+        started_at = time.perf_counter()
+        cache_key = semantic_cache.cache_key_for(session, user_question)
+        cached_response = semantic_cache.lookup(cache_key)
+        if cached_response is not None:
+            record_turn(session, user_question, cached_response)
+            save_session(session)
+            if files:
+                persistence.save_report(session, files)
+            persistence.save_turn(session, user_question, cached_response, trace=current_trace(), cached=True,
+                                  latency_ms=(time.perf_counter() - started_at) * 1000)
+            return Response({"response": cached_response, "conversation_id": str(session.id), "cached": True})
+
+        # WSGI can't tell when a client disconnects, so the deadline bounds abandoned requests
+        budget = ExecutionBudget.from_settings()
+        result = app.invoke(initial_state, config=run_config(budget))
         final_message_content = result["messages"][-1].content
 
         pdf_status_data = None # Store parsed JSON data here
         # Iterate through messages to find the PDF tool's output
         for msg in reversed(result["messages"]):
             if isinstance(msg, ToolMessage) and msg.name == "pdf_tool":
-                try:
-                    # Parse the JSON string returned by the pdf_tool
-                    pdf_status_data = json.loads(msg.content)
-                except json.JSONDecodeError:
-                    pdf_status_data = {"status": "error", "message": msg.content}
+                pdf_status_data = parse_pdf_tool_output(msg.content)
                 break
 
-        response_data = {"response": final_message_content}
+        latency_ms = (time.perf_counter() - started_at) * 1000
+        if not budget.exhausted_reason: # A forced answer may be incomplete - don't serve it again
+            semantic_cache.store(cache_key, final_message_content, latency_ms, used_pdf_tool=pdf_status_data is not None)
+
+        record_turn(session, user_question, final_message_content)
+        save_session(session)
+        if files:
+            persistence.save_report(session, files)
+        persistence.save_turn(session, user_question, final_message_content, trace=current_trace(),
+                              budget_exhausted=budget.exhausted_reason, latency_ms=latency_ms, pdf_info=pdf_status_data)
+
+        response_data = {"response": final_message_content, "conversation_id": str(session.id)}
         if pdf_status_data:
             response_data["pdf_info"] = pdf_status_data # Add the parsed dictionary
+        if budget.exhausted_reason:
+            response_data["budget"] = budget.summary()
         return Response(response_data)
 
+    except OPENAI_UNAVAILABLE as e:
+        print(f"OpenAI unavailable: {e!r}")
+        return Response(
+            {"error": SERVICE_BUSY_MESSAGE}, status=status.HTTP_503_SERVICE_UNAVAILABLE,
+            headers={"Retry-After": str(openai_client.retry_after("chat"))},
+        )
     except Exception as e:
         print(traceback.format_exc()) # Print full traceback
         return Response({"error": str(e)}, status=500)
 
 
+@csrf_exempt
+@require_POST
+async def stream_chatgpt(request):
+    """
+    Streaming counterpart of query_chatgpt. Runs the graph asynchronously and emits
+    Server-Sent Events as they happen:
+      - token: a chunk of the model's answer
+      - tool_start / tool_end: a tool invocation began / finished
+      - pdf_info: the parsed pdf_tool result
+      - done: final response plus timings (ttft_ms is the latency we track)
+      - error: something went wrong mid-stream
+    """
+    user_question = request.POST.get("message")
+    files = request.FILES.getlist("files")
+
+    session = await sync_to_async(get_session)(request.POST.get("conversation_id"))
+    if files:
+        session.report = await sync_to_async(process_pdf_files)(files)
+        report_index.prefetch(session.report)
+
+    initial_state = initial_state_for(session, user_question)
+    trace = current_trace() # The generator runs after the middleware returns, so keep hold of it
+
+    budget = ExecutionBudget.from_settings()
+
+    async def event_stream():
+        started_at = time.perf_counter()
+        ttft_ms = None
+        final_message_content = ""
+        pdf_status_data = None
+        finished = False
+
+        try:
+            cache_key = await sync_to_async(semantic_cache.cache_key_for)(session, user_question)
+            cached_response = semantic_cache.lookup(cache_key)
+            if cached_response is not None:
+                record_turn(session, user_question, cached_response)
+                await sync_to_async(save_session)(session)
+                ttft_ms = (time.perf_counter() - started_at) * 1000
+                if files:
+                    persistence.save_report(session, files)
+                persistence.save_turn(session, user_question, cached_response, trace=trace, cached=True,
+                                      streamed=True, latency_ms=ttft_ms)
+                yield sse_event("token", {"content": cached_response})
+                yield sse_event("done", {
+                    "response": cached_response,
+                    "conversation_id": str(session.id),
+                    "cached": True,
+                    "ttft_ms": ttft_ms,
+                })
+                finished = True
+                return
+
+            async for event in app.astream_events(initial_state, config=run_config(budget), version="v2"):
+                kind = event["event"]
+                node = event.get("metadata", {}).get("langgraph_node")
+
+                if kind == "on_chat_model_stream" and node == "llm_call":
+                    content = event["data"]["chunk"].content
+                    if content:
+                        if ttft_ms is None:
+                            ttft_ms = (time.perf_counter() - started_at) * 1000
+                            print(f"Time to first token: {ttft_ms:.0f} ms")
+                        yield sse_event("token", {"content": content})
+
+                elif kind == "on_chat_model_end" and node == "llm_call":
+                    output = event["data"].get("output")
+                    if output is not None and not getattr(output, "tool_calls", None):
+                        final_message_content = output.content
+
+                elif kind == "on_tool_start":
+                    yield sse_event("tool_start", {"name": event["name"], "run_id": event["run_id"]})
+
+                elif kind == "on_tool_end":
+                    yield sse_event("tool_end", {"name": event["name"], "run_id": event["run_id"]})
+                    if event["name"] == "pdf_tool":
+                        output = event["data"].get("output")
+                        pdf_status_data = parse_pdf_tool_output(getattr(output, "content", output))
+                        yield sse_event("pdf_info", pdf_status_data)
+
+            total_ms = (time.perf_counter() - started_at) * 1000
+            if not budget.exhausted_reason: # A forced answer may be incomplete - don't serve it again
+                semantic_cache.store(cache_key, final_message_content, total_ms, used_pdf_tool=pdf_status_data is not None)
+
+            record_turn(session, user_question, final_message_content)
+            await sync_to_async(save_session)(session)
+            if files:
+                persistence.save_report(session, files)
+            persistence.save_turn(session, user_question, final_message_content, trace=trace, streamed=True,
+                                  budget_exhausted=budget.exhausted_reason, latency_ms=total_ms,
+                                  pdf_info=pdf_status_data)
+
+            response_data = {
+                "response": final_message_content,
+                "conversation_id": str(session.id),
+                "ttft_ms": ttft_ms,
+                "total_ms": total_ms,
+            }
+            if pdf_status_data:
+                response_data["pdf_info"] = pdf_status_data
+            if budget.exhausted_reason:
+                response_data["budget"] = budget.summary()
+            if settings.TIMING_HEADER and trace is not None:
+                response_data["timings"] = trace.summary() # In place of the Server-Timing header
+            finished = True
+            yield sse_event("done", response_data)
+
+        except OPENAI_UNAVAILABLE as e:
+            print(f"OpenAI unavailable: {e!r}")
+            yield sse_event("error", {"error": SERVICE_BUSY_MESSAGE, "retry_after": openai_client.retry_after("chat")})
+            finished = True
+        except Exception as e:
+            print(traceback.format_exc())
+            yield sse_event("error", {"error": str(e)})
+            finished = True
+        finally:
+            if not finished:
+                # The client disconnected (the server cancelled or closed this generator)
+                print("Client disconnected, cancelling the run")
+                budget.cancel()
+
+    async def traced(frames):
+        with use_trace(trace):
+            async for frame in frames:
+                yield frame
+
+    response = StreamingHttpResponse(traced(event_stream()), content_type="text/event-stream")
+    response["Cache-Control"] = "no-cache"
+    response["X-Accel-Buffering"] = "no" # Stop nginx from buffering the stream
+    return response
+
+
+def metrics(request):
+    """Prometheus metrics for this worker process."""
+    return HttpResponse(render_metrics(), content_type="text/plain; version=0.0.4; charset=utf-8")
+
+
+@api_view(['GET'])
+def semantic_cache_stats(request):
+    """Hit rate and latency saved by the semantic response cache in this worker."""
+    return Response(semantic_cache.get_cache().stats())
+
+
+@api_view(['GET'])
+def pdf_job_status(request, job_id):
+    """Status of a PDF rendering job queued by pdf_tool."""
+    try:
+        job = PdfJob.objects.get(pk=job_id)
+    except PdfJob.DoesNotExist:
+        return Response({"error": "Unknown PDF job."}, status=status.HTTP_404_NOT_FOUND)
+    if job.status in (PdfJob.QUEUED, PdfJob.RUNNING):
+        pdf_jobs.recover() # Polling a job whose worker died restarts it
+    return Response(pdf_jobs.job_info(job))
@@ -23,6 +23,117 @@ BASE_DIR = Path(__file__).resolve().parent.parent
 MEDIA_URL = '/media/'  # The URL prefix for accessing media files
 MEDIA_ROOT = os.path.join(BASE_DIR, 'media') # The absolute path to the directory
 
+# RAG data and vector store locations
+RAG_DATA_DIR = os.path.join(BASE_DIR, 'RAG_data') # Research PDFs to index
+VECTORSTORE_DIR = os.path.join(BASE_DIR, 'vectorstores', 'sample_index') # Where the FAISS index is saved
+
+# Models
+CHAT_MODEL = 'gpt-4o'
+CONTEXT_WINDOW_TOKENS = 128_000 # Prompt budget for CHAT_MODEL
+RESPONSE_RESERVE_TOKENS = 4096 # Kept free in the context window for the answer
+OPENAI_PROMPT_CACHE_KEY = True # Send prompt_cache_key (hash of the report) to improve prompt cache hits
+
+# Index hot reload
+INDEX_RELOAD_CHECK_SECONDS = 5 # How often workers check whether the index on disk was replaced
+WARM_UP_ON_START = True # Load the LLM client, embeddings and index when the server starts
+
+# Embeddings
+EMBEDDING_MODEL = 'text-embedding-3-small'
+EMBEDDING_CACHE_DIR = os.path.join(BASE_DIR, 'cache', 'embeddings') # Disk cache of embedding vectors
+EMBEDDING_CACHE_MAX_ENTRIES = 200_000 # Least recently used vectors are evicted beyond this
+EMBEDDING_CACHE_FLUSH_SECONDS = 30 # How often cache hits are written to the LRU index, in the background
+EMBEDDING_BATCH_SIZE = 256 # Max texts per embedding API call
+EMBEDDING_MAX_CONCURRENCY = 4 # Max embedding API calls in flight at once
+
+# OpenAI client (see feedback_agent/openai_client.py)
+OPENAI_MAX_CONNECTIONS = 50 # Pooled HTTP connections per lane (chat, embeddings)
+OPENAI_KEEPALIVE_SECONDS = 60 # Idle pooled connections are closed after this
+OPENAI_TIMEOUT_SECONDS = 120 # Per call, retries included, unless the caller sets its own
+OPENAI_CONNECT_TIMEOUT_SECONDS = 5
+OPENAI_CHAT_MAX_CONCURRENCY = 16 # Upper bound of the chat lane's adaptive concurrency limit
+OPENAI_EMBEDDINGS_MAX_CONCURRENCY = 8 # Upper bound of the embeddings lane's limit, shared by queries and indexing
+OPENAI_BULK_SHARE = 0.5 # Share of the embeddings lane indexing may use; query embeddings always go first
+OPENAI_QUEUE_TIMEOUT_SECONDS = 30 # A call waiting longer than this for a slot fails
+OPENAI_MAX_RETRIES = 4 # Retries of 429s, 5xx responses, timeouts and connection errors
+OPENAI_BACKOFF_BASE_SECONDS = 0.5 # Retry n waits a random time up to base * 2**n ...
+OPENAI_BACKOFF_MAX_SECONDS = 20 # ... capped at this, unless the server sent retry-after
+OPENAI_BREAKER_FAILURES = 5 # Consecutive failures that open a lane's circuit
+OPENAI_BREAKER_RESET_SECONDS = 30 # How long an open circuit fails calls before trying one again
+
+# PDF ingestion
+INGESTION_MAX_WORKERS = None # Processes used to parse PDFs; None means one per CPU core
+REPORT_MAX_PAGES = 60 # Uploaded report pages passed to the LLM, across all files in a request
+REPORT_MAX_CHARS = 120_000 # Uploaded report characters passed to the LLM, across all files in a request
+
+# Report retrieval (see feedback_agent/report_index.py)
+REPORT_INLINE_MAX_TOKENS = 4000 # Reports up to this size go into the prompt whole; longer ones are searched with report_tool
+REPORT_OVERVIEW_TOKENS = 800 # Opening of a long report kept in the prompt as an overview
+REPORT_RETRIEVAL_K = 6 # Report sections returned per report_tool call
+REPORT_RETRIEVAL_MAX_TOKENS = 2500 # Token budget for the sections returned by one report_tool call
+REPORT_INDEX_CACHE_SIZE = 64 # Report indexes kept in each worker's memory
+REPORT_INDEX_BUILD_TIMEOUT_SECONDS = 10 # report_tool searches by keyword only if the index isn't ready by then
+
+# Conversation sessions
+SESSION_HISTORY_TOKEN_BUDGET = 6000 # Older turns are summarised once history grows past this
+SESSION_CACHE_SIZE = 1000 # Sessions kept in each worker's memory
+
+# Background indexing jobs (see feedback_agent/index_jobs.py)
+INDEX_CHECKPOINT_CHUNKS = 512 # Chunks embedded per batch; progress is reported after each batch
+INDEX_JOB_PROGRESS_SECONDS = 2 # How often a running job saves its progress
+INDEX_JOB_STALE_SECONDS = 30 * 60 # RUNNING jobs without a progress update for this long are assumed dead and requeued
+
+# Audit trail of reports, turns and token usage, written in the background (see feedback_agent/persistence.py)
+PERSISTENCE_ENABLED = True
+PERSISTENCE_QUEUE_SIZE = 10_000 # Turns waiting to be written; further records are dropped (and counted) when full
+PERSISTENCE_BATCH_SIZE = 200 # Records written per transaction
+PERSISTENCE_FLUSH_SECONDS = 1.0 # Longest a record waits for its batch to fill
+
+# Retention in days (see feedback_agent/retention.py); None keeps that data forever
+RETENTION_PDF_DAYS = 30 # Finished PDF jobs and their generated files
+RETENTION_CONVERSATION_DAYS = 90 # Since a conversation's last turn; its reports, turns and token usage go with it
+RETENTION_JOB_DAYS = 30 # Finished indexing jobs
+RETENTION_CLEANUP_INTERVAL_SECONDS = 6 * 3600 # How often the background writer runs the cleanup; 0 disables it
+
+# Vector index type (see feedback_agent/index_types.py); setup_vector_db can override both
+VECTOR_INDEX_TYPE = 'flat' # 'flat' (exact), 'ivf_flat', 'ivf_pq', 'hnsw' or 'sq8'
+VECTOR_INDEX_PARAMS = {} # Build options, e.g. {'nlist': 1024, 'pq_m': 96, 'train_sample': 50_000}
+VECTOR_INDEX_SEARCH_PARAMS = {'nprobe': 16, 'efSearch': 64} # IVF clusters scanned / HNSW search depth
+INDEX_COMPARE_MAX_VECTORS = 20_000 # compare_vector_indexes samples this many vectors from larger indexes
+INDEX_COMPARE_MAX_QUERIES = 200 # Queries searched per index type when comparing
+
+# Retrieval
+RETRIEVAL_K = 4 # Documents returned per query
+RETRIEVAL_MAX_DOCUMENTS = 10 # Documents returned per tool call, however many queries it has
+RETRIEVAL_FETCH_K = 20 # Candidates fetched per query before deduplication and MMR
+RETRIEVAL_MMR_LAMBDA = 0.5 # 1.0 ranks purely by relevance, lower values favour diversity
+RETRIEVAL_MAX_TOKENS = 2500 # Token budget for the documents returned by one tool call
+RETRIEVAL_DUPLICATE_THRESHOLD = 0.8 # Shingle overlap above which a chunk counts as a duplicate
+RETRIEVAL_MODE = 'hybrid' # 'hybrid' (vector + BM25 keyword search), 'dense' or 'lexical'
+RETRIEVAL_RRF_K = 60 # Reciprocal rank fusion constant; higher values flatten the rank weighting
+RETRIEVAL_EMBEDDING_TIMEOUT_SECONDS = 3 # Hybrid search falls back to keywords only past this
+
+# Execution budget per turn (see feedback_agent/budget.py)
+AGENT_MAX_STEPS = 6 # LLM calls per turn, the forced final answer included
+AGENT_MAX_TOKENS = 60_000 # Prompt + completion tokens per turn before the final answer is forced
+AGENT_MAX_TOOL_CALLS = 8 # Tool calls per turn; extra calls are skipped
+AGENT_DEADLINE_SECONDS = 90 # Wall-clock limit per turn
+AGENT_FINAL_ANSWER_RESERVE_SECONDS = 15 # Kept back from the deadline for the final answer
+
+# Tool execution
+TOOL_MAX_WORKERS = 8 # Tool calls from one LLM turn run concurrently on this many threads
+TOOL_TIMEOUT_SECONDS = 30 # Default per-tool timeout
+TOOL_TIMEOUTS = {'retriever_tool': 20, 'report_tool': 20, 'pdf_tool': 10} # Per-tool overrides
+
+# Background PDF rendering
+PDF_RENDER_WORKERS = 2 # Threads rendering summary PDFs in each server process
+PDF_JOB_STALE_SECONDS = 10 * 60 # RUNNING jobs older than this are assumed dead and requeued
+
+# Semantic response cache (opening questions about the same report)
+SEMANTIC_CACHE_ENABLED = True
+SEMANTIC_CACHE_THRESHOLD = 0.95 # Minimum cosine similarity between questions for a hit
+SEMANTIC_CACHE_TTL_SECONDS = 24 * 60 * 60
+SEMANTIC_CACHE_MAX_ENTRIES = 5000
+
 
 # Quick-start development settings - unsuitable for production
 # See https://docs.djangoproject.com/en/5.2/howto/deployment/checklist/
@@ -58,6 +169,7 @@ CORS_ORIGIN_WHITELIST = (
 
 # Add cors middleware here
 MIDDLEWARE = [
+    'feedback_agent.tracing.TimingMiddleware', # First, so it times the whole request
     'django.middleware.security.SecurityMiddleware',
     'django.contrib.sessions.middleware.SessionMiddleware',
     'django.middleware.common.CommonMiddleware',
@@ -91,10 +203,20 @@ WSGI_APPLICATION = 'kosh_feedback.wsgi.application'
 # Database
 # https://docs.djangoproject.com/en/5.2/ref/settings/#databases
 
+# WAL lets requests keep reading while the background writers commit; IMMEDIATE
+# transactions take the write lock up front, so concurrent writers wait for it
+# (up to timeout seconds) instead of failing with "database is locked"
+SQLITE_WAL = True
+
 DATABASES = {
     'default': {
         'ENGINE': 'django.db.backends.sqlite3',
         'NAME': BASE_DIR / 'db.sqlite3',
+        'OPTIONS': {
+            'timeout': 20,
+            'transaction_mode': 'IMMEDIATE',
+            **({'init_command': 'PRAGMA journal_mode=WAL; PRAGMA synchronous=NORMAL;'} if SQLITE_WAL else {}),
+        },
     }
 }
 
@@ -139,3 +261,19 @@ STATIC_URL = 'static/'
 # https://docs.djangoproject.com/en/5.2/ref/settings/#default-auto-field
 
 DEFAULT_AUTO_FIELD = 'django.db.models.BigAutoField'
+
+
+# Tracing and metrics (see feedback_agent/tracing.py); Prometheus metrics are served at /metrics
+TRACE_LOG_SPANS = True # Log every span as a JSON line on the feedback_agent.trace logger
+TIMING_HEADER = DEBUG # Per-request Server-Timing header, and timings in the stream's done event
+
+LOGGING = {
+    'version': 1,
+    'disable_existing_loggers': False,
+    'handlers': {
+        'console': {'class': 'logging.StreamHandler'},
+    },
+    'loggers': {
+        'feedback_agent.trace': {'handlers': ['console'], 'level': 'INFO', 'propagate': False},
+    },
+}
@@ -14,3 +14,10 @@ from django.core.wsgi import get_wsgi_application
 os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'kosh_feedback.settings')
 
 application = get_wsgi_application()
+
+# Load the LLM client and vector index before the first request arrives
+from django.conf import settings
+
+if settings.WARM_UP_ON_START:
+    from feedback_agent.resources import warm_up
+    warm_up()